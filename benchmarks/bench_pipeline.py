@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+本地热点路径微基准
+测量每条记录在网络之外的CPU开销（Prompt构建、请求序列化、规则预检、响应解析、JSON提取、结果验证、输出格式化），
+结果可保存为基线文件，并在后续运行中与基线比较，超出阈值时以非零状态退出
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from batch import iter_directory_records  # noqa: E402
+from openai_client import (  # noqa: E402
+    extract_json_from_content,
+    parse_openai_response,
+    validate_evaluation_result,
+)
+from prompt import build_evaluation_messages  # noqa: E402
+from rules import triage_record  # noqa: E402
+from utils import format_json_output  # noqa: E402
+
+SAMPLES_DIR = os.path.join(ROOT_DIR, 'data', 'samples')
+DEFAULT_BASELINE = os.path.join(ROOT_DIR, 'benchmarks', 'baseline.json')
+
+# 基准: (名称, 无参可调用对象)
+Benchmark = Tuple[str, Callable[[], Any]]
+
+
+def _completion(content: str) -> str:
+    """包装为Chat Completions响应体"""
+    return json.dumps({
+        'id': 'chatcmpl-bench',
+        'object': 'chat.completion',
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                     'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 800, 'completion_tokens': 300, 'total_tokens': 1100},
+    }, ensure_ascii=False)
+
+
+def _evaluation(n_items: int) -> Dict[str, Any]:
+    return {
+        'total_score': 82,
+        'risks': [f"第{i + 1}项风险：术中止血记录不完整，可能增加术后出血风险" for i in range(n_items)],
+        'suggestions': [f"第{i + 1}项建议：补充记录止血方式及出血量评估" for i in range(n_items)],
+        'risk_level': 'Medium',
+    }
+
+
+def build_benchmarks() -> List[Benchmark]:
+    """构造基准列表：样例语料 + 合成的大响应和异常响应"""
+    records = [(t, s) for _, t, s in iter_directory_records(SAMPLES_DIR)]
+    messages = [build_evaluation_messages(s, t) for t, s in records]
+    requests = [{'model': 'deepseek-chat', 'messages': m, 'temperature': 0.1, 'max_tokens': 1000}
+                for m in messages]
+
+    normal = json.dumps(_evaluation(3), ensure_ascii=False, indent=2)
+    large = json.dumps(_evaluation(200), ensure_ascii=False, indent=2)
+    fenced = f"以下是评估结果：\n```json\n{normal}\n```\n如有疑问请告知。"
+    prose = f"根据手术记录，评估如下 {normal} 以上评估仅供参考。"
+    truncated = large[:len(large) * 2 // 3]
+    validated = validate_evaluation_result(_evaluation(3))
+
+    responses = {
+        'normal': _completion(normal),
+        'large': _completion(large),
+        'fenced': _completion(fenced),
+        'prose': _completion(prose),
+    }
+
+    benchmarks: List[Benchmark] = [
+        ('build_evaluation_messages',
+         lambda: [build_evaluation_messages(s, t) for t, s in records]),
+        ('json_dumps_request',
+         lambda: [json.dumps(r).encode('utf-8') for r in requests]),
+        ('triage_record',
+         lambda: [triage_record(s, t) for t, s in records]),
+    ]
+    for name, body in responses.items():
+        benchmarks.append((f"parse_response[{name}]",
+                           lambda body=body: parse_openai_response(body)))
+    benchmarks += [
+        ('parse_response[truncated]', lambda: parse_openai_response(_completion(truncated))),
+        ('extract_json[normal]', lambda: extract_json_from_content(normal)),
+        ('extract_json[fenced]', lambda: extract_json_from_content(fenced)),
+        ('extract_json[truncated]', lambda: extract_json_from_content(truncated)),
+        ('validate_result[normal]', lambda: validate_evaluation_result(_evaluation(3))),
+        ('validate_result[large]', lambda: validate_evaluation_result(_evaluation(200))),
+        ('format_json_output', lambda: format_json_output(validated)),
+    ]
+    return benchmarks
+
+
+def measure(func: Callable[[], Any], repeat: int = 5, min_time: float = 0.2) -> float:
+    """
+    测量单次调用耗时
+
+    Args:
+        func: 被测函数
+        repeat: 重复轮数，取最快一轮
+        min_time: 每轮的最短运行时间（秒），用于自动确定循环次数
+
+    Returns:
+        float: 单次调用耗时（微秒）
+    """
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(number, int(number * min_time / max(elapsed, 1e-9)))
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number * 1e6
+
+
+def run_benchmarks(filter_text: str = '', repeat: int = 5) -> Dict[str, float]:
+    """
+    运行全部基准
+
+    Args:
+        filter_text: 仅运行名称包含该文本的基准
+        repeat: 重复轮数
+
+    Returns:
+        Dict[str, float]: 基准名称 -> 单次耗时（微秒）
+    """
+    return {
+        name: round(measure(func, repeat=repeat), 3)
+        for name, func in build_benchmarks()
+        if filter_text in name
+    }
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float],
+            threshold: float) -> List[Tuple[str, float, float, float]]:
+    """
+    与基线比较
+
+    Args:
+        results: 本次结果
+        baseline: 基线结果
+        threshold: 允许的相对变慢比例（如0.2表示20%）
+
+    Returns:
+        List[Tuple[str, float, float, float]]: 超出阈值的 (名称, 基线, 本次, 变化比例)
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        change = current / previous - 1
+        if change > threshold:
+            regressions.append((name, previous, current, change))
+    return regressions
+
+
+def format_results(results: Dict[str, float], baseline: Dict[str, float]) -> str:
+    """格式化结果表格（有基线时显示变化比例）"""
+    width = max(len(name) for name in results) + 2
+    lines = [f"{'基准':<{width - 2}}{'耗时(us)':>10}{'基线(us)':>10}{'变化':>9}"]
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous:
+            lines.append(f"{name:<{width}}{current:>12.2f}{previous:>12.2f}"
+                         f"{current / previous - 1:>+11.1%}")
+        else:
+            lines.append(f"{name:<{width}}{current:>12.2f}{'-':>12}{'-':>11}")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="本地热点路径微基准")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果保存为基线")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="允许的相对变慢比例，超出时返回非零状态 (默认: 0.25)")
+    parser.add_argument("--filter", default='', help="仅运行名称包含该文本的基准")
+    parser.add_argument("--repeat", type=int, default=5, help="重复轮数 (默认: 5)")
+    args = parser.parse_args()
+
+    baseline: Dict[str, float] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+
+    results = run_benchmarks(args.filter, args.repeat)
+    print(format_results(results, baseline))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n基线已保存到: {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n以下基准相对基线变慢超过 {args.threshold:.0%}:")
+        for name, previous, current, change in regressions:
+            print(f"  {name}: {previous:.2f}us -> {current:.2f}us ({change:+.1%})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
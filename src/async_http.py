@@ -0,0 +1,300 @@
+"""
+异步HTTP传输模块
+基于asyncio流实现的非阻塞HTTP/1.1客户端，按主机复用keep-alive连接，仅依赖标准库
+"""
+
+import asyncio
+import http.client
+import ssl
+import time
+import urllib.parse
+import weakref
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+try:
+    from .http_pool import PooledResponse
+    from .metrics import observe_stage
+except ImportError:
+    from http_pool import PooledResponse
+    from metrics import observe_stage
+
+
+_Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+# 单个响应头行的最大长度，防止异常响应耗尽内存
+_MAX_LINE = 65536
+
+
+class _StaleConnection(Exception):
+    """复用的连接在收到响应前已被服务端关闭"""
+
+
+def _close_writer(writer: asyncio.StreamWriter) -> None:
+    """关闭连接，忽略已关闭或传输错误"""
+    try:
+        writer.close()
+    except (OSError, RuntimeError):
+        pass
+
+
+async def _read_line(reader: asyncio.StreamReader) -> bytes:
+    line = await reader.readline()
+    if len(line) > _MAX_LINE:
+        raise http.client.LineTooLong("响应头")
+    return line
+
+
+async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+    """读取 Transfer-Encoding: chunked 的响应体"""
+    chunks = []
+    while True:
+        size_line = await _read_line(reader)
+        try:
+            size = int(size_line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise http.client.IncompleteRead(b''.join(chunks))
+        if size == 0:
+            # 跳过trailer直到空行
+            while (await _read_line(reader)) not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+
+
+async def _read_response(reader: asyncio.StreamReader, method: str,
+                         reused: bool, sent: float) -> Tuple[PooledResponse, bool]:
+    """
+    读取完整响应，并记录首字节时间（发送时刻 ``sent`` 到响应头读完）和响应体读取耗时
+
+    Returns:
+        Tuple[PooledResponse, bool]: (响应, 连接是否可复用)
+    """
+    status_line = await _read_line(reader)
+    if not status_line:
+        if reused:
+            raise _StaleConnection()
+        raise http.client.RemoteDisconnected("服务端在返回响应前关闭了连接")
+
+    try:
+        version, status, *reason = status_line.decode('iso-8859-1').rstrip('\r\n').split(' ', 2)
+        status = int(status)
+    except ValueError:
+        raise http.client.BadStatusLine(status_line)
+
+    headers: Dict[str, str] = {}
+    while True:
+        line = await _read_line(reader)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('iso-8859-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    headers_read = time.perf_counter()
+    observe_stage('ttfb', headers_read - sent)
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+    if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+        data = b''
+    elif 'chunked' in headers.get('transfer-encoding', '').lower():
+        data = await _read_chunked(reader)
+    elif 'content-length' in headers:
+        data = await reader.readexactly(int(headers['content-length']))
+    else:
+        # 没有长度信息，读到连接关闭为止
+        data = await reader.read()
+        keep_alive = False
+    observe_stage('body_read', time.perf_counter() - headers_read)
+
+    return PooledResponse(status, reason[0] if reason else '', headers, data), keep_alive
+
+
+class AsyncConnectionPool:
+    """
+    单个主机的异步持久连接池
+
+    连接绑定到创建它的事件循环；请求被取消或超时时连接直接关闭，不会归还到池中。
+    """
+
+    def __init__(self, scheme: str, host: str, port: Optional[int] = None,
+                 maxsize: int = 10, idle_timeout: float = 60.0,
+                 ssl_context: Optional[ssl.SSLContext] = None):
+        """
+        Args:
+            scheme: http 或 https
+            host: 目标主机
+            port: 目标端口，默认按scheme确定
+            maxsize: 最多保留的空闲连接数
+            idle_timeout: 空闲连接的最长保留时间（秒）
+            ssl_context: HTTPS使用的SSL上下文
+        """
+        if scheme not in ('http', 'https'):
+            raise ValueError(f"不支持的URL协议: {scheme}")
+        self.scheme = scheme
+        self.host = host
+        self.port = port or (443 if scheme == 'https' else 80)
+        self.maxsize = max(1, maxsize)
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        self._idle: Deque[Tuple[_Connection, float]] = deque()
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    async def _get_conn(self) -> Tuple[_Connection, bool]:
+        now = time.monotonic()
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            reader, writer = conn
+            if now - last_used <= self.idle_timeout and not reader.at_eof() \
+                    and not writer.is_closing():
+                self.connections_reused += 1
+                return conn, True
+            _close_writer(writer)
+
+        self.connections_created += 1
+        start = time.perf_counter()
+        conn = await asyncio.open_connection(
+            self.host, self.port,
+            ssl=self.ssl_context if self.scheme == 'https' else None,
+            limit=_MAX_LINE * 2,
+        )
+        observe_stage('connect', time.perf_counter() - start)
+        return conn, False
+
+    def _put_conn(self, conn: _Connection) -> None:
+        if len(self._idle) < self.maxsize:
+            self._idle.append((conn, time.monotonic()))
+        else:
+            _close_writer(conn[1])
+
+    async def request(self, method: str, path: str, body: Optional[bytes] = None,
+                      headers: Optional[Dict[str, str]] = None) -> PooledResponse:
+        """
+        发送请求并完整读取响应（超时由调用方通过 asyncio.timeout 控制）
+
+        Args:
+            method: HTTP方法
+            path: 请求路径（含查询字符串）
+            body: 请求体
+            headers: 请求头
+
+        Returns:
+            PooledResponse: 响应对象
+        """
+        body = body or b''
+        default_port = 443 if self.scheme == 'https' else 80
+        host = self.host if self.port == default_port else f"{self.host}:{self.port}"
+        head = [f"{method} {path} HTTP/1.1", f"Host: {host}"]
+        for name, value in (headers or {}).items():
+            head.append(f"{name}: {value}")
+        head.append(f"Content-Length: {len(body)}")
+        payload = ("\r\n".join(head) + "\r\n\r\n").encode('utf-8') + body
+
+        while True:
+            conn, reused = await self._get_conn()
+            reader, writer = conn
+            try:
+                sent = time.perf_counter()
+                writer.write(payload)
+                await writer.drain()
+                response, keep_alive = await _read_response(reader, method, reused, sent)
+            except (_StaleConnection, ConnectionResetError, BrokenPipeError):
+                _close_writer(writer)
+                if reused:
+                    # 复用的连接已失效，换新连接重试
+                    continue
+                raise
+            except BaseException:
+                # 包括取消和超时：连接状态未知，直接关闭
+                _close_writer(writer)
+                raise
+
+            if keep_alive:
+                self._put_conn(conn)
+            else:
+                _close_writer(writer)
+            return response
+
+    def close(self) -> None:
+        """关闭所有空闲连接"""
+        while self._idle:
+            (_, writer), _ = self._idle.pop()
+            _close_writer(writer)
+
+
+class AsyncPoolManager:
+    """按 (scheme, host, port) 管理当前事件循环内的异步连接池"""
+
+    def __init__(self, maxsize: int = 10, idle_timeout: float = 60.0):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._pools: Dict[Tuple[str, str, int], AsyncConnectionPool] = {}
+        self._ssl_context = ssl.create_default_context()
+
+    def connection_pool(self, url: str) -> AsyncConnectionPool:
+        """获取URL对应主机的连接池，不存在时创建"""
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname or '', port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = AsyncConnectionPool(
+                scheme, key[1], port,
+                maxsize=self.maxsize,
+                idle_timeout=self.idle_timeout,
+                ssl_context=self._ssl_context,
+            )
+            self._pools[key] = pool
+        return pool
+
+    async def request(self, method: str, url: str, body: Optional[bytes] = None,
+                      headers: Optional[Dict[str, str]] = None) -> PooledResponse:
+        """
+        通过对应主机的连接池发送请求
+
+        Args:
+            method: HTTP方法
+            url: 完整URL
+            body: 请求体
+            headers: 请求头
+
+        Returns:
+            PooledResponse: 响应对象
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        return await self.connection_pool(url).request(method, path, body, headers)
+
+    def clear(self) -> None:
+        """关闭所有连接池"""
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+
+
+# 异步连接绑定事件循环，因此每个事件循环各有一个连接池管理器
+_managers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncPoolManager]" = \
+    weakref.WeakKeyDictionary()
+
+
+def get_async_pool_manager(maxsize: int = 10, idle_timeout: float = 60.0) -> AsyncPoolManager:
+    """
+    获取当前事件循环共享的异步连接池管理器（首次调用时按参数创建）
+
+    Args:
+        maxsize: 每个主机最多保留的空闲连接数
+        idle_timeout: 空闲连接的最长保留时间（秒）
+
+    Returns:
+        AsyncPoolManager: 当前事件循环的连接池管理器
+    """
+    loop = asyncio.get_running_loop()
+    manager = _managers.get(loop)
+    if manager is None:
+        manager = AsyncPoolManager(maxsize=maxsize, idle_timeout=idle_timeout)
+        _managers[loop] = manager
+    return manager
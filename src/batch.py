@@ -0,0 +1,599 @@
+"""
+批量评估模块
+支持目录/清单/JSONL/CSV输入，在有界线程池上并发执行评估，并逐条写出JSONL结果
+"""
+
+import csv
+import gzip
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple, TypeVar, Union
+
+try:
+    from .prompt import SURGERY_TYPES
+    from .utils import read_file_content
+    from .journal import BatchJournal
+except ImportError:
+    from prompt import SURGERY_TYPES
+    from utils import read_file_content
+    from journal import BatchJournal
+
+
+# 批量记录: (record_id, surgery_type, surgery_steps)
+BatchRecord = Tuple[str, str, str]
+
+# 打包评估函数: 记录列表 -> 与记录一一对应的评估结果或异常
+GroupEvaluateFn = Callable[[List[BatchRecord]], List[Union[Dict[str, Any], Exception]]]
+
+T = TypeVar('T')
+
+# 批量输入类型，与命令行参数 --dir/--manifest/--jsonl/--csv 对应
+BATCH_INPUTS = ('dir', 'manifest', 'jsonl', 'csv')
+
+# JSONL/CSV 导出中 记录ID、手术类型、手术步骤 的默认字段名
+DEFAULT_FIELDS = ('id', 'type', 'text')
+
+# CSV单个字段的最大字符数（标准库默认131072，长篇手术记录可能超出）
+CSV_FIELD_SIZE_LIMIT = 16 * 1024 * 1024
+
+
+def infer_surgery_type(file_name: str, default: str = "general") -> str:
+    """
+    根据文件名前缀推断手术类型（如 appendectomy_01.txt -> appendectomy）
+
+    Args:
+        file_name: 文件名或路径
+        default: 无法推断时使用的手术类型
+
+    Returns:
+        str: 手术类型
+    """
+    stem = os.path.splitext(os.path.basename(file_name))[0].lower()
+    # 长名称优先，避免前缀相互覆盖
+    for surgery_type in sorted(SURGERY_TYPES, key=len, reverse=True):
+        if stem.startswith(surgery_type):
+            return surgery_type
+    return default
+
+
+def resolve_surgery_type(value: Any) -> Optional[str]:
+    """
+    将输入中的手术类型映射为 SURGERY_TYPES 的键
+
+    接受键本身（不区分大小写）或中文名称，名称可带术式前缀（如"腹腔镜胆囊切除术" -> cholecystectomy）
+
+    Args:
+        value: 输入中的手术类型
+
+    Returns:
+        Optional[str]: 手术类型键，无法识别时为None
+    """
+    text = str(value).strip()
+    if text.lower() in SURGERY_TYPES:
+        return text.lower()
+    # 长名称优先，避免名称相互覆盖
+    for surgery_type, name in sorted(SURGERY_TYPES.items(), key=lambda item: len(item[1]), reverse=True):
+        if name in text:
+            return surgery_type
+    return None
+
+
+def _checked_type(value: Any, default_type: str, unknown: Set[str], source: str) -> str:
+    """校验输入中的手术类型，无法识别时使用 default_type（每个未知类型只警告一次）"""
+    if not value:
+        return default_type
+    surgery_type = resolve_surgery_type(value)
+    if surgery_type is None:
+        value = str(value)
+        if value not in unknown:
+            unknown.add(value)
+            print(f"警告: {source} 中的未知手术类型 '{value}' 按 {default_type} 评估", file=sys.stderr)
+        return default_type
+    return surgery_type
+
+
+def _read_record(record_id: str, path: str, surgery_type: str) -> Iterator[BatchRecord]:
+    """读取单个文件记录，读取失败时打印警告并跳过"""
+    try:
+        yield record_id, surgery_type, read_file_content(path)
+    except (FileNotFoundError, IOError) as e:
+        print(f"警告: 跳过无法读取的记录 {record_id}: {e}", file=sys.stderr)
+
+
+def iter_directory_records(directory: str, default_type: str = "general") -> Iterator[BatchRecord]:
+    """
+    遍历目录下的 .txt 手术记录（按文件名排序，不递归）
+
+    Args:
+        directory: 目录路径
+        default_type: 文件名无法推断类型时使用的手术类型
+
+    Yields:
+        BatchRecord: (记录ID, 手术类型, 手术步骤)
+    """
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"目录未找到: {directory}")
+
+    names = sorted(
+        entry.name for entry in os.scandir(directory)
+        if entry.is_file() and entry.name.endswith('.txt')
+    )
+    for name in names:
+        path = os.path.join(directory, name)
+        yield from _read_record(name, path, infer_surgery_type(name, default_type))
+
+
+def iter_manifest_records(manifest_path: str, default_type: str = "general") -> Iterator[BatchRecord]:
+    """
+    遍历清单文件中的记录
+
+    清单每行一条记录，支持两种格式（空行和 # 开头的行被忽略）:
+      - 纯文本: ``路径 [手术类型]``，相对路径以清单所在目录为基准
+      - JSON: ``{"id": "...", "file": "...", "type": "..."}`` 或以 ``text`` 代替 ``file``
+
+    Args:
+        manifest_path: 清单文件路径
+        default_type: 未指定类型时使用的手术类型
+
+    Yields:
+        BatchRecord: (记录ID, 手术类型, 手术步骤)
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    unknown: Set[str] = set()
+
+    try:
+        f = open(manifest_path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        raise FileNotFoundError(f"清单文件未找到: {manifest_path}")
+
+    with f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            if line.startswith('{'):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    print(f"警告: 清单第{line_no}行JSON无效，已跳过: {e}", file=sys.stderr)
+                    continue
+                path = entry.get('file')
+                record_id = str(entry.get('id') or path or f"line-{line_no}")
+                if entry.get('type'):
+                    surgery_type = _checked_type(entry['type'], default_type, unknown, manifest_path)
+                else:
+                    surgery_type = infer_surgery_type(path, default_type) if path else default_type
+                if 'text' in entry:
+                    yield record_id, surgery_type, str(entry['text'])
+                    continue
+                if not path:
+                    print(f"警告: 清单第{line_no}行缺少 file 或 text 字段，已跳过", file=sys.stderr)
+                    continue
+            else:
+                parts = line.rsplit(None, 1)
+                if len(parts) == 2 and parts[1] in SURGERY_TYPES:
+                    path, surgery_type = parts
+                else:
+                    path = line
+                    surgery_type = infer_surgery_type(path, default_type)
+                record_id = path
+
+            full_path = path if os.path.isabs(path) else os.path.join(base_dir, path)
+            yield from _read_record(record_id, full_path, surgery_type)
+
+
+def parse_fields(spec: str) -> Tuple[str, str, str]:
+    """
+    解析字段映射 ``ID字段,类型字段,文本字段``（空项使用默认字段名）
+
+    Args:
+        spec: 如 ``case_no,op_type,op_note`` 或 ``,,note``
+
+    Returns:
+        Tuple[str, str, str]: (ID字段, 类型字段, 文本字段)
+
+    Raises:
+        ValueError: 格式不正确
+    """
+    parts = [part.strip() for part in spec.split(',')]
+    if len(parts) != 3:
+        raise ValueError(f"字段映射需为 \"ID字段,类型字段,文本字段\": {spec}")
+    return tuple(part or default for part, default in zip(parts, DEFAULT_FIELDS))
+
+
+def _open_export(path: str, **kwargs) -> TextIO:
+    """以文本方式打开导出文件（.gz 结尾时透明解压），utf-8-sig 兼容带BOM的导出"""
+    opener = gzip.open if path.endswith('.gz') else open
+    try:
+        return opener(path, 'rt', encoding='utf-8-sig', **kwargs)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"导出文件未找到: {path}")
+
+
+def _export_record(entry: Dict[str, Any], fields: Tuple[str, str, str], path: str,
+                   location: str, default_type: str, unknown: Set[str]) -> Optional[BatchRecord]:
+    """
+    将一条导出记录映射为 BatchRecord（缺少ID时以位置代替，手术类型经 resolve_surgery_type 校验），
+    缺少文本时打印警告并返回None
+    """
+    id_field, type_field, text_field = fields
+    text = entry.get(text_field)
+    if text is None or text == '':
+        print(f"警告: {path} {location} 缺少 {text_field} 字段，已跳过", file=sys.stderr)
+        return None
+    record_id = str(entry.get(id_field) or location)
+    return record_id, _checked_type(entry.get(type_field), default_type, unknown, path), str(text)
+
+
+def iter_jsonl_records(path: str, default_type: str = "general",
+                       fields: Tuple[str, str, str] = DEFAULT_FIELDS) -> Iterator[BatchRecord]:
+    """
+    流式读取JSONL导出（每行一个JSON对象，一次只解析一行）
+
+    Args:
+        path: JSONL文件路径（支持 .gz）
+        default_type: 记录未指定类型时使用的手术类型
+        fields: (ID字段, 类型字段, 文本字段)
+
+    Yields:
+        BatchRecord: (记录ID, 手术类型, 手术步骤)
+    """
+    unknown: Set[str] = set()
+    with _open_export(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"警告: {path} 第{line_no}行JSON无效，已跳过: {e}", file=sys.stderr)
+                continue
+            if not isinstance(entry, dict):
+                print(f"警告: {path} 第{line_no}行不是JSON对象，已跳过", file=sys.stderr)
+                continue
+            record = _export_record(entry, fields, path, f"line-{line_no}", default_type, unknown)
+            if record is not None:
+                yield record
+
+
+def iter_csv_records(path: str, default_type: str = "general",
+                     fields: Tuple[str, str, str] = DEFAULT_FIELDS) -> Iterator[BatchRecord]:
+    """
+    流式读取CSV导出（首行为表头，.tsv 按制表符分隔；字段内可含换行）
+
+    Args:
+        path: CSV/TSV文件路径（支持 .gz）
+        default_type: 记录未指定类型时使用的手术类型
+        fields: (ID字段, 类型字段, 文本字段)
+
+    Yields:
+        BatchRecord: (记录ID, 手术类型, 手术步骤)
+
+    Raises:
+        ValueError: 表头中没有文本字段
+    """
+    csv.field_size_limit(max(csv.field_size_limit(), CSV_FIELD_SIZE_LIMIT))
+    delimiter = '\t' if path.endswith(('.tsv', '.tsv.gz')) else ','
+    unknown: Set[str] = set()
+    with _open_export(path, newline='') as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        if fields[2] not in (reader.fieldnames or []):
+            raise ValueError(f"CSV表头中没有文本字段 {fields[2]}: {path}")
+        for row_no, row in enumerate(reader, 1):
+            record = _export_record(row, fields, path, f"row-{row_no}", default_type, unknown)
+            if record is not None:
+                yield record
+
+
+def batch_input(args) -> Optional[Tuple[str, str]]:
+    """
+    从命令行参数中取出批量输入
+
+    Args:
+        args: 含 --dir/--manifest/--jsonl/--csv 中若干参数的命令行参数
+
+    Returns:
+        Optional[Tuple[str, str]]: (输入类型, 路径)；非批量输入时返回None
+    """
+    for kind in BATCH_INPUTS:
+        path = getattr(args, kind, None)
+        if path:
+            return kind, path
+    return None
+
+
+def open_batch_records(kind: str, path: str, default_type: str = "general",
+                       fields: Tuple[str, str, str] = DEFAULT_FIELDS) -> Iterator[BatchRecord]:
+    """
+    按输入类型打开记录迭代器（均为惰性读取）
+
+    Args:
+        kind: BATCH_INPUTS 之一
+        path: 目录或文件路径
+        default_type: 无法确定类型时使用的手术类型
+        fields: JSONL/CSV 的 (ID字段, 类型字段, 文本字段)
+
+    Returns:
+        Iterator[BatchRecord]: 记录迭代器
+    """
+    if kind == 'dir':
+        return iter_directory_records(path, default_type)
+    if kind == 'manifest':
+        return iter_manifest_records(path, default_type)
+    if kind == 'jsonl':
+        return iter_jsonl_records(path, default_type, fields)
+    if kind == 'csv':
+        return iter_csv_records(path, default_type, fields)
+    raise ValueError(f"未知的批量输入类型: {kind}")
+
+
+_PREFETCH_DONE = object()
+
+
+def prefetch(items: Iterable[T], size: int) -> Iterator[T]:
+    """
+    在后台线程中读取 ``items``，经容量为 ``size`` 的有界队列交给调用方
+
+    读取（磁盘IO、解压、解析）与评估重叠进行；队列满时读取线程阻塞，
+    因此预读的记录数不超过 ``size``。读取中的异常在调用方重新抛出。
+
+    Args:
+        items: 源迭代器
+        size: 队列容量
+
+    Yields:
+        T: 源迭代器的元素（顺序不变）
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=max(1, size))
+    stopped = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read() -> None:
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((_PREFETCH_DONE, None))
+        except BaseException as e:
+            put((_PREFETCH_DONE, e))
+
+    reader = threading.Thread(target=read, name='batch-prefetch', daemon=True)
+    reader.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _PREFETCH_DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # 调用方提前结束（异常或中断）时让读取线程退出
+        stopped.set()
+
+
+def _evaluate_record(evaluate_fn: Callable[[str, str], Dict[str, Any]],
+                     record: BatchRecord) -> Dict[str, Any]:
+    """执行单条评估，将结果或错误封装为一行输出"""
+    record_id, surgery_type, surgery_steps = record
+    start = time.perf_counter()
+    line: Dict[str, Any] = {'id': record_id, 'surgery_type': surgery_type}
+    try:
+        line['status'] = 'ok'
+        line['result'] = evaluate_fn(surgery_steps, surgery_type)
+    except Exception as e:
+        line['status'] = 'error'
+        line['error'] = str(e)
+    line['elapsed'] = round(time.perf_counter() - start, 3)
+    return line
+
+
+def _evaluate_group(evaluate_group_fn: GroupEvaluateFn,
+                    group: List[BatchRecord]) -> List[Dict[str, Any]]:
+    """执行一组记录的打包评估，逐条封装为输出行（elapsed为整组耗时）"""
+    start = time.perf_counter()
+    try:
+        outcomes = evaluate_group_fn(group)
+    except Exception as e:
+        outcomes = [e] * len(group)
+    elapsed = round(time.perf_counter() - start, 3)
+
+    lines = []
+    for (record_id, surgery_type, _), outcome in zip(group, outcomes):
+        line: Dict[str, Any] = {'id': record_id, 'surgery_type': surgery_type}
+        if isinstance(outcome, Exception):
+            line['status'] = 'error'
+            line['error'] = str(outcome)
+        else:
+            line['status'] = 'ok'
+            line['result'] = outcome
+        line['elapsed'] = elapsed
+        lines.append(line)
+    return lines
+
+
+def _chunks(records: Iterable[BatchRecord], size: int) -> Iterator[List[BatchRecord]]:
+    """按固定大小分组（最后一组可能不足）"""
+    group: List[BatchRecord] = []
+    for record in records:
+        group.append(record)
+        if len(group) >= size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+class _ResultWriter:
+    """逐行写出JSONL结果并累计汇总（只在消费记录的线程中调用）"""
+
+    def __init__(self, output: TextIO):
+        self.output = output
+        self.summary: Dict[str, Any] = {'total': 0, 'succeeded': 0, 'failed': 0}
+
+    def write(self, lines: Iterable[Dict[str, Any]], flush: bool = True) -> None:
+        for line in lines:
+            self.summary['total'] += 1
+            self.summary['succeeded' if line['status'] == 'ok' else 'failed'] += 1
+            self.output.write(json.dumps(line, ensure_ascii=False) + "\n")
+        if flush:
+            self.output.flush()
+
+    def replay(self, line: Dict[str, Any]) -> None:
+        """写出恢复运行时已完成记录的原输出行（不逐行flush，随下一批结果一起落到输出）"""
+        self.write((line,), flush=False)
+
+
+def _run_tasks(items: Iterable[T], task: Callable[[T], List[Dict[str, Any]]],
+               writer: _ResultWriter, workers: int, max_pending: int) -> Dict[str, Any]:
+    """
+    在有界线程池上执行任务，每个任务完成后立即写出其输出行，返回汇总信息
+
+    恢复运行时 items 在迭代中经 ``writer.replay`` 直接写出已完成记录的行，同样计入汇总
+    """
+    workers = max(1, workers)
+    max_pending = max_pending or workers * 2
+    start = time.perf_counter()
+
+    def write_completed(pending: Set[Future]) -> Set[Future]:
+        done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            writer.write(future.result())
+        return not_done
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: Set[Future] = set()
+        for item in items:
+            if len(pending) >= max_pending:
+                pending = write_completed(pending)
+            pending.add(executor.submit(task, item))
+        while pending:
+            pending = write_completed(pending)
+    writer.output.flush()
+
+    summary = writer.summary
+    elapsed = time.perf_counter() - start
+    summary['elapsed_seconds'] = round(elapsed, 3)
+    summary['throughput'] = round(summary['total'] / elapsed, 3) if elapsed > 0 else 0.0
+    return summary
+
+
+def _journal_lines(journal: Optional[BatchJournal], records: List[BatchRecord],
+                   lines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """在工作线程中将评估完成的记录追加到日志（写出结果之前），返回原输出行"""
+    if journal is not None:
+        for record, line in zip(records, lines):
+            journal.append(record, line)
+    return lines
+
+
+def _resume(records: Iterable[BatchRecord], journal: Optional[BatchJournal],
+            replay: Callable[[Dict[str, Any]], None]) -> Iterable[BatchRecord]:
+    """恢复运行时跳过日志中已成功的记录"""
+    return records if journal is None else journal.skip_completed(records, replay)
+
+
+def _finish_summary(summary: Dict[str, Any], journal: Optional[BatchJournal]) -> Dict[str, Any]:
+    if journal is not None:
+        summary['resumed'] = journal.resumed
+    return summary
+
+
+def run_batch(records: Iterable[BatchRecord],
+              evaluate_fn: Callable[[str, str], Dict[str, Any]],
+              output: TextIO,
+              workers: int = 4,
+              max_pending: int = 0,
+              journal: Optional[BatchJournal] = None) -> Dict[str, Any]:
+    """
+    在有界线程池上并发评估多条记录，每条记录完成后立即写出一行JSONL
+
+    在途任务数不超过 ``max_pending``（默认 2 * workers），记录由后台线程经同等容量的
+    有界队列预读，因此无论输入多大，内存中只保留少量待评估记录，输出也随完成逐行写出。
+
+    Args:
+        records: 记录迭代器
+        evaluate_fn: 评估函数，签名同 evaluate_surgery_steps(steps, type)
+        output: JSONL输出流
+        workers: 并发工作线程数
+        max_pending: 最大在途任务数
+        journal: 批量评估日志（可选）；日志中已成功的记录不再评估，直接写出原输出行
+
+    Returns:
+        Dict[str, Any]: 汇总信息（总数、成功数、失败数、耗时、吞吐量；使用日志时另含恢复数）
+    """
+    writer = _ResultWriter(output)
+    summary = _run_tasks(
+        _resume(prefetch(records, max_pending or workers * 2), journal, writer.replay),
+        lambda record: _journal_lines(journal, [record], [_evaluate_record(evaluate_fn, record)]),
+        writer, workers, max_pending,
+    )
+    return _finish_summary(summary, journal)
+
+
+def run_packed_batch(records: Iterable[BatchRecord],
+                     evaluate_group_fn: GroupEvaluateFn,
+                     output: TextIO,
+                     pack_size: int,
+                     workers: int = 4,
+                     max_pending: int = 0,
+                     journal: Optional[BatchJournal] = None) -> Dict[str, Any]:
+    """
+    将记录按 ``pack_size`` 分组，每组以一次打包请求评估，并发执行
+
+    Args:
+        records: 记录迭代器
+        evaluate_group_fn: 打包评估函数，返回与记录一一对应的结果或异常
+        output: JSONL输出流
+        pack_size: 每组记录数
+        workers: 并发工作线程数（每个线程处理一组）
+        max_pending: 最大在途组数
+        journal: 批量评估日志（可选），已成功的记录在分组前跳过
+
+    Returns:
+        Dict[str, Any]: 汇总信息（总数、成功数、失败数、耗时、吞吐量；使用日志时另含恢复数）
+    """
+    writer = _ResultWriter(output)
+    summary = _run_tasks(
+        _chunks(_resume(prefetch(records, (max_pending or workers * 2) * max(1, pack_size)),
+                        journal, writer.replay), max(1, pack_size)),
+        lambda group: _journal_lines(journal, group, _evaluate_group(evaluate_group_fn, group)),
+        writer, workers, max_pending,
+    )
+    return _finish_summary(summary, journal)
+
+
+def format_batch_summary(summary: Dict[str, Any]) -> str:
+    """
+    格式化批量评估汇总信息
+
+    Args:
+        summary: run_batch 返回的汇总字典
+
+    Returns:
+        str: 可读的汇总文本
+    """
+    return (
+        "=== 批量评估摘要 ===\n"
+        f"记录总数: {summary['total']}\n"
+        f"成功: {summary['succeeded']}\n"
+        f"失败: {summary['failed']}\n"
+        f"耗时: {summary['elapsed_seconds']:.2f} 秒\n"
+        f"吞吐量: {summary['throughput']:.2f} 条/秒"
+        + (f"\n从日志恢复: {summary['resumed']}" if summary.get('resumed') else "")
+    )
@@ -0,0 +1,423 @@
+"""
+离线批处理模块
+将评估请求渲染为JSONL批处理文件，通过 /v1/files 和 /v1/batches 异步提交，
+轮询完成后下载结果并逐行解析；作业状态保存在状态文件中，中断后可继续
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, TextIO, Tuple
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from .openai_client import (
+        http_error, network_error, parse_openai_response, resolve_config, send_with_retries,
+        api_base_url, api_headers, chat_request_body
+    )
+    from .prompt import build_evaluation_messages, SURGERY_TYPES
+    from .batch import BatchRecord, DEFAULT_FIELDS, batch_input, open_batch_records, parse_fields
+    from .http_pool import PooledResponse, get_pool_manager
+    from .utils import AppConfig
+except ImportError:
+    from openai_client import (
+        http_error, network_error, parse_openai_response, resolve_config, send_with_retries,
+        api_base_url, api_headers, chat_request_body
+    )
+    from prompt import build_evaluation_messages, SURGERY_TYPES
+    from batch import BatchRecord, DEFAULT_FIELDS, batch_input, open_batch_records, parse_fields
+    from http_pool import PooledResponse, get_pool_manager
+    from utils import AppConfig
+
+
+CHAT_ENDPOINT = '/v1/chat/completions'
+
+# 批处理的终止状态
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class BatchClient:
+    """/v1/files 与 /v1/batches 接口的客户端（共享连接池，瞬时错误自动重试）"""
+
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.base_url = api_base_url(config)
+        self.pool = get_pool_manager(maxsize=config.pool_size, idle_timeout=config.pool_idle_timeout)
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None,
+                 content_type: str = 'application/json', timeout: float = 120) -> PooledResponse:
+        headers = api_headers(self.config)
+        headers['Content-Type'] = content_type
+        url = f"{self.base_url}{path}"
+
+        def send() -> PooledResponse:
+            try:
+                response = self.pool.request(method, url, body=body, headers=headers, timeout=timeout)
+            except (OSError, http.client.HTTPException) as e:
+                raise network_error(e)
+            if response.status != 200:
+                raise http_error(response.status, response.text(), response.headers)
+            return response
+
+        return send_with_retries(send, self.config, 0)
+
+    def _json(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        return json.loads(self._request(method, path, body).text())
+
+    def upload_file(self, path: str, purpose: str = 'batch') -> Dict[str, Any]:
+        """
+        以multipart/form-data上传文件
+
+        Args:
+            path: 本地文件路径
+            purpose: 文件用途
+
+        Returns:
+            Dict[str, Any]: 文件对象（含 id）
+        """
+        boundary = uuid.uuid4().hex
+        with open(path, 'rb') as f:
+            content = f.read()
+        body = b''.join([
+            f'--{boundary}\r\nContent-Disposition: form-data; name="purpose"\r\n\r\n{purpose}\r\n'.encode(),
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+            f'filename="{os.path.basename(path)}"\r\nContent-Type: application/jsonl\r\n\r\n'.encode(),
+            content,
+            f'\r\n--{boundary}--\r\n'.encode(),
+        ])
+        response = self._request('POST', '/files', body, f'multipart/form-data; boundary={boundary}')
+        return json.loads(response.text())
+
+    def download_file(self, file_id: str) -> bytes:
+        """下载文件内容"""
+        return self._request('GET', f'/files/{file_id}/content').data
+
+    def create_batch(self, input_file_id: str, completion_window: str = '24h',
+                     metadata: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """创建批处理作业"""
+        return self._json('POST', '/batches', {
+            'input_file_id': input_file_id,
+            'endpoint': CHAT_ENDPOINT,
+            'completion_window': completion_window,
+            'metadata': metadata or {},
+        })
+
+    def retrieve_batch(self, batch_id: str) -> Dict[str, Any]:
+        """查询批处理作业"""
+        return self._json('GET', f'/batches/{batch_id}')
+
+    def cancel_batch(self, batch_id: str) -> Dict[str, Any]:
+        """取消批处理作业"""
+        return self._json('POST', f'/batches/{batch_id}/cancel')
+
+
+def render_batch_file(records: Iterable[BatchRecord], path: str, config: AppConfig,
+                      model: Optional[str] = None) -> Dict[str, Tuple[str, str]]:
+    """
+    将评估请求渲染为批处理JSONL文件
+
+    Args:
+        records: (记录ID, 手术类型, 手术步骤) 序列
+        path: 输出的JSONL文件路径
+        config: 运行配置
+        model: 模型名称，默认使用配置中的 OPENAI_MODEL
+
+    Returns:
+        Dict[str, Tuple[str, str]]: custom_id -> (记录ID, 手术类型)；重复的记录ID以 #序号 区分
+    """
+    model = model or config.model
+    mapping: Dict[str, Tuple[str, str]] = {}
+    with open(path, 'w', encoding='utf-8') as f:
+        for record_id, surgery_type, surgery_steps in records:
+            if surgery_type not in SURGERY_TYPES:
+                surgery_type = 'general'
+            custom_id = record_id
+            suffix = 1
+            while custom_id in mapping:
+                suffix += 1
+                custom_id = f"{record_id}#{suffix}"
+            mapping[custom_id] = (record_id, surgery_type)
+            body = chat_request_body(build_evaluation_messages(surgery_steps, surgery_type), model, config)
+            f.write(json.dumps({
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': CHAT_ENDPOINT,
+                'body': body,
+            }, ensure_ascii=False) + "\n")
+    return mapping
+
+
+def _load_state(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_state(path: str, state: Dict[str, Any]) -> None:
+    """原子写入状态文件（先写临时文件再替换），中断时不会留下半个文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def submit(client: BatchClient, records: Iterable[BatchRecord], state_path: str,
+           state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    渲染、上传并创建批处理作业；每一步完成后保存状态，已完成的步骤在恢复时跳过
+
+    Args:
+        client: 批处理客户端
+        records: 记录序列（仅在尚未渲染时读取）
+        state_path: 状态文件路径
+        state: 当前状态（会被更新）
+
+    Returns:
+        Dict[str, Any]: 更新后的状态
+    """
+    if 'records' not in state:
+        input_path = state.setdefault('input_path', f"{os.path.splitext(state_path)[0]}.input.jsonl")
+        state['records'] = render_batch_file(records, input_path, client.config)
+        _save_state(state_path, state)
+        print(f"已生成批处理文件: {input_path}（{len(state['records'])} 条请求）", file=sys.stderr)
+
+    if 'input_file_id' not in state:
+        state['input_file_id'] = client.upload_file(state['input_path'])['id']
+        _save_state(state_path, state)
+        print(f"已上传: {state['input_file_id']}", file=sys.stderr)
+
+    if 'batch_id' not in state:
+        batch = client.create_batch(state['input_file_id'], metadata={'source': 'hospital-agent'})
+        state['batch_id'] = batch['id']
+        state['status'] = batch.get('status')
+        _save_state(state_path, state)
+        print(f"已创建批处理作业: {state['batch_id']}", file=sys.stderr)
+    return state
+
+
+def wait_for_completion(client: BatchClient, state_path: str, state: Dict[str, Any],
+                        poll_interval: float = 30.0, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    轮询批处理作业直到进入终止状态
+
+    Args:
+        client: 批处理客户端
+        state_path: 状态文件路径
+        state: 当前状态（会被更新）
+        poll_interval: 轮询间隔（秒）
+        timeout: 最长等待时间（秒），超时后抛出 TimeoutError，可稍后恢复
+
+    Returns:
+        Dict[str, Any]: 批处理作业对象
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        batch = client.retrieve_batch(state['batch_id'])
+        if batch.get('status') != state.get('status'):
+            state['status'] = batch.get('status')
+            _save_state(state_path, state)
+            counts = batch.get('request_counts') or {}
+            print(f"批处理状态: {state['status']} "
+                  f"({counts.get('completed', 0)}/{counts.get('total', 0)} 完成，"
+                  f"{counts.get('failed', 0)} 失败)", file=sys.stderr)
+        if batch.get('status') in TERMINAL_STATUSES:
+            return batch
+        if deadline is not None and time.monotonic() + poll_interval > deadline:
+            raise TimeoutError(f"批处理作业 {state['batch_id']} 未在 {timeout} 秒内完成，可稍后恢复")
+        time.sleep(poll_interval)
+
+
+def _result_line(custom_id: str, mapping: Dict[str, Tuple[str, str]],
+                 entry: Dict[str, Any]) -> Dict[str, Any]:
+    """将批处理结果的一行转换为与批量模式相同格式的输出行"""
+    record_id, surgery_type = mapping.get(custom_id, (custom_id, 'general'))
+    line: Dict[str, Any] = {'id': record_id, 'surgery_type': surgery_type}
+    response = entry.get('response') or {}
+    error = entry.get('error')
+    try:
+        if error:
+            raise Exception(f"批处理请求失败: {error.get('message') or error}")
+        if response.get('status_code') != 200:
+            raise Exception(f"批处理请求HTTP错误 {response.get('status_code')}: {response.get('body')}")
+        result = parse_openai_response(json.dumps(response['body'], ensure_ascii=False))
+    except Exception as e:
+        line['status'] = 'error'
+        line['error'] = str(e)
+    else:
+        line['status'] = 'ok'
+        line['result'] = result
+    return line
+
+
+def collect_results(client: BatchClient, batch: Dict[str, Any], mapping: Dict[str, Tuple[str, str]],
+                    output: TextIO) -> Dict[str, Any]:
+    """
+    下载结果文件和错误文件，逐行解析后写出JSONL
+
+    Args:
+        client: 批处理客户端
+        batch: 已结束的批处理作业对象
+        mapping: custom_id -> (记录ID, 手术类型)
+        output: 输出流
+
+    Returns:
+        Dict[str, Any]: 汇总信息（总数、成功数、失败数）
+    """
+    summary = {'total': 0, 'succeeded': 0, 'failed': 0}
+    seen = set()
+
+    def write(line: Dict[str, Any]) -> None:
+        summary['total'] += 1
+        summary['succeeded' if line['status'] == 'ok' else 'failed'] += 1
+        output.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    for file_key in ('output_file_id', 'error_file_id'):
+        file_id = batch.get(file_key)
+        if not file_id:
+            continue
+        for raw in client.download_file(file_id).decode('utf-8').splitlines():
+            if not raw.strip():
+                continue
+            entry = json.loads(raw)
+            custom_id = entry.get('custom_id', '')
+            if custom_id in seen:
+                continue
+            seen.add(custom_id)
+            write(_result_line(custom_id, mapping, entry))
+
+    # 结果文件中缺失的请求（如作业过期或被取消）
+    for custom_id, (record_id, surgery_type) in mapping.items():
+        if custom_id not in seen:
+            write({'id': record_id, 'surgery_type': surgery_type, 'status': 'error',
+                   'error': f"批处理结果缺失（作业状态: {batch.get('status')}）"})
+    output.flush()
+    return summary
+
+
+def run_batch_job(records: Optional[Iterable[BatchRecord]], state_path: str, output: Optional[TextIO],
+                  config: AppConfig, poll_interval: float = 30.0,
+                  timeout: Optional[float] = None, wait: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    执行或恢复一个离线批处理作业
+
+    Args:
+        records: 记录序列；恢复已有作业时必须为None
+        state_path: 状态文件路径，存在时从中恢复
+        output: 结果输出流（wait 为False时可为None）
+        config: 运行配置
+        poll_interval: 轮询间隔（秒）
+        timeout: 最长等待时间（秒）
+        wait: 为False时提交后立即返回，不等待完成
+
+    Returns:
+        Optional[Dict[str, Any]]: 汇总信息；未等待完成时返回None
+
+    Raises:
+        ValueError: 状态文件不存在且未提供记录，或状态文件已有作业却又提供了记录
+    """
+    client = BatchClient(config)
+    state = _load_state(state_path)
+    if 'records' in state and records is not None:
+        # 已渲染的作业只会按原输入恢复，新输入会被静默忽略，因此直接拒绝
+        raise ValueError(f"状态文件中已有作业，恢复时不能再指定输入: {state_path}"
+                         "（提交新作业请使用新的状态文件）")
+    if state:
+        print(f"从状态文件恢复批处理作业: {state_path}", file=sys.stderr)
+    elif records is None:
+        raise ValueError(f"状态文件不存在且未提供输入记录: {state_path}")
+
+    state = submit(client, records or [], state_path, state)
+    if not wait:
+        return None
+
+    batch = wait_for_completion(client, state_path, state, poll_interval, timeout)
+    summary = collect_results(client, batch, state['records'], output)
+    state['collected'] = True
+    _save_state(state_path, state)
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口（evaluate.py batch-api 子命令）"""
+    parser = argparse.ArgumentParser(
+        prog="evaluate.py batch-api",
+        description="通过异步批处理接口离线评估大量记录",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+使用示例:
+  python src/evaluate.py batch-api --dir data/samples --state audit.batch.json --output results.jsonl
+  python src/evaluate.py batch-api --state audit.batch.json --output results.jsonl   # 恢复
+  python src/evaluate.py batch-api --dir data/samples --state audit.batch.json --no-wait
+        """
+    )
+    input_group = parser.add_mutually_exclusive_group()
+    input_group.add_argument("--dir", "-d", help="评估目录下所有 .txt 文件")
+    input_group.add_argument("--manifest", "-m", help="清单文件")
+    input_group.add_argument("--jsonl", help="JSONL导出文件（流式读取，支持 .gz）")
+    input_group.add_argument("--csv", help="带表头的CSV导出文件（流式读取，支持 .gz）")
+    parser.add_argument("--fields", default=",".join(DEFAULT_FIELDS),
+                        help="JSONL/CSV导出的字段名 \"ID字段,类型字段,文本字段\" (默认: id,type,text)")
+    parser.add_argument("--type", "-T", default="general", choices=list(SURGERY_TYPES.keys()),
+                        help="无法推断时使用的手术类型 (默认: general)")
+    parser.add_argument("--state", required=True, help="作业状态文件，存在时恢复该作业")
+    parser.add_argument("--output", "-o", help="结果JSONL文件（默认输出到标准输出）")
+    parser.add_argument("--poll-interval", type=float, default=30.0, help="轮询间隔秒数 (默认: 30)")
+    parser.add_argument("--timeout", type=float, help="最长等待秒数，超时后可稍后恢复")
+    parser.add_argument("--no-wait", action="store_true", help="提交后立即退出")
+    parser.add_argument("--cancel", action="store_true", help="取消状态文件中的作业")
+    args = parser.parse_args(argv)
+
+    try:
+        config = resolve_config(None)
+        if args.cancel:
+            state = _load_state(args.state)
+            if not state.get('batch_id'):
+                print(f"错误: 状态文件中没有批处理作业: {args.state}", file=sys.stderr)
+                return 1
+            batch = BatchClient(config).cancel_batch(state['batch_id'])
+            print(f"批处理作业 {state['batch_id']} 状态: {batch.get('status')}", file=sys.stderr)
+            return 0
+
+        records = None
+        batch = batch_input(args)
+        if batch:
+            records = open_batch_records(*batch, args.type, parse_fields(args.fields))
+
+        if args.no_wait:
+            summary = run_batch_job(records, args.state, None, config, wait=False)
+        elif args.output:
+            with open(args.output, 'w', encoding='utf-8') as out:
+                summary = run_batch_job(records, args.state, out, config,
+                                        args.poll_interval, args.timeout)
+        else:
+            summary = run_batch_job(records, args.state, sys.stdout, config,
+                                    args.poll_interval, args.timeout)
+    except TimeoutError as e:
+        print(f"等待超时: {e}", file=sys.stderr)
+        return 2
+    except (FileNotFoundError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    except Exception as e:
+        print(f"批处理失败: {e}", file=sys.stderr)
+        return 1
+
+    if summary is None:
+        print("已提交，稍后使用相同的 --state 参数恢复并收集结果", file=sys.stderr)
+        return 0
+    print(f"批处理完成: 共 {summary['total']} 条，成功 {summary['succeeded']}，失败 {summary['failed']}",
+          file=sys.stderr)
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
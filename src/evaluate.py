@@ -4,55 +4,628 @@
 """
 
 import argparse
+import asyncio
+import functools
+import json
+import math
+import sqlite3
 import sys
 import os
-from typing import Dict, Any
+import time
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple, Union
 
 # 添加src目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from .openai_client import call_openai_api
-    from .prompt import build_evaluation_messages, validate_surgery_steps, SURGERY_TYPES
-    from .utils import read_file_content, format_json_output, load_env_config
+    from .openai_client import (
+        call_openai_api, acall_openai_api, stream_openai_api, estimate_chat_request,
+        call_openai_api_packed, chat_cache_key, request_key, get_repair_stats
+    )
+    from .prompt import (
+        build_evaluation_messages, build_packed_evaluation_messages, validate_surgery_steps, SURGERY_TYPES
+    )
+    from .utils import AppConfig, get_config, read_file_content, format_json_output, load_env_config
+    from .batch import (
+        BatchRecord, DEFAULT_FIELDS, batch_input, open_batch_records, parse_fields,
+        run_batch, run_packed_batch, format_batch_summary
+    )
+    from .journal import BatchJournal
+    from .failover import get_failover_stats, reserve_hedge_threads
+    from .cache import ResponseCache, get_default_cache
+    from .tokens import ContextLengthError, estimate_text_tokens, format_estimate, get_model_profile
+    from .mapreduce import DEFAULT_SEGMENT_TOKENS, evaluate_long_record
+    from .singleflight import AsyncSingleFlight, SingleFlight
+    from .near_dup import NearDuplicateIndex, get_default_index
+    from .rules import triage_record
+    from .results_store import ResultsStore, get_default_store, result_source
+    from .metrics import CallMetrics, format_timings, serve_metrics, timed, track_call, write_metrics
+    from .profiling import output_prefix, parse_profile_modes, profiled, start_profiling, stop_profiling
 except ImportError:
-    from openai_client import call_openai_api
-    from prompt import build_evaluation_messages, validate_surgery_steps, SURGERY_TYPES
-    from utils import read_file_content, format_json_output, load_env_config
+    from openai_client import (
+        call_openai_api, acall_openai_api, stream_openai_api, estimate_chat_request,
+        call_openai_api_packed, chat_cache_key, request_key, get_repair_stats
+    )
+    from prompt import (
+        build_evaluation_messages, build_packed_evaluation_messages, validate_surgery_steps, SURGERY_TYPES
+    )
+    from utils import AppConfig, get_config, read_file_content, format_json_output, load_env_config
+    from batch import (
+        BatchRecord, DEFAULT_FIELDS, batch_input, open_batch_records, parse_fields,
+        run_batch, run_packed_batch, format_batch_summary
+    )
+    from journal import BatchJournal
+    from failover import get_failover_stats, reserve_hedge_threads
+    from cache import ResponseCache, get_default_cache
+    from tokens import ContextLengthError, estimate_text_tokens, format_estimate, get_model_profile
+    from mapreduce import DEFAULT_SEGMENT_TOKENS, evaluate_long_record
+    from singleflight import AsyncSingleFlight, SingleFlight
+    from near_dup import NearDuplicateIndex, get_default_index
+    from rules import triage_record
+    from results_store import ResultsStore, get_default_store, result_source
+    from metrics import CallMetrics, format_timings, serve_metrics, timed, track_call, write_metrics
+    from profiling import output_prefix, parse_profile_modes, profiled, start_profiling, stop_profiling
+
+
+# 进程内请求合并：内容相同的并发评估共享一次上游调用
+_singleflight = SingleFlight()
+_async_singleflight = AsyncSingleFlight()
+
 
+def _near_dup_scope(near_dup: Optional[NearDuplicateIndex], surgery_type: str,
+                    config: Optional[AppConfig]) -> Optional[str]:
+    """近似重复索引的作用域（未启用索引时为None）"""
+    if near_dup is None:
+        return None
+    return near_dup.make_scope((config or get_config()).model, surgery_type)
 
-def evaluate_surgery_steps(surgery_steps: str, surgery_type: str = "general") -> Dict[str, Any]:
+
+@profiled
+def evaluate_surgery_steps(surgery_steps: str, surgery_type: str = "general",
+                           cache: Optional[ResponseCache] = None,
+                           refresh: bool = False,
+                           config: Optional[AppConfig] = None,
+                           near_dup: Optional[NearDuplicateIndex] = None,
+                           hints: Optional[List[str]] = None) -> Dict[str, Any]:
     """
     评估手术步骤
     
+    并发的相同请求（规范化后的请求体一致）只发起一次上游调用，共享其结果或异常。
+    
     Args:
         surgery_steps: 手术步骤描述
         surgery_type: 手术类型
+        cache: 响应缓存（可选）
+        refresh: 为True时忽略已有缓存重新评估
+        config: 运行配置，默认使用进程共享配置
+        near_dup: 近似重复索引（可选），命中时复用已有结果并附带 ``reused`` 字段
+        hints: 本地规则预检提示（可选），附加在用户Prompt中
         
     Returns:
         Dict[str, Any]: 评估结果
+        
+    Raises:
+        ContextLengthError: 记录预计超出模型上下文长度（发送前拒绝）
     """
     # 验证输入
-    if not validate_surgery_steps(surgery_steps):
+    if not validate_surgery_steps(surgery_steps, (config or get_config()).model):
         raise ValueError("手术步骤描述无效")
     
     if surgery_type not in SURGERY_TYPES:
-        print(f"警告: 未知手术类型 '{surgery_type}'，使用通用评估")
+        print(f"警告: 未知手术类型 '{surgery_type}'，使用通用评估", file=sys.stderr)
         surgery_type = "general"
     
+    # 近似重复的记录直接复用已有结果
+    scope = _near_dup_scope(near_dup, surgery_type, config)
+    if near_dup is not None and not refresh:
+        reused = near_dup.lookup(surgery_steps, scope)
+        if reused is not None:
+            return reused
+    
     # 构建评估消息
-    messages = build_evaluation_messages(surgery_steps, surgery_type)
+    with timed('prompt_build'):
+        messages = build_evaluation_messages(surgery_steps, surgery_type, hints)
     
-    # 调用API进行评估
-    try:
-        result = call_openai_api(messages)
+    # 调用API进行评估（相同请求并发时只调用一次）
+    def call() -> Dict[str, Any]:
+        try:
+            result = call_openai_api(messages, cache=cache, refresh=refresh, config=config)
+        except ContextLengthError:
+            raise
+        except Exception as e:
+            raise Exception(f"评估失败: {e}")
+        if near_dup is not None and 'fallback' not in result:
+            near_dup.add(surgery_steps, scope, result)
+        return result
+    
+    return _singleflight.do((request_key(messages, config=config), refresh), call)
+
+
+@profiled
+async def aevaluate_surgery_steps(surgery_steps: str, surgery_type: str = "general",
+                                  semaphore: Optional[asyncio.Semaphore] = None,
+                                  timeout: Optional[float] = None,
+                                  cache: Optional[ResponseCache] = None,
+                                  refresh: bool = False,
+                                  config: Optional[AppConfig] = None,
+                                  near_dup: Optional[NearDuplicateIndex] = None,
+                                  hints: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    异步评估手术步骤，可在同一事件循环中并发大量评估
+    
+    Args:
+        surgery_steps: 手术步骤描述
+        surgery_type: 手术类型
+        semaphore: 并发信号量（可选），限制本调用方同时在途的评估数（含排队和重试）
+        timeout: 单次评估截止时间（秒，含信号量排队），默认30秒
+        cache: 响应缓存（可选）
+        refresh: 为True时忽略已有缓存重新评估
+        config: 运行配置，默认使用进程共享配置
+        near_dup: 近似重复索引（可选），命中时复用已有结果并附带 ``reused`` 字段
+        hints: 本地规则预检提示（可选），附加在用户Prompt中
+        
+    Returns:
+        Dict[str, Any]: 评估结果
+        
+    Raises:
+        TimeoutError: 超过截止时间
+        asyncio.CancelledError: 调用方取消了评估
+        ContextLengthError: 记录预计超出模型上下文长度（发送前拒绝）
+    """
+    # 验证输入
+    if not validate_surgery_steps(surgery_steps, (config or get_config()).model):
+        raise ValueError("手术步骤描述无效")
+    
+    if surgery_type not in SURGERY_TYPES:
+        print(f"警告: 未知手术类型 '{surgery_type}'，使用通用评估", file=sys.stderr)
+        surgery_type = "general"
+    
+    # 近似重复的记录直接复用已有结果
+    scope = _near_dup_scope(near_dup, surgery_type, config)
+    if near_dup is not None and not refresh:
+        reused = near_dup.lookup(surgery_steps, scope)
+        if reused is not None:
+            return reused
+    
+    # 构建评估消息
+    with timed('prompt_build'):
+        messages = build_evaluation_messages(surgery_steps, surgery_type, hints)
+    
+    # 调用API进行评估（相同请求并发时只调用一次）。截止时间和信号量属于各个调用方，
+    # 在合并等待之外生效；所有调用方都离开（取消或超时）时共享的上游请求随之取消
+    async def call() -> Dict[str, Any]:
+        try:
+            result = await acall_openai_api(messages, timeout=math.inf, cache=cache,
+                                            refresh=refresh, config=config)
+        except ContextLengthError:
+            raise
+        except Exception as e:
+            raise Exception(f"评估失败: {e}")
+        if near_dup is not None and 'fallback' not in result:
+            near_dup.add(surgery_steps, scope, result)
         return result
+    
+    key = (request_key(messages, config=config), refresh)
+    deadline = 30.0 if timeout is None else timeout
+    caller_timeout = asyncio.timeout(deadline)
+    try:
+        async with caller_timeout:
+            if semaphore is None:
+                return await _async_singleflight.do(key, call)
+            async with semaphore:
+                return await _async_singleflight.do(key, call)
+    except TimeoutError:
+        if caller_timeout.expired():
+            raise TimeoutError(f"请求超时: 超过截止时间 {deadline} 秒")
+        raise
+
+
+@profiled
+def stream_evaluate_surgery_steps(surgery_steps: str, surgery_type: str = "general",
+                                  cache: Optional[ResponseCache] = None,
+                                  refresh: bool = False,
+                                  config: Optional[AppConfig] = None) -> Iterator[Tuple[str, Any]]:
+    """
+    流式评估手术步骤，评估字段一生成就产出，适合交互式界面
+    
+    Args:
+        surgery_steps: 手术步骤描述
+        surgery_type: 手术类型
+        cache: 响应缓存（可选）
+        refresh: 为True时忽略已有缓存重新评估
+        config: 运行配置，默认使用进程共享配置
+        
+    Yields:
+        Tuple[str, Any]: (事件类型, 值)，事件类型为 total_score / risk_level / risk /
+        suggestion，最后一个事件为 ("result", 完整评估结果)
+    """
+    # 验证输入
+    if not validate_surgery_steps(surgery_steps, (config or get_config()).model):
+        raise ValueError("手术步骤描述无效")
+    
+    if surgery_type not in SURGERY_TYPES:
+        print(f"警告: 未知手术类型 '{surgery_type}'，使用通用评估", file=sys.stderr)
+        surgery_type = "general"
+    
+    # 构建评估消息
+    with timed('prompt_build'):
+        messages = build_evaluation_messages(surgery_steps, surgery_type)
+    
+    try:
+        yield from stream_openai_api(messages, cache=cache, refresh=refresh, config=config)
+    except ContextLengthError:
+        raise
     except Exception as e:
         raise Exception(f"评估失败: {e}")
 
 
-def main():
+@profiled
+def evaluate_packed_records(records: List[BatchRecord],
+                            cache: Optional[ResponseCache] = None,
+                            refresh: bool = False,
+                            config: Optional[AppConfig] = None) -> List[Union[Dict[str, Any], Exception]]:
+    """
+    以一次打包请求评估多条记录，系统Prompt只发送一次
+    
+    缓存命中的记录不再打包；打包回复中缺失或无效的记录、以及打包请求整体失败时，
+    相应记录回退为单条调用。打包结果按单条请求的缓存键写入缓存，与单条评估共用。
+    
+    Args:
+        records: (记录ID, 手术类型, 手术步骤) 列表
+        cache: 响应缓存（可选）
+        refresh: 为True时忽略已有缓存重新评估
+        config: 运行配置，默认使用进程共享配置
+        
+    Returns:
+        List[Union[Dict[str, Any], Exception]]: 与输入记录一一对应的评估结果或异常
+    """
+    config = config or get_config()
+    outcomes: List[Union[Dict[str, Any], Exception, None]] = [None] * len(records)
+    packed: List[Tuple[int, BatchRecord, Optional[str]]] = []
+    seen_ids = set()
+    
+    for index, (record_id, surgery_type, surgery_steps) in enumerate(records):
+        if not validate_surgery_steps(surgery_steps, config.model):
+            outcomes[index] = ValueError("手术步骤描述无效")
+            continue
+        if surgery_type not in SURGERY_TYPES:
+            surgery_type = "general"
+        cache_key = None
+        if cache is not None:
+            cache_key = chat_cache_key(cache, build_evaluation_messages(surgery_steps, surgery_type),
+                                       config=config)
+            cached = None if refresh else cache.get(cache_key)
+            if cached is not None:
+                outcomes[index] = cached
+                continue
+        # 同一包内的重复ID无法区分，重复记录单独评估
+        if record_id in seen_ids:
+            continue
+        seen_ids.add(record_id)
+        packed.append((index, (record_id, surgery_type, surgery_steps), cache_key))
+    
+    results: Dict[str, Dict[str, Any]] = {}
+    if len(packed) > 1:
+        with timed('prompt_build'):
+            messages = build_packed_evaluation_messages([record for _, record, _ in packed])
+        try:
+            results = call_openai_api_packed(
+                messages,
+                [record[0] for _, record, _ in packed],
+                config=config
+            )
+        except Exception as e:
+            print(f"警告: 打包评估失败，回退为单条评估: {e}", file=sys.stderr)
+    for index, (record_id, _, _), cache_key in packed:
+        if record_id in results:
+            outcomes[index] = results[record_id]
+            if cache_key is not None and 'fallback' not in results[record_id]:
+                cache.put(cache_key, results[record_id])
+    
+    for index, (record_id, surgery_type, surgery_steps) in enumerate(records):
+        if outcomes[index] is None:
+            try:
+                outcomes[index] = evaluate_surgery_steps(surgery_steps, surgery_type, cache=cache,
+                                                         refresh=refresh, config=config)
+            except Exception as e:
+                outcomes[index] = e
+    return outcomes
+
+
+def evaluate_with_triage(surgery_steps: str, surgery_type: str,
+                         evaluate_fn: Callable[..., Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    规则预检后评估：要点齐全且无异常表述的记录直接返回规则结果，
+    其余记录带上预检提示交给模型评估
+    
+    Args:
+        surgery_steps: 手术步骤描述
+        surgery_type: 手术类型
+        evaluate_fn: 模型评估函数，需接受 ``hints`` 关键字参数（如 evaluate_surgery_steps）
+        
+    Returns:
+        Dict[str, Any]: 评估结果（规则结果带 ``triage`` 字段）
+    """
+    triage = triage_record(surgery_steps, surgery_type)
+    if triage.conclusive:
+        return triage.as_evaluation()
+    return evaluate_fn(surgery_steps, surgery_type, hints=triage.hints())
+
+
+def triage_packed_records(records: List[BatchRecord],
+                          evaluate_group_fn: Callable[[List[BatchRecord]], List[Any]]
+                          ) -> List[Union[Dict[str, Any], Exception]]:
+    """
+    打包评估前的规则预检：结论明确的记录直接返回规则结果，其余记录打包交给模型
+    
+    Args:
+        records: (记录ID, 手术类型, 手术步骤) 列表
+        evaluate_group_fn: 打包评估函数（如 evaluate_packed_records）
+        
+    Returns:
+        List[Union[Dict[str, Any], Exception]]: 与输入记录一一对应的评估结果或异常
+    """
+    outcomes: List[Union[Dict[str, Any], Exception, None]] = [None] * len(records)
+    pending = []
+    for index, (_, surgery_type, surgery_steps) in enumerate(records):
+        triage = triage_record(surgery_steps, surgery_type)
+        if triage.conclusive:
+            outcomes[index] = triage.as_evaluation()
+        else:
+            pending.append(index)
+    if pending:
+        for index, outcome in zip(pending, evaluate_group_fn([records[i] for i in pending])):
+            outcomes[index] = outcome
+    return outcomes
+
+
+def record_evaluation(store: ResultsStore, result: Dict[str, Any], surgery_type: str,
+                      surgery_steps: str, latency: float, config: AppConfig,
+                      usage: Optional[Tuple[int, int]] = None) -> None:
+    """
+    将一次评估结果写入结果库（令牌数优先使用API返回的用量 ``usage``，没有时为本地估算；
+    规则结果和近似复用结果未调用模型，记为0）；后备端点作答时记录其模型
+    
+    写入失败只打印警告，不影响评估结果的输出
+    """
+    model = result.get('fallback', {}).get('model') or config.model
+    prompt_tokens = completion_tokens = 0
+    if result_source(result) == 'model' and usage is not None:
+        prompt_tokens, completion_tokens = usage
+    elif result_source(result) == 'model':
+        messages = build_evaluation_messages(surgery_steps, surgery_type)
+        prompt_tokens = estimate_chat_request(messages, model=model, config=config).prompt_tokens
+        completion_tokens = estimate_text_tokens(json.dumps(result, ensure_ascii=False),
+                                                 get_model_profile(model))
+    try:
+        store.add(result, surgery_type, surgery_steps, model, round(latency, 3),
+                  prompt_tokens, completion_tokens)
+    except sqlite3.Error as e:
+        print(f"警告: 评估结果写入结果库失败: {e}", file=sys.stderr)
+
+
+def store_evaluations(evaluate_fn: Callable[..., Dict[str, Any]], store: ResultsStore,
+                      config: AppConfig) -> Callable[..., Dict[str, Any]]:
+    """
+    包装单条评估函数：评估成功后写入结果库
+    
+    Args:
+        evaluate_fn: 评估函数，签名同 evaluate_surgery_steps(steps, type)，其余关键字参数原样传递
+        store: 结果库
+        config: 运行配置
+        
+    Returns:
+        Callable[..., Dict[str, Any]]: 包装后的评估函数
+    """
+    def evaluate(surgery_steps: str, surgery_type: str, **kwargs: Any) -> Dict[str, Any]:
+        start = time.perf_counter()
+        with track_call() as call:
+            result = evaluate_fn(surgery_steps, surgery_type, **kwargs)
+        record_evaluation(store, result, surgery_type, surgery_steps, time.perf_counter() - start,
+                          config, _call_usage(call))
+        return result
+    return evaluate
+
+
+def store_packed_evaluations(evaluate_group_fn: Callable[[List[BatchRecord]], List[Any]],
+                             store: ResultsStore, config: AppConfig
+                             ) -> Callable[[List[BatchRecord]], List[Any]]:
+    """包装打包评估函数：成功的记录逐条写入结果库（耗时和API返回的令牌用量按组内记录数均摊）"""
+    def evaluate_group(records: List[BatchRecord]) -> List[Any]:
+        start = time.perf_counter()
+        with track_call() as call:
+            outcomes = evaluate_group_fn(records)
+        latency = (time.perf_counter() - start) / max(1, len(records))
+        usage = _call_usage(call)
+        if usage is not None:
+            model_results = sum(1 for outcome in outcomes
+                                if not isinstance(outcome, Exception) and result_source(outcome) == 'model')
+            usage = tuple(tokens // max(1, model_results) for tokens in usage)
+        for (_, surgery_type, surgery_steps), outcome in zip(records, outcomes):
+            if not isinstance(outcome, Exception):
+                record_evaluation(store, outcome, surgery_type, surgery_steps, latency, config, usage)
+        return outcomes
+    return evaluate_group
+
+
+def _call_usage(call: CallMetrics) -> Optional[Tuple[int, int]]:
+    """调用范围内API返回的 (提示令牌数, 生成令牌数)，没有收到用量时为None"""
+    if not call.has_usage:
+        return None
+    return call.prompt_tokens, call.completion_tokens
+
+
+# 流式输出时各事件的显示名称
+_STREAM_EVENT_LABELS = {
+    'total_score': '总分',
+    'risk_level': '风险等级',
+    'risk': '风险',
+    'suggestion': '建议',
+}
+
+
+def run_stream_mode(surgery_steps: str, surgery_type: str, cache: Optional[ResponseCache],
+                    refresh: bool, config: AppConfig) -> Dict[str, Any]:
+    """
+    流式评估单条记录，逐项打印到达的评估字段
+    
+    Returns:
+        Dict[str, Any]: 完整评估结果
+    """
+    result: Dict[str, Any] = {}
+    print("=== 实时评估 ===")
+    for event, value in stream_evaluate_surgery_steps(
+            surgery_steps, surgery_type, cache=cache, refresh=refresh, config=config):
+        if event == 'result':
+            result = value
+        else:
+            print(f"{_STREAM_EVENT_LABELS[event]}: {value}", flush=True)
+    return result
+
+
+def run_batch_mode(args, evaluate_fn: Callable[[str, str], Dict[str, Any]],
+                   evaluate_group_fn: Optional[Callable[[List[BatchRecord]], List[Any]]] = None) -> int:
+    """
+    批量评估模式：从目录、清单或JSONL/CSV导出流式读取记录，并发评估并逐条输出JSONL
+
+    Args:
+        args: 命令行参数
+        evaluate_fn: 单条记录评估函数
+        evaluate_group_fn: 打包评估函数（--pack 大于1时使用）
+
+    Returns:
+        int: 退出码（存在失败记录时返回1）
+    """
+    kind, path = batch_input(args)
+    records = open_batch_records(kind, path, args.type, args.fields)
+
+    if args.verbose:
+        print(f"批量评估: {path}，并发数: {args.workers}，"
+              f"每请求记录数: {args.pack}", file=sys.stderr)
+
+    reserve_hedge_threads(args.workers)
+    journal = BatchJournal(args.journal, resume=args.resume) if args.journal else None
+    if journal is not None and args.verbose:
+        print(f"批量评估日志: {args.journal}，已成功记录: {journal.completed_count}", file=sys.stderr)
+
+    def run(out) -> Dict[str, Any]:
+        if evaluate_group_fn is not None and args.pack > 1:
+            return run_packed_batch(records, evaluate_group_fn, out, args.pack,
+                                    workers=args.workers, journal=journal)
+        return run_batch(records, evaluate_fn, out, workers=args.workers, journal=journal)
+
+    try:
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as out:
+                summary = run(out)
+            print(f"评估结果已保存到: {args.output}")
+            print(format_batch_summary(summary))
+        else:
+            # 标准输出保留给JSONL结果，摘要写到标准错误
+            summary = run(sys.stdout)
+            print(format_batch_summary(summary), file=sys.stderr)
+    finally:
+        # 中断（如Ctrl-C）时也要把已完成的记录落盘
+        if journal is not None:
+            journal.close()
+
+    return 0 if summary['failed'] == 0 else 1
+
+
+def run_estimate_mode(records: Iterator[BatchRecord], config: AppConfig) -> int:
+    """
+    预估模式：只在本地估算每条记录的令牌数、费用和延迟，不调用API
+
+    Args:
+        records: (记录ID, 手术类型, 手术步骤) 序列
+        config: 运行配置
+
+    Returns:
+        int: 退出码（存在超出上下文长度的记录时返回1）
+    """
+    count = prompt_tokens = completion_tokens = oversized = 0
+    cost = latency = 0.0
+    for record_id, surgery_type, steps in records:
+        estimate = estimate_chat_request(build_evaluation_messages(steps, surgery_type), config=config)
+        print(f"{record_id}: {format_estimate(estimate)}")
+        count += 1
+        prompt_tokens += estimate.prompt_tokens
+        completion_tokens += estimate.completion_tokens
+        cost += estimate.cost
+        latency += estimate.latency
+        oversized += 0 if estimate.fits else 1
+
+    if count > 1:
+        print(f"\n合计: {count} 条记录，提示 {prompt_tokens} 令牌，预期生成 {completion_tokens} 令牌，"
+              f"预计费用 ${cost:.4f}，串行预计耗时 {latency:.0f} 秒，超出上下文 {oversized} 条")
+    return 0 if oversized == 0 else 1
+
+
+def format_cache_stats(cache: ResponseCache) -> str:
+    """格式化缓存命中统计"""
+    stats = cache.stats()
+    return (f"缓存: 命中 {stats['hits']} 次，未命中 {stats['misses']} 次，"
+            f"命中率 {stats['hit_rate']:.0%}，条目数 {stats['entries']}")
+
+
+def format_near_dup_stats(near_dup: NearDuplicateIndex) -> str:
+    """格式化近似重复复用统计"""
+    stats = near_dup.stats()
+    return (f"近似重复: 复用 {stats['hits']} 次，未命中 {stats['misses']} 次，"
+            f"复用率 {stats['hit_rate']:.0%}，索引条目数 {stats['entries']}")
+
+
+def format_coalescing_stats() -> str:
+    """格式化请求合并统计（线程与协程两条路径合计）"""
+    stats = [_singleflight.stats(), _async_singleflight.stats()]
+    executed = sum(s['executed'] for s in stats)
+    coalesced = sum(s['coalesced'] for s in stats)
+    return f"请求合并: 上游调用 {executed} 次，合并重复请求 {coalesced} 次"
+
+
+def format_failover_stats() -> str:
+    """格式化故障转移统计（对冲、切换次数和各端点熔断状态）"""
+    stats = get_failover_stats()
+    endpoints = "，".join(
+        f"{name} {health['state']}（成功 {health['successes']}，失败 {health['failures']}）"
+        for name, health in stats['endpoints'].items()
+    )
+    return (f"故障转移: 对冲 {stats['hedged']} 次（对冲先返回 {stats['hedge_wins']} 次），"
+            f"切换端点 {stats['failovers']} 次；端点: {endpoints or '无'}")
+
+
+def format_repair_stats() -> str:
+    """格式化结果修复统计"""
+    stats = get_repair_stats()
+    return (f"结果修复: 尝试 {stats['attempted']} 次，成功 {stats['succeeded']} 次，"
+            f"成功率 {stats['success_rate']:.0%}")
+
+
+# 子命令: 名称 -> 模块名，按需导入对应模块并调用其 main(argv)
+SUBCOMMANDS = {
+    'batch-api': 'batch_api',
+    'stats': 'results_store',
+    'serve': 'service',
+}
+
+
+def run_subcommand(name: str, argv: List[str]) -> int:
+    """导入并执行子命令"""
+    import importlib
+    module_name = SUBCOMMANDS[name]
+    if __package__:
+        module = importlib.import_module(f".{module_name}", __package__)
+    else:
+        module = importlib.import_module(module_name)
+    return module.main(argv)
+
+
+def main(argv: Optional[List[str]] = None):
     """主函数，处理命令行参数"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in SUBCOMMANDS:
+        return run_subcommand(argv[0], argv[1:])
+    
     parser = argparse.ArgumentParser(
         description="医院手术质控Agent - 手术步骤评估工具",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -60,6 +633,23 @@ def main():
 使用示例:
   python evaluate.py --file data/appendectomy_01.txt --type appendectomy
   python evaluate.py --text "手术步骤..." --type cholecystectomy
+  python evaluate.py --dir data/samples --workers 8 --output results.jsonl
+  python evaluate.py --manifest manifest.txt --output results.jsonl
+  python evaluate.py --dir data/samples --pack 8 --output results.jsonl
+  python evaluate.py --file long_record.txt --map-reduce --segment-tokens 1000
+  python evaluate.py batch-api --dir data/samples --state audit.batch.json -o results.jsonl
+  python evaluate.py --dir data/samples --store
+  python evaluate.py --manifest manifest.txt --journal run.journal -o results.jsonl --resume
+  python evaluate.py --jsonl his_export.jsonl.gz --fields case_no,op_type,op_note -o results.jsonl
+  python evaluate.py --dir data/samples --timings --metrics-file metrics.prom
+  python evaluate.py --dir data/samples --profile cpu --output results.jsonl
+  python evaluate.py stats --month 2024-06
+  python evaluate.py serve --port 8080 --workers 8
+
+子命令:
+  batch-api         - 通过异步批处理接口离线评估大量记录（evaluate.py batch-api -h 查看参数）
+  stats             - 汇总结果库：分数分布、风险等级构成和高频风险点（evaluate.py stats -h 查看参数）
+  serve             - 常驻评估服务：POST /evaluate（交互优先）和 /evaluate/batch（evaluate.py serve -h 查看参数）
   
 支持的手术类型:
   appendectomy      - 阑尾切除术
@@ -81,6 +671,26 @@ def main():
         type=str,
         help="直接输入的手术步骤文本"
     )
+    input_group.add_argument(
+        "--dir", "-d",
+        type=str,
+        help="批量模式：评估目录下所有 .txt 文件（类型按文件名前缀推断）"
+    )
+    input_group.add_argument(
+        "--manifest", "-m",
+        type=str,
+        help="批量模式：清单文件，每行一个 \"路径 [类型]\" 或一个JSON对象"
+    )
+    input_group.add_argument(
+        "--jsonl",
+        type=str,
+        help="批量模式：JSONL导出文件，每行一条记录，流式读取（支持 .gz）"
+    )
+    input_group.add_argument(
+        "--csv",
+        type=str,
+        help="批量模式：带表头的CSV导出文件，流式读取（.tsv 按制表符分隔，支持 .gz）"
+    )
     
     # 其他参数
     parser.add_argument(
@@ -91,10 +701,44 @@ def main():
         help="手术类型 (默认: general)"
     )
     
+    parser.add_argument(
+        "--fields",
+        type=str,
+        default=",".join(DEFAULT_FIELDS),
+        help="JSONL/CSV导出的字段名 \"ID字段,类型字段,文本字段\" (默认: id,type,text)"
+    )
+    
     parser.add_argument(
         "--output", "-o",
         type=str,
-        help="输出结果到文件（可选）"
+        help="输出结果到文件（可选，批量模式下为JSONL文件）"
+    )
+
+    parser.add_argument(
+        "--workers", "-w",
+        type=int,
+        default=4,
+        help="批量模式并发数 (默认: 4)"
+    )
+    
+    parser.add_argument(
+        "--pack",
+        type=int,
+        default=1,
+        help="批量模式：每次请求打包评估的记录数，共用一份系统Prompt (默认: 1，不打包)"
+    )
+    
+    parser.add_argument(
+        "--journal",
+        type=str,
+        metavar="PATH",
+        help="批量模式：将每条记录的输入摘要和结果追加到日志文件，中断后可用 --resume 继续"
+    )
+    
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="批量模式：从 --journal 日志继续，跳过已成功的记录，只重试失败和未完成的记录"
     )
     
     parser.add_argument(
@@ -103,13 +747,97 @@ def main():
         help="显示详细信息"
     )
     
+    parser.add_argument(
+        "--stream", "-s",
+        action="store_true",
+        help="流式输出：评估字段生成后立即显示（单条记录模式）"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="不使用本地响应缓存"
+    )
+    
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="忽略已有缓存重新评估，并用新结果更新缓存"
+    )
+    
+    parser.add_argument(
+        "--near-dup",
+        type=float,
+        metavar="THRESHOLD",
+        help="复用相似度达到阈值（0-1）的已评估记录的结果，默认取 NEAR_DUP_THRESHOLD，0 表示关闭"
+    )
+    
+    parser.add_argument(
+        "--triage",
+        action="store_true",
+        help="先按本地规则清单预检，要点齐全且无异常表述的记录不调用模型，其余记录附带预检提示"
+    )
+    
+    parser.add_argument(
+        "--store",
+        action="store_true",
+        help="将评估结果连同元数据写入结果库（RESULTS_DB_PATH），供 stats 子命令汇总"
+    )
+    
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="结束时输出各阶段耗时（配置加载、Prompt构建、序列化、建连、首字节、读取、JSON提取、验证）和令牌用量摘要"
+    )
+    
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        metavar="PATH",
+        help="结束时将阶段耗时和令牌用量直方图以Prometheus文本格式写入文件"
+    )
+    
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="运行期间在 127.0.0.1:PORT/metrics 暴露Prometheus指标"
+    )
+    
+    parser.add_argument(
+        "--profile",
+        type=str,
+        metavar="cpu|mem",
+        help="性能剖析：cpu（cProfile统计和折叠调用栈）、mem（tracemalloc分配排行）或 cpu,mem，"
+             "结果保存在输出文件旁（无输出文件时在 EVAL_PROFILE_DIR），默认取 EVAL_PROFILE"
+    )
+    
+    parser.add_argument(
+        "--map-reduce",
+        action="store_true",
+        help="长记录按编号步骤分段并行评估后合并结果"
+    )
+    
+    parser.add_argument(
+        "--segment-tokens",
+        type=int,
+        default=DEFAULT_SEGMENT_TOKENS,
+        help=f"分段评估时每段步骤的令牌预算 (默认: {DEFAULT_SEGMENT_TOKENS})"
+    )
+    
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="只估算令牌数、费用和延迟，不调用API"
+    )
+    
     parser.add_argument(
         "--config-check",
         action="store_true", 
         help="检查配置并退出"
     )
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     # 配置检查模式
     if args.config_check:
@@ -132,10 +860,107 @@ def main():
         return 0
     
     # 检查是否提供了输入参数
-    if not args.file and not args.text:
-        parser.error("必须提供 --file 或 --text 参数")
+    batch = batch_input(args)
+    if not (args.file or args.text or batch):
+        parser.error("必须提供 --file、--text、--dir、--manifest、--jsonl 或 --csv 参数")
+    
+    try:
+        args.fields = parse_fields(args.fields)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    if args.workers < 1:
+        parser.error("--workers 必须大于0")
+    
+    if args.map_reduce and args.stream:
+        parser.error("--map-reduce 不支持与 --stream 同时使用")
+    
+    if args.pack < 1:
+        parser.error("--pack 必须大于0")
+    
+    if args.pack > 1 and args.map_reduce:
+        parser.error("--pack 不支持与 --map-reduce 同时使用")
+    
+    if args.triage and (args.stream or args.map_reduce):
+        parser.error("--triage 不支持与 --stream 或 --map-reduce 同时使用")
+    
+    if args.near_dup is not None and not 0 <= args.near_dup <= 1:
+        parser.error("--near-dup 必须在0到1之间")
+    
+    if args.journal and not batch:
+        parser.error("--journal 只能用于批量模式（--dir、--manifest、--jsonl 或 --csv）")
+    
+    if args.resume and not args.journal:
+        parser.error("--resume 需要同时指定 --journal")
+    
+    if args.metrics_port is not None:
+        try:
+            serve_metrics(args.metrics_port)
+        except OSError as e:
+            print(f"错误: 无法在端口 {args.metrics_port} 启动指标端点: {e}")
+            return 1
+    
+    config = get_config()
+    try:
+        profile_modes = parse_profile_modes(config.profile if args.profile is None else args.profile)
+    except ValueError as e:
+        parser.error(str(e))
+    if profile_modes and not args.estimate:
+        start_profiling(profile_modes, output_prefix(args.output, config.profile_dir))
+    
+    cache = None if args.no_cache else get_default_cache(config)
+    near_dup_threshold = config.near_dup_threshold if args.near_dup is None else args.near_dup
+    near_dup = None
+    if near_dup_threshold > 0 and not args.no_cache:
+        near_dup = get_default_index(config, near_dup_threshold)
+    evaluate_fn = functools.partial(
+        evaluate_surgery_steps, cache=cache, refresh=args.refresh, config=config, near_dup=near_dup
+    )
+    if args.map_reduce:
+        evaluate_fn = functools.partial(
+            evaluate_long_record, evaluate_fn=evaluate_fn,
+            max_segment_tokens=args.segment_tokens, model=config.model
+        )
+    if args.triage:
+        evaluate_fn = functools.partial(evaluate_with_triage, evaluate_fn=evaluate_fn)
+    store = get_default_store(config) if args.store and not args.estimate else None
+    if store is not None:
+        evaluate_fn = store_evaluations(evaluate_fn, store, config)
     
     try:
+        # 预估模式
+        if args.estimate:
+            if batch:
+                records = open_batch_records(*batch, args.type, args.fields)
+            else:
+                steps = read_file_content(args.file) if args.file else args.text
+                records = iter([(args.file or 'text', args.type, steps)])
+            return run_estimate_mode(records, config)
+        
+        # 批量模式
+        if batch:
+            evaluate_group_fn = functools.partial(
+                evaluate_packed_records, cache=cache, refresh=args.refresh, config=config
+            )
+            if args.triage:
+                evaluate_group_fn = functools.partial(
+                    triage_packed_records, evaluate_group_fn=evaluate_group_fn
+                )
+            if store is not None:
+                evaluate_group_fn = store_packed_evaluations(evaluate_group_fn, store, config)
+            exit_code = run_batch_mode(args, evaluate_fn, evaluate_group_fn)
+            if args.verbose and cache is not None:
+                print(format_cache_stats(cache), file=sys.stderr)
+            if args.verbose and near_dup is not None:
+                print(format_near_dup_stats(near_dup), file=sys.stderr)
+            if args.verbose:
+                print(format_coalescing_stats(), file=sys.stderr)
+                print(format_repair_stats(), file=sys.stderr)
+                if config.fallback_endpoints:
+                    print(format_failover_stats(), file=sys.stderr)
+            return exit_code
+        
+
         # 获取手术步骤文本
         if args.file:
             if args.verbose:
@@ -150,7 +975,15 @@ def main():
             print("开始评估...")
         
         # 执行评估
-        result = evaluate_surgery_steps(surgery_steps, args.type)
+        if args.stream:
+            start = time.perf_counter()
+            with track_call() as call:
+                result = run_stream_mode(surgery_steps, args.type, cache, args.refresh, config)
+            if store is not None:
+                record_evaluation(store, result, args.type, surgery_steps,
+                                  time.perf_counter() - start, config, _call_usage(call))
+        else:
+            result = evaluate_fn(surgery_steps, args.type)
         
         # 格式化输出
         formatted_result = format_json_output(result)
@@ -171,14 +1004,22 @@ def main():
             print(f"风险等级: {result['risk_level']}")
             print(f"识别风险: {len(result['risks'])} 个")
             print(f"改进建议: {len(result['suggestions'])} 条")
+            if cache is not None:
+                print(format_cache_stats(cache))
+            if 'triage' in result:
+                print("规则预检要点齐全且无异常表述，未调用模型")
+            if 'reused' in result:
+                print(f"复用近似记录的评估结果（相似度 {result['reused']['similarity']:.0%}）")
         
         return 0
         
-    except FileNotFoundError as e:
+    except (FileNotFoundError, FileExistsError) as e:
         print(f"错误: {e}")
         return 1
     except ValueError as e:
         print(f"输入错误: {e}")
+        if isinstance(e, ContextLengthError):
+            print("提示: 可使用 --map-reduce 将长记录分段评估")
         return 1
     except Exception as e:
         print(f"评估失败: {e}")
@@ -186,6 +1027,17 @@ def main():
             import traceback
             traceback.print_exc()
         return 1
+    finally:
+        profile_report = stop_profiling()
+        if profile_report is not None:
+            print(profile_report, file=sys.stderr)
+        if args.timings:
+            print(format_timings(), file=sys.stderr)
+        if args.metrics_file:
+            try:
+                write_metrics(args.metrics_file)
+            except OSError as e:
+                print(f"警告: 指标写入 {args.metrics_file} 失败: {e}", file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,588 @@
+"""
+多端点故障转移模块
+按配置的顺序（主端点在前，OPENAI_FALLBACK_ENDPOINTS 中的后备端点在后）调用模型：
+每个端点独立统计健康状况，连续失败达到阈值时熔断一段时间；
+主端点超过其观测到的延迟分位数（默认p95）仍未返回时，向下一个端点发出对冲请求，先返回者胜出
+"""
+
+import asyncio
+import contextvars
+import dataclasses
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+try:
+    from .utils import AppConfig
+except ImportError:
+    from utils import AppConfig
+
+
+T = TypeVar('T')
+
+# 对冲线程池的最小线程数；并发调用方更多时按 reserve_hedge_threads 扩大
+MIN_HEDGE_THREADS = 64
+
+# 估计延迟分位数所需的最少样本数（样本不足时不对冲）
+MIN_LATENCY_SAMPLES = 20
+
+# 对冲等待时间的下限（秒），避免延迟极低时几乎每个请求都被对冲
+MIN_HEDGE_DELAY = 0.05
+
+
+class SendTimer:
+    """
+    一次尝试中实际HTTP发送的计时
+
+    对冲等待和延迟样本只应覆盖请求发出后的时间：限流器、自适应并发的排队等待和重试退避
+    是客户端自身造成的，计入后会在自我限流时触发对冲并抬高延迟分位数。
+    """
+
+    def __init__(self, on_start: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            on_start: 首次发送开始时的回调（在发送线程或协程中调用）
+        """
+        self.started_at: Optional[float] = None
+        self.latency: Optional[float] = None
+        self._on_start = on_start
+
+    def _start(self) -> float:
+        now = time.perf_counter()
+        if self.started_at is None:
+            self.started_at = now
+            if self._on_start is not None:
+                self._on_start()
+        return now
+
+    def elapsed(self) -> float:
+        """距首次发送开始的秒数（尚未发送时为0）"""
+        return 0.0 if self.started_at is None else time.perf_counter() - self.started_at
+
+    def wrap(self, send: Callable[[], T]) -> Callable[[], T]:
+        """包装一次发送，记录开始时间和成功发送的耗时"""
+        def timed() -> T:
+            start = self._start()
+            result = send()
+            self.latency = time.perf_counter() - start
+            return result
+        return timed
+
+    def awrap(self, send: Callable[[], Awaitable[T]]) -> Callable[[], Awaitable[T]]:
+        """wrap 的异步版本"""
+        async def timed() -> T:
+            start = self._start()
+            result = await send()
+            self.latency = time.perf_counter() - start
+            return result
+        return timed
+
+
+# 单个端点的一次尝试: (端点配置, 是否为最后一个可用端点, 发送计时) -> 结果
+Attempt = Callable[[AppConfig, bool, SendTimer], T]
+
+
+class CircuitOpenError(Exception):
+    """所有端点都处于熔断状态，请求未发送"""
+
+
+def parse_endpoints(spec: str) -> List[Tuple[str, str, str]]:
+    """
+    解析后备端点配置
+
+    格式为分号分隔的 ``base_url|model|api_key``，省略 api_key 时沿用主端点的密钥，如
+    ``https://api.openai.com|gpt-4o-mini|sk-xxx;http://127.0.0.1:8000|local-model``
+
+    Args:
+        spec: OPENAI_FALLBACK_ENDPOINTS 的值
+
+    Returns:
+        List[Tuple[str, str, str]]: (base_url, model, api_key) 列表（api_key 可能为空）
+
+    Raises:
+        ValueError: 条目缺少 base_url 或 model
+    """
+    endpoints = []
+    for item in spec.split(';'):
+        if not item.strip():
+            continue
+        parts = [part.strip() for part in item.split('|')]
+        if len(parts) < 2 or not parts[0] or not parts[1]:
+            raise ValueError(f"后备端点配置无效（应为 base_url|model[|api_key]）: {item.strip()}")
+        endpoints.append((parts[0], parts[1], parts[2] if len(parts) > 2 else ''))
+    return endpoints
+
+
+def endpoint_chain(config: AppConfig, model: Optional[str] = None) -> List[AppConfig]:
+    """
+    按优先级返回各端点的配置（每个端点一份 AppConfig，base_url、model 和 api_key 各不相同）
+
+    Args:
+        config: 运行配置（主端点）
+        model: 主端点使用的模型，默认使用配置中的 OPENAI_MODEL
+
+    Returns:
+        List[AppConfig]: 主端点在前，后备端点按配置顺序在后
+    """
+    primary = config if model is None or model == config.model else dataclasses.replace(config, model=model)
+    chain = [primary]
+    for base_url, fallback_model, api_key in parse_endpoints(config.fallback_endpoints):
+        chain.append(dataclasses.replace(
+            config, base_url=base_url, model=fallback_model,
+            api_key=api_key or config.api_key, fallback_endpoints='',
+        ))
+    return chain
+
+
+def endpoint_name(config: AppConfig) -> str:
+    """端点名称（base_url + 模型），用于区分健康状态"""
+    return f"{config.base_url}|{config.model}"
+
+
+class EndpointHealth:
+    """
+    端点健康状态与熔断器，线程安全
+
+    - closed: 正常放行；连续失败 ``failure_threshold`` 次后转为 open
+    - open: 拒绝请求；经过 ``reset_timeout`` 秒后转为 half_open
+    - half_open: 只放行一个探测请求，成功则恢复 closed，失败则重新 open
+
+    同时保留最近 ``window`` 次成功请求的延迟，用于估计对冲等待时间。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, window: int = 200):
+        """
+        Args:
+            failure_threshold: 触发熔断的连续失败次数
+            reset_timeout: 熔断持续时间（秒）
+            window: 延迟样本窗口大小
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        判断是否可以向该端点发送请求（half_open 状态下占用唯一的探测名额）
+
+        Returns:
+            bool: 是否放行
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self, latency: Optional[float] = None) -> None:
+        """
+        记录一次成功（端点已正常应答）
+
+        Args:
+            latency: 请求耗时（秒），为None时不计入延迟样本
+        """
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.state = self.CLOSED
+            self._probing = False
+            if latency is not None:
+                self._latencies.append(latency)
+
+    def record_failure(self) -> None:
+        """记录一次失败，达到阈值或探测失败时熔断"""
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def record_cancelled(self) -> None:
+        """请求被取消（对冲中落败），不计成败，只归还探测名额"""
+        with self._lock:
+            self._probing = False
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        """
+        成功请求延迟的分位数
+
+        Args:
+            q: 分位（0-1）
+
+        Returns:
+            Optional[float]: 样本不足 MIN_LATENCY_SAMPLES 时返回None
+        """
+        with self._lock:
+            if len(self._latencies) < MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取健康统计
+
+        Returns:
+            Dict[str, Any]: 熔断状态、成功数、失败数、熔断次数和p95延迟
+        """
+        p95 = self.latency_quantile(0.95)
+        with self._lock:
+            return {
+                'state': self.state,
+                'successes': self.successes,
+                'failures': self.failures,
+                'opened': self.opened,
+                'p95_latency': None if p95 is None else round(p95, 3),
+            }
+
+
+_health: Dict[str, EndpointHealth] = {}
+_health_lock = threading.Lock()
+
+# 对冲统计: 发出的对冲请求数、对冲请求先返回的次数、切换到后备端点的次数
+_counts = {'hedged': 0, 'hedge_wins': 0, 'failovers': 0}
+
+
+def get_health(config: AppConfig) -> EndpointHealth:
+    """
+    获取端点的健康状态（按 base_url + 模型区分，首次调用时按配置创建）
+
+    Args:
+        config: 端点配置
+
+    Returns:
+        EndpointHealth: 进程内共享的健康状态
+    """
+    name = endpoint_name(config)
+    with _health_lock:
+        health = _health.get(name)
+        if health is None:
+            health = EndpointHealth(config.circuit_failure_threshold, config.circuit_reset_seconds)
+            _health[name] = health
+        return health
+
+
+def _count(name: str) -> None:
+    with _health_lock:
+        _counts[name] += 1
+
+
+def get_failover_stats() -> Dict[str, Any]:
+    """
+    获取故障转移统计
+
+    Returns:
+        Dict[str, Any]: 对冲、对冲胜出和故障转移次数，以及各端点的健康统计
+    """
+    with _health_lock:
+        stats: Dict[str, Any] = dict(_counts)
+        endpoints = list(_health.items())
+    stats['endpoints'] = {name: health.stats() for name, health in endpoints}
+    return stats
+
+
+def _hedge_delay(endpoints: Sequence[AppConfig], primary: AppConfig) -> Optional[float]:
+    """对冲等待时间: 有后备端点且开启对冲时为主端点延迟的分位数，样本不足时为None（不对冲）"""
+    if len(endpoints) < 2 or primary.hedge_quantile <= 0:
+        return None
+    delay = get_health(primary).latency_quantile(primary.hedge_quantile)
+    return None if delay is None else max(MIN_HEDGE_DELAY, delay)
+
+
+class _Candidates:
+    """按优先级依次取出当前放行的端点"""
+
+    def __init__(self, endpoints: Sequence[AppConfig]):
+        self._remaining = list(endpoints)
+
+    def next(self) -> Optional[Tuple[AppConfig, bool]]:
+        """返回 (端点, 之后是否已无其他端点)，没有可用端点时返回None"""
+        while self._remaining:
+            endpoint = self._remaining.pop(0)
+            if get_health(endpoint).allow():
+                return endpoint, not self._remaining
+        return None
+
+
+def _tracked(attempt: Attempt, endpoint: AppConfig, last: bool,
+             is_failure: Callable[[BaseException], bool], timer: SendTimer) -> Any:
+    """执行一次尝试并记录端点健康状态（延迟样本只取实际发送的耗时）"""
+    health = get_health(endpoint)
+    recorded = False
+    try:
+        try:
+            result = attempt(endpoint, last, timer)
+        except Exception as e:
+            if is_failure(e):
+                health.record_failure()
+            else:
+                # 端点正常应答，只是请求本身有问题
+                health.record_success()
+            recorded = True
+            raise
+        health.record_success(timer.latency)
+        recorded = True
+        return result
+    finally:
+        if not recorded:
+            # KeyboardInterrupt等不计成败，但必须归还half_open的探测名额
+            health.record_cancelled()
+
+
+# 对冲请求使用的线程池（落败的请求在后台完成，结果丢弃，但仍计入健康统计）
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_threads = MIN_HEDGE_THREADS
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_executor_threads, thread_name_prefix='hedge')
+        return _executor
+
+
+def reserve_hedge_threads(callers: int) -> None:
+    """
+    按并发调用方数量扩大对冲线程池（批量评估和服务启动时按工作线程数调用）
+
+    每个调用方最多同时占用主请求和对冲请求两个线程；线程不足时主请求在池中排队，
+    排队时间会被误当作端点延迟。
+
+    Args:
+        callers: 同时调用 call_with_failover 的线程数
+    """
+    global _executor, _executor_threads
+    with _executor_lock:
+        needed = 2 * callers
+        if needed <= _executor_threads:
+            return
+        _executor_threads = needed
+        old, _executor = _executor, None
+    if old is not None:
+        # 旧线程池中已提交的请求照常完成
+        old.shutdown(wait=False)
+
+
+def call_with_failover(endpoints: Sequence[AppConfig], attempt: Attempt,
+                       is_failure: Callable[[BaseException], bool]) -> Tuple[T, AppConfig]:
+    """
+    按优先级调用各端点，失败时切换到下一个端点，主端点迟迟不返回时发出对冲请求
+
+    Args:
+        endpoints: 端点配置（见 endpoint_chain）
+        attempt: 单个端点的一次尝试，参数为 (端点配置, 是否为最后一个可用端点, 发送计时)；
+            调用方可据此在非最后端点上减少重试，把重试留给故障转移，
+            并须用 ``SendTimer.wrap`` 包装实际的HTTP发送（在取得限流配额之后）
+        is_failure: 判断异常是否属于端点故障（计入熔断并切换端点）；其他异常直接抛出
+
+    Returns:
+        Tuple[T, AppConfig]: (结果, 给出结果的端点)
+
+    Raises:
+        CircuitOpenError: 所有端点都处于熔断状态
+        Exception: 最后一个端点的错误，或不属于端点故障的错误
+    """
+    candidates = _Candidates(endpoints)
+    first = candidates.next()
+    if first is None:
+        raise CircuitOpenError("所有端点均处于熔断状态，请稍后重试")
+
+    delay = _hedge_delay(endpoints, first[0])
+    if delay is None:
+        # 不对冲：在调用线程上依次尝试
+        current: Optional[Tuple[AppConfig, bool]] = first
+        while True:
+            endpoint, last = current
+            try:
+                return _tracked(attempt, endpoint, last, is_failure, SendTimer()), endpoint
+            except Exception as e:
+                if not is_failure(e):
+                    raise
+                current = candidates.next()
+                if current is None:
+                    raise
+                _count('failovers')
+
+    executor = _get_executor()
+    pending: Dict[Future, AppConfig] = {}
+    primary = first[0]
+    error: Optional[BaseException] = None
+
+    def launch(candidate: Tuple[AppConfig, bool], timer: SendTimer) -> Future:
+        endpoint, last = candidate
+        # 在调用方的上下文中执行，各阶段耗时仍计入调用方的指标范围（见 metrics.track_call）
+        context = contextvars.copy_context()
+        future = executor.submit(context.run, _tracked, attempt, endpoint, last, is_failure, timer)
+        pending[future] = endpoint
+        return future
+
+    clock: Tuple[threading.Event, SendTimer]
+
+    def launch_timed(candidate: Tuple[AppConfig, bool]) -> None:
+        """发出请求并以它为对冲计时的起点（请求实际发出或未发出就结束时唤醒等待方）"""
+        nonlocal clock
+        sent = threading.Event()
+        timer = SendTimer(sent.set)
+        launch(candidate, timer).add_done_callback(lambda _: sent.set())
+        clock = (sent, timer)
+
+    launch_timed(first)
+    hedged = False
+    while pending:
+        timeout = None
+        if not hedged:
+            sent, timer = clock
+            sent.wait()
+            timeout = max(0.0, delay - timer.elapsed())
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # 主端点超过延迟分位数仍未返回，向下一个端点发出对冲请求
+            hedged = True
+            candidate = candidates.next()
+            if candidate is not None:
+                _count('hedged')
+                launch(candidate, SendTimer())
+            continue
+        for future in done:
+            endpoint = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                if not is_failure(e):
+                    raise
+                error = e
+                continue
+            if endpoint is not primary and hedged:
+                _count('hedge_wins')
+            return result, endpoint
+        if not pending:
+            candidate = candidates.next()
+            if candidate is not None:
+                _count('failovers')
+                launch_timed(candidate)
+    raise error
+
+
+async def _atracked(attempt: Callable[[AppConfig, bool, SendTimer], Awaitable[T]],
+                    endpoint: AppConfig, last: bool,
+                    is_failure: Callable[[BaseException], bool], timer: SendTimer) -> T:
+    """_tracked 的异步版本（被取消时归还探测名额）"""
+    health = get_health(endpoint)
+    recorded = False
+    try:
+        try:
+            result = await attempt(endpoint, last, timer)
+        except Exception as e:
+            if is_failure(e):
+                health.record_failure()
+            else:
+                health.record_success()
+            recorded = True
+            raise
+        health.record_success(timer.latency)
+        recorded = True
+        return result
+    finally:
+        if not recorded:
+            health.record_cancelled()
+
+
+async def acall_with_failover(endpoints: Sequence[AppConfig],
+                              attempt: Callable[[AppConfig, bool, SendTimer], Awaitable[T]],
+                              is_failure: Callable[[BaseException], bool]) -> Tuple[T, AppConfig]:
+    """
+    call_with_failover 的异步版本（胜出后取消其余在途请求）
+
+    Raises:
+        CircuitOpenError: 所有端点都处于熔断状态
+        Exception: 最后一个端点的错误，或不属于端点故障的错误
+    """
+    candidates = _Candidates(endpoints)
+    first = candidates.next()
+    if first is None:
+        raise CircuitOpenError("所有端点均处于熔断状态，请稍后重试")
+
+    delay = _hedge_delay(endpoints, first[0])
+    primary = first[0]
+    pending: Dict[asyncio.Task, AppConfig] = {}
+    error: Optional[BaseException] = None
+
+    def launch(candidate: Tuple[AppConfig, bool], timer: SendTimer) -> asyncio.Task:
+        endpoint, last = candidate
+        task = asyncio.ensure_future(_atracked(attempt, endpoint, last, is_failure, timer))
+        pending[task] = endpoint
+        return task
+
+    clock: Tuple[asyncio.Event, SendTimer]
+
+    def launch_timed(candidate: Tuple[AppConfig, bool]) -> None:
+        nonlocal clock
+        sent = asyncio.Event()
+        timer = SendTimer(sent.set)
+        launch(candidate, timer).add_done_callback(lambda _: sent.set())
+        clock = (sent, timer)
+
+    launch_timed(first)
+    hedged = delay is None
+    try:
+        while pending:
+            timeout = None
+            if not hedged:
+                sent, timer = clock
+                await sent.wait()
+                timeout = max(0.0, delay - timer.elapsed())
+            done, _ = await asyncio.wait(pending, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                candidate = candidates.next()
+                if candidate is not None:
+                    _count('hedged')
+                    launch(candidate, SendTimer())
+                continue
+            for task in done:
+                endpoint = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    if not is_failure(e):
+                        raise
+                    error = e
+                    continue
+                if endpoint is not primary and delay is not None and hedged:
+                    _count('hedge_wins')
+                return result, endpoint
+            if not pending:
+                candidate = candidates.next()
+                if candidate is not None:
+                    _count('failovers')
+                    launch_timed(candidate)
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
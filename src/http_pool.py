@@ -0,0 +1,348 @@
+"""
+HTTP连接池模块
+基于http.client的持久连接（keep-alive），按主机维护连接池，避免每次请求重复TCP/TLS握手
+"""
+
+import http.client
+import ssl
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Tuple
+
+try:
+    from .metrics import observe_stage, timed
+except ImportError:
+    from metrics import observe_stage, timed
+
+
+# 复用的连接在发送请求或读取响应头时被服务端关闭，说明连接已失效，可安全重连重试
+_STALE_CONNECTION_ERRORS = (
+    ConnectionResetError,
+    BrokenPipeError,
+    ConnectionAbortedError,
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    http.client.ResponseNotReady,
+)
+
+
+class PooledResponse:
+    """已完整读取的HTTP响应"""
+
+    def __init__(self, status: int, reason: str, headers: Dict[str, str], data: bytes):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.data = data
+
+    def text(self, encoding: str = 'utf-8') -> str:
+        """以文本形式返回响应体"""
+        return self.data.decode(encoding, errors='replace')
+
+
+class HTTPConnectionPool:
+    """
+    单个主机的持久连接池
+
+    空闲连接按后进先出复用；超过空闲超时的连接会被丢弃，
+    复用的连接若已被服务端关闭，会自动新建连接重试一次。
+    """
+
+    def __init__(self, scheme: str, host: str, port: Optional[int] = None,
+                 maxsize: int = 10, idle_timeout: float = 60.0,
+                 proxy: Optional[str] = None,
+                 ssl_context: Optional[ssl.SSLContext] = None):
+        """
+        Args:
+            scheme: http 或 https
+            host: 目标主机
+            port: 目标端口，默认按scheme确定
+            maxsize: 最多保留的空闲连接数
+            idle_timeout: 空闲连接的最长保留时间（秒）
+            proxy: 代理地址（如 http://proxy:3128），为空表示直连
+            ssl_context: HTTPS使用的SSL上下文
+        """
+        if scheme not in ('http', 'https'):
+            raise ValueError(f"不支持的URL协议: {scheme}")
+        self.scheme = scheme
+        self.host = host
+        self.port = port or (443 if scheme == 'https' else 80)
+        self.maxsize = max(1, maxsize)
+        self.idle_timeout = idle_timeout
+        self.proxy = urllib.parse.urlsplit(proxy) if proxy else None
+        self.ssl_context = ssl_context
+        self._idle: Deque[Tuple[http.client.HTTPConnection, float]] = deque()
+        self._lock = threading.Lock()
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    def _new_conn(self, timeout: float) -> http.client.HTTPConnection:
+        """新建连接（尚未建立socket，首次请求时才连接）"""
+        self.connections_created += 1
+        if self.proxy:
+            proxy_host = self.proxy.hostname
+            proxy_port = self.proxy.port or 80
+            if self.scheme == 'https':
+                conn = http.client.HTTPSConnection(
+                    proxy_host, proxy_port, timeout=timeout, context=self.ssl_context
+                )
+                conn.set_tunnel(self.host, self.port)
+                return conn
+            return http.client.HTTPConnection(proxy_host, proxy_port, timeout=timeout)
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=timeout, context=self.ssl_context
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _get_conn(self, timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        """取出一个空闲连接，没有可用连接时新建；返回 (连接, 是否复用)"""
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    self.connections_reused += 1
+                    break
+                conn.close()
+            else:
+                conn = None
+
+        if conn is None:
+            return self._new_conn(timeout), False
+
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _put_conn(self, conn: http.client.HTTPConnection) -> None:
+        """归还连接，超出容量时关闭"""
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def _request_target(self, path: str) -> str:
+        """HTTP代理需要使用绝对URL作为请求目标"""
+        if self.proxy and self.scheme == 'http':
+            return f"http://{self.host}:{self.port}{path}"
+        return path
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None,
+                timeout: float = 30.0) -> PooledResponse:
+        """
+        发送请求并完整读取响应
+
+        Args:
+            method: HTTP方法
+            path: 请求路径（含查询字符串）
+            body: 请求体
+            headers: 请求头
+            timeout: 连接和读取超时（秒）
+
+        Returns:
+            PooledResponse: 响应对象
+
+        Raises:
+            OSError, http.client.HTTPException: 网络或协议错误
+        """
+        with self.stream(method, path, body, headers, timeout) as response:
+            with timed('body_read'):
+                data = response.read()
+            return PooledResponse(
+                response.status,
+                response.reason,
+                {k.lower(): v for k, v in response.getheaders()},
+                data,
+            )
+
+    @contextmanager
+    def stream(self, method: str, path: str, body: Optional[bytes] = None,
+               headers: Optional[Dict[str, str]] = None,
+               timeout: float = 30.0) -> Iterator[http.client.HTTPResponse]:
+        """
+        发送请求并返回未读取的响应，供调用方逐行/分块读取（如SSE流）
+
+        退出上下文时，若响应已读完且连接可复用则归还连接池，否则关闭连接。
+
+        Args:
+            method: HTTP方法
+            path: 请求路径（含查询字符串）
+            body: 请求体
+            headers: 请求头
+            timeout: 连接和单次读取超时（秒）
+
+        Yields:
+            http.client.HTTPResponse: 响应对象
+        """
+        target = self._request_target(path)
+        while True:
+            conn, reused = self._get_conn(timeout)
+            try:
+                if not reused:
+                    with timed('connect'):
+                        conn.connect()
+                sent = time.perf_counter()
+                conn.request(method, target, body=body, headers=headers or {})
+                response = conn.getresponse()
+                observe_stage('ttfb', time.perf_counter() - sent)
+            except _STALE_CONNECTION_ERRORS:
+                conn.close()
+                if reused:
+                    # 复用的连接已失效，换新连接重试
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            break
+
+        try:
+            yield response
+        except BaseException:
+            conn.close()
+            raise
+
+        if response.isclosed() and not response.will_close:
+            self._put_conn(conn)
+        else:
+            conn.close()
+
+    def close(self) -> None:
+        """关闭所有空闲连接"""
+        with self._lock:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                conn.close()
+
+
+class PoolManager:
+    """
+    按 (scheme, host, port) 管理连接池，线程安全，可被并发调用方共享
+    """
+
+    def __init__(self, maxsize: int = 10, idle_timeout: float = 60.0):
+        """
+        Args:
+            maxsize: 每个主机最多保留的空闲连接数
+            idle_timeout: 空闲连接的最长保留时间（秒）
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._pools: Dict[Tuple[str, str, int], HTTPConnectionPool] = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+
+    def connection_pool(self, url: str) -> HTTPConnectionPool:
+        """
+        获取URL对应主机的连接池，不存在时创建
+
+        Args:
+            url: 完整URL
+
+        Returns:
+            HTTPConnectionPool: 连接池
+        """
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname or '', port)
+
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                proxy = None
+                if not urllib.request.proxy_bypass(parts.hostname or ''):
+                    proxy = urllib.request.getproxies().get(scheme)
+                pool = HTTPConnectionPool(
+                    scheme, key[1], port,
+                    maxsize=self.maxsize,
+                    idle_timeout=self.idle_timeout,
+                    proxy=proxy,
+                    ssl_context=self._ssl_context,
+                )
+                self._pools[key] = pool
+            return pool
+
+    def request(self, method: str, url: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None,
+                timeout: float = 30.0) -> PooledResponse:
+        """
+        通过对应主机的连接池发送请求
+
+        Args:
+            method: HTTP方法
+            url: 完整URL
+            body: 请求体
+            headers: 请求头
+            timeout: 超时（秒）
+
+        Returns:
+            PooledResponse: 响应对象
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        return self.connection_pool(url).request(method, path, body, headers, timeout)
+
+    @contextmanager
+    def stream(self, method: str, url: str, body: Optional[bytes] = None,
+               headers: Optional[Dict[str, str]] = None,
+               timeout: float = 30.0) -> Iterator[http.client.HTTPResponse]:
+        """
+        通过对应主机的连接池发送请求，返回可逐行读取的响应（见 HTTPConnectionPool.stream）
+
+        Args:
+            method: HTTP方法
+            url: 完整URL
+            body: 请求体
+            headers: 请求头
+            timeout: 超时（秒）
+
+        Yields:
+            http.client.HTTPResponse: 响应对象
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        with self.connection_pool(url).stream(method, path, body, headers, timeout) as response:
+            yield response
+
+    def clear(self) -> None:
+        """关闭所有连接池"""
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+_default_manager: Optional[PoolManager] = None
+_default_manager_lock = threading.Lock()
+
+
+def get_pool_manager(maxsize: int = 10, idle_timeout: float = 60.0) -> PoolManager:
+    """
+    获取进程内共享的连接池管理器（首次调用时按参数创建）
+
+    Args:
+        maxsize: 每个主机最多保留的空闲连接数
+        idle_timeout: 空闲连接的最长保留时间（秒）
+
+    Returns:
+        PoolManager: 共享的连接池管理器
+    """
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = PoolManager(maxsize=maxsize, idle_timeout=idle_timeout)
+        return _default_manager
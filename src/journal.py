@@ -0,0 +1,200 @@
+"""
+批量评估日志模块
+只追加的JSONL日志，逐条记录每条记录的输入摘要和评估结果，按组fsync落盘；
+批量评估中断后以 --resume 重新运行时跳过已成功的记录，只重试失败和未完成的记录
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# 日志中的记录: (record_id, surgery_type, surgery_steps)，与 batch.BatchRecord 相同
+JournalRecord = Tuple[str, str, str]
+
+
+def record_hash(surgery_type: str, surgery_steps: str) -> str:
+    """
+    计算记录的输入摘要（手术类型和内容相同的记录摘要相同）
+
+    Args:
+        surgery_type: 手术类型
+        surgery_steps: 手术步骤描述
+
+    Returns:
+        str: SHA-256十六进制摘要
+    """
+    return hashlib.sha256(f"{surgery_type}\n{surgery_steps}".encode('utf-8')).hexdigest()
+
+
+def read_journal(path: str) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    读取日志中的有效条目
+
+    最后一行若没有换行符或不是有效JSON，视为写入时崩溃留下的残缺行并忽略；
+    中间的损坏行打印警告后跳过。
+
+    Args:
+        path: 日志文件路径
+
+    Returns:
+        Tuple[List[Dict[str, Any]], int]: (有效条目, 最后一个完整行之后的字节偏移)
+    """
+    entries: List[Dict[str, Any]] = []
+    valid_end = 0
+    with open(path, 'rb') as f:
+        # 逐行读取，多读一行以判断当前行是否为末行
+        lines = iter(f)
+        raw = next(lines, None)
+        line_no = 0
+        while raw is not None:
+            following = next(lines, None)
+            line_no += 1
+            try:
+                entry = json.loads(raw)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                entry = None
+            if following is None and (entry is None or not raw.endswith(b'\n')):
+                print(f"警告: 日志 {path} 末行不完整（{len(raw)} 字节），已忽略", file=sys.stderr)
+                break
+            valid_end += len(raw)
+            if isinstance(entry, dict) and 'id' in entry and 'hash' in entry:
+                entries.append(entry)
+            elif raw.strip():
+                print(f"警告: 日志 {path} 第{line_no}行无效，已跳过", file=sys.stderr)
+            raw = following
+    return entries, valid_end
+
+
+class BatchJournal:
+    """
+    只追加的批量评估日志，线程安全
+
+    每条记录评估完成后立即追加一行并写入操作系统缓冲（进程崩溃不丢失），
+    每 ``sync_every`` 条或距上次落盘超过 ``sync_interval`` 秒时fsync一次
+    （断电或系统崩溃最多丢失最后一组，恢复时这些记录会重新评估）。
+    """
+
+    def __init__(self, path: str, resume: bool = False, sync_every: int = 32,
+                 sync_interval: float = 1.0):
+        """
+        Args:
+            path: 日志文件路径
+            resume: 为True时加载已有日志并在其后追加；为False时日志文件不得已存在
+            sync_every: 每写入多少条fsync一次
+            sync_interval: 距上次fsync的最长秒数
+
+        Raises:
+            FileExistsError: 未指定resume而日志文件已存在（避免覆盖已付费的结果）
+        """
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self.sync_interval = sync_interval
+        self.resumed = 0
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._completed: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(path):
+            if not resume:
+                raise FileExistsError(f"日志文件已存在: {path}（使用 --resume 继续，或删除后重新开始）")
+            entries, valid_end = read_journal(path)
+            if valid_end < os.path.getsize(path):
+                # 截掉残缺的末行，避免新条目接在残缺内容后面
+                with open(path, 'r+b') as f:
+                    f.truncate(valid_end)
+            for entry in entries:
+                key = (entry['id'], entry['hash'])
+                if entry.get('status') == 'ok':
+                    self._completed[key] = entry['line']
+                else:
+                    self._completed.pop(key, None)
+
+        self._file = open(path, 'a', encoding='utf-8')
+
+    @property
+    def completed_count(self) -> int:
+        """日志中已成功的记录数"""
+        return len(self._completed)
+
+    def completed_line(self, record: JournalRecord) -> Optional[Dict[str, Any]]:
+        """
+        查找记录已成功的输出行
+
+        Args:
+            record: (记录ID, 手术类型, 手术步骤)
+
+        Returns:
+            Optional[Dict[str, Any]]: 记录ID和输入摘要都一致且已成功时返回原输出行，否则返回None
+        """
+        record_id, surgery_type, surgery_steps = record
+        return self._completed.get((record_id, record_hash(surgery_type, surgery_steps)))
+
+    def skip_completed(self, records: Iterable[JournalRecord],
+                       replay: Callable[[Dict[str, Any]], None]) -> Iterator[JournalRecord]:
+        """
+        过滤已成功的记录，其原输出行立即交给 ``replay`` 重新写出（不在内存中积压）
+
+        Args:
+            records: 记录迭代器
+            replay: 写出已完成记录输出行的函数（在迭代方的线程中调用）
+
+        Yields:
+            JournalRecord: 需要评估的记录
+        """
+        for record in records:
+            line = self.completed_line(record)
+            if line is None:
+                yield record
+            else:
+                self.resumed += 1
+                replay(line)
+
+    def append(self, record: JournalRecord, line: Dict[str, Any]) -> None:
+        """
+        追加一条记录的评估结果（按组fsync）
+
+        Args:
+            record: (记录ID, 手术类型, 手术步骤)
+            line: 该记录的输出行
+        """
+        record_id, surgery_type, surgery_steps = record
+        entry = {
+            'id': record_id,
+            'hash': record_hash(surgery_type, surgery_steps),
+            'status': line['status'],
+            'line': line,
+        }
+        data = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            self._unsynced += 1
+            if (self._unsynced >= self.sync_every
+                    or time.monotonic() - self._last_sync >= self.sync_interval):
+                self._sync()
+
+    def _sync(self) -> None:
+        """fsync日志文件（调用方持有锁）"""
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        """落盘并关闭日志文件"""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            if self._unsynced:
+                self._sync()
+            self._file.close()
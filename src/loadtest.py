@@ -0,0 +1,260 @@
+"""
+端到端压测模块
+以不同并发度驱动 evaluate_surgery_steps（单条/批量/异步模式），
+统计吞吐量、p50/p95/p99延迟和错误率，默认使用进程内模拟服务
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import io
+import json
+import os
+import sys
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence, Tuple
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from .evaluate import evaluate_surgery_steps, aevaluate_surgery_steps
+    from .batch import iter_directory_records, run_batch
+    from .mock_server import add_mock_arguments, mock_options_from_args, start_mock_server
+    from .utils import AppConfig, get_config
+except ImportError:
+    from evaluate import evaluate_surgery_steps, aevaluate_surgery_steps
+    from batch import iter_directory_records, run_batch
+    from mock_server import add_mock_arguments, mock_options_from_args, start_mock_server
+    from utils import AppConfig, get_config
+
+
+DEFAULT_SAMPLES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'samples'
+)
+
+# 压测记录: (手术类型, 手术步骤)
+Workload = List[Tuple[str, str]]
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """
+    最近秩法计算百分位数
+
+    Args:
+        sorted_values: 已排序的数值
+        pct: 百分位（0-100）
+
+    Returns:
+        float: 百分位数，空序列返回0
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def load_workload(samples_dir: str, total: int) -> Workload:
+    """
+    从样例目录构造压测负载，循环使用样例直到达到请求总数
+
+    每条记录附加序号，使请求内容各不相同（避免命中缓存或被合并）。
+    """
+    samples = [(surgery_type, steps) for _, surgery_type, steps in iter_directory_records(samples_dir)]
+    if not samples:
+        raise ValueError(f"样例目录中没有 .txt 记录: {samples_dir}")
+    return [
+        (samples[i % len(samples)][0], f"{samples[i % len(samples)][1]}\n（压测记录 #{i}）")
+        for i in range(total)
+    ]
+
+
+def _timed_call(config: AppConfig, surgery_type: str, steps: str) -> Tuple[float, bool]:
+    start = time.perf_counter()
+    try:
+        evaluate_surgery_steps(steps, surgery_type, config=config)
+        ok = True
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_sync_level(workload: Workload, concurrency: int, config: AppConfig) -> List[Tuple[float, bool]]:
+    """线程池并发调用 evaluate_surgery_steps"""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_timed_call, config, t, s) for t, s in workload]
+        return [f.result() for f in futures]
+
+
+def run_batch_level(workload: Workload, concurrency: int, config: AppConfig) -> List[Tuple[float, bool]]:
+    """通过批量模式 run_batch 评估，延迟取每行输出中的 elapsed"""
+    records = ((f"load-{i}", t, s) for i, (t, s) in enumerate(workload))
+    output = io.StringIO()
+    run_batch(records, lambda s, t: evaluate_surgery_steps(s, t, config=config),
+              output, workers=concurrency)
+    samples = []
+    for line in output.getvalue().splitlines():
+        entry = json.loads(line)
+        samples.append((entry['elapsed'], entry['status'] == 'ok'))
+    return samples
+
+
+def run_async_level(workload: Workload, concurrency: int, config: AppConfig) -> List[Tuple[float, bool]]:
+    """单个事件循环内以信号量限制并发调用 aevaluate_surgery_steps"""
+    async def one(semaphore: asyncio.Semaphore, surgery_type: str, steps: str) -> Tuple[float, bool]:
+        # 延迟从获得并发槽位开始计时，与线程池模式口径一致
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await aevaluate_surgery_steps(steps, surgery_type, config=config)
+                ok = True
+            except Exception:
+                ok = False
+            return time.perf_counter() - start, ok
+
+    async def run() -> List[Tuple[float, bool]]:
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[one(semaphore, t, s) for t, s in workload])
+
+    return asyncio.run(run())
+
+
+MODES = {
+    'sync': run_sync_level,
+    'batch': run_batch_level,
+    'async': run_async_level,
+}
+
+
+def summarize(samples: List[Tuple[float, bool]], elapsed: float) -> Dict[str, Any]:
+    """
+    汇总一轮压测结果
+
+    Args:
+        samples: (延迟秒数, 是否成功) 列表
+        elapsed: 本轮总耗时（秒）
+
+    Returns:
+        Dict[str, Any]: 请求数、吞吐量、延迟百分位和错误率
+    """
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        'requests': len(samples),
+        'elapsed': round(elapsed, 3),
+        'rps': round(len(samples) / elapsed, 2) if elapsed > 0 else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+    }
+
+
+def run_sweep(mode: str, levels: Sequence[int], requests: int, config: AppConfig,
+              samples_dir: str = DEFAULT_SAMPLES_DIR) -> List[Dict[str, Any]]:
+    """
+    按并发度列表依次压测
+
+    Args:
+        mode: sync / batch / async
+        levels: 并发度列表
+        requests: 每个并发度的请求数
+        config: 运行配置（通常指向模拟服务）
+        samples_dir: 样例目录
+
+    Returns:
+        List[Dict[str, Any]]: 每个并发度的汇总结果
+    """
+    runner = MODES[mode]
+    # 自适应并发上限不能低于压测的最大并发度
+    config = dataclasses.replace(config, max_concurrency=max(config.max_concurrency, max(levels)))
+    results = []
+    for concurrency in levels:
+        workload = load_workload(samples_dir, requests)
+        start = time.perf_counter()
+        samples = runner(workload, concurrency, config)
+        summary = summarize(samples, time.perf_counter() - start)
+        summary.update({'mode': mode, 'concurrency': concurrency})
+        results.append(summary)
+    return results
+
+
+def _display_width(text: str) -> int:
+    """终端显示宽度（中文等全角字符占两列）"""
+    return sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in text)
+
+
+def format_sweep_table(results: List[Dict[str, Any]]) -> str:
+    """格式化压测结果表格"""
+    columns = [
+        ('模式', 'mode', '{}'), ('并发', 'concurrency', '{}'), ('请求数', 'requests', '{}'),
+        ('req/s', 'rps', '{:.2f}'), ('p50(ms)', 'p50_ms', '{:.1f}'),
+        ('p95(ms)', 'p95_ms', '{:.1f}'), ('p99(ms)', 'p99_ms', '{:.1f}'),
+        ('错误率', 'error_rate', '{:.2%}'),
+    ]
+    width = 10
+
+    def cell(text: str) -> str:
+        return ' ' * (width - _display_width(text)) + text
+
+    lines = [''.join(cell(title) for title, _, _ in columns)]
+    for r in results:
+        lines.append(''.join(cell(fmt.format(r[key])) for _, key, fmt in columns))
+    return "\n".join(lines)
+
+
+def main() -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(
+        description="手术质控评估端到端压测工具",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+使用示例:
+  python src/loadtest.py --mode sync --concurrency 1,4,16 --requests 100
+  python src/loadtest.py --mode async --concurrency 16,64,256 --latency lognormal:-1,0.5
+  python src/loadtest.py --base-url http://127.0.0.1:8000 --mode batch
+        """
+    )
+    parser.add_argument("--mode", choices=list(MODES), default="sync", help="驱动模式 (默认: sync)")
+    parser.add_argument("--concurrency", default="1,4,16", help="逗号分隔的并发度列表 (默认: 1,4,16)")
+    parser.add_argument("--requests", "-n", type=int, default=50, help="每个并发度的请求数 (默认: 50)")
+    parser.add_argument("--samples", default=DEFAULT_SAMPLES_DIR, help="样例目录")
+    parser.add_argument("--base-url", help="使用已运行的服务，不启动进程内模拟服务")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        levels = [int(v) for v in args.concurrency.split(',') if v.strip()]
+    except ValueError:
+        parser.error("--concurrency 必须是逗号分隔的整数")
+    if not levels or min(levels) < 1:
+        parser.error("--concurrency 必须是正整数")
+
+    server = None
+    if args.base_url:
+        config = dataclasses.replace(get_config(), base_url=args.base_url)
+    else:
+        server = start_mock_server(options=mock_options_from_args(args))
+        config = dataclasses.replace(get_config(), base_url=server.base_url, api_key='sk-mock')
+        print(f"已启动模拟服务: {server.base_url} (延迟 {args.latency})", file=sys.stderr)
+
+    try:
+        results = run_sweep(args.mode, levels, args.requests, config, args.samples)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(format_sweep_table(results))
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
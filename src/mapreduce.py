@@ -0,0 +1,211 @@
+"""
+长记录分段评估模块
+将超长手术记录按编号步骤切分为若干段并行评估，再合并为一个评估结果，
+长记录的延迟取决于最慢的一段，而不是整篇生成
+"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from .tokens import DEFAULT_PROFILE, ModelProfile, estimate_text_tokens, get_model_profile
+except ImportError:
+    from tokens import DEFAULT_PROFILE, ModelProfile, estimate_text_tokens, get_model_profile
+
+
+# 每段手术步骤的默认令牌预算
+DEFAULT_SEGMENT_TOKENS = 1500
+
+# 单条记录最多同时评估的段数
+MAX_SEGMENT_WORKERS = 8
+
+# 编号步骤行，如 "1. "、"2、"、"3）"
+_STEP_LINE = re.compile(r'^\s*\d+\s*[.、．)）]')
+
+# 句末标点（超长步骤在句子边界处再切分）
+_SENTENCE_END = re.compile(r'(?<=[。；;！？!?])')
+
+# 去重时忽略的空白和标点
+_NORMALIZE = re.compile(r'[\s,.;:!?，。；：！？、“”"\'（）()【】\[\]]+')
+
+_RISK_LEVELS = ['Low', 'Medium', 'High']
+
+# 提示模型本段只是完整记录的一部分
+SEGMENT_NOTE_TEMPLATE = (
+    "（注意：以下为完整手术记录的第{index}/{count}部分，仅评估本部分列出的步骤，"
+    "不要因缺少其他部分的步骤而扣分）"
+)
+
+
+def _split_steps(surgery_steps: str) -> Tuple[str, List[str]]:
+    """
+    按编号步骤行切分记录
+
+    Returns:
+        Tuple[str, List[str]]: (首个步骤之前的记录头, 步骤列表)；
+        步骤之后不带编号的行归入前一个步骤
+    """
+    header: List[str] = []
+    steps: List[str] = []
+    for line in surgery_steps.strip().splitlines():
+        if _STEP_LINE.match(line):
+            steps.append(line.strip())
+        elif steps:
+            if line.strip():
+                steps[-1] += "\n" + line.strip()
+        else:
+            header.append(line)
+    return "\n".join(header).strip(), steps
+
+
+def _split_oversized(steps: List[str], max_tokens: int, profile: ModelProfile) -> List[str]:
+    """将超出预算的单个步骤在句子边界处切开"""
+    pieces: List[str] = []
+    for step in steps:
+        if estimate_text_tokens(step, profile) <= max_tokens:
+            pieces.append(step)
+            continue
+        current = ''
+        for sentence in _SENTENCE_END.split(step):
+            if current and estimate_text_tokens(current + sentence, profile) > max_tokens:
+                pieces.append(current.strip())
+                current = ''
+            current += sentence
+        if current.strip():
+            pieces.append(current.strip())
+    return pieces
+
+
+def split_record(surgery_steps: str, max_segment_tokens: int = DEFAULT_SEGMENT_TOKENS,
+                 model: Optional[str] = None) -> List[str]:
+    """
+    将手术记录切分为与步骤对齐的若干段
+
+    每段包含记录头（患者、诊断等）和若干连续步骤，步骤部分不超过令牌预算；
+    单个步骤超出预算时在句子边界处切开。没有编号步骤的记录按段落切分。
+
+    Args:
+        surgery_steps: 手术步骤描述
+        max_segment_tokens: 每段步骤的令牌预算
+        model: 目标模型名称（决定令牌估算粒度）
+
+    Returns:
+        List[str]: 分段后的记录文本；无需切分时只有一段（原文）
+    """
+    profile = get_model_profile(model) if model else DEFAULT_PROFILE
+    header, steps = _split_steps(surgery_steps)
+    if len(steps) < 2:
+        header = ''
+        steps = [p.strip() for p in re.split(r'\n\s*\n', surgery_steps.strip()) if p.strip()]
+
+    groups: List[List[str]] = []
+    used = 0
+    for step in _split_oversized(steps, max_segment_tokens, profile):
+        tokens = estimate_text_tokens(step, profile)
+        if groups and used + tokens <= max_segment_tokens:
+            groups[-1].append(step)
+            used += tokens
+        else:
+            groups.append([step])
+            used = tokens
+
+    if len(groups) <= 1:
+        return [surgery_steps]
+
+    segments = []
+    for index, group in enumerate(groups, 1):
+        note = SEGMENT_NOTE_TEMPLATE.format(index=index, count=len(groups))
+        parts = [note, header, "\n".join(group)] if header else [note, "\n".join(group)]
+        segments.append("\n\n".join(parts))
+    return segments
+
+
+def _normalize(text: str) -> str:
+    return _NORMALIZE.sub('', text).lower()
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+def dedupe_items(items: List[str], threshold: float = 0.8) -> List[str]:
+    """
+    去除重复和近似重复的条目（保留先出现的一条）
+
+    只有规范化后完全相同或整体高度相似的条目才视为重复；短条目被长条目包含
+    （如“出血”与“术中出血风险”）时两者可能是不同的风险点，不做合并。
+
+    Args:
+        items: 风险点或建议列表
+        threshold: 字符二元组Jaccard相似度阈值，达到即视为重复
+
+    Returns:
+        List[str]: 去重后的列表
+    """
+    kept: List[str] = []
+    seen: List[Tuple[str, set]] = []
+    for item in items:
+        normalized = _normalize(item)
+        if not normalized:
+            continue
+        grams = _bigrams(normalized)
+        if any(normalized == other
+               or len(grams & other_grams) / len(grams | other_grams) >= threshold
+               for other, other_grams in seen):
+            continue
+        seen.append((normalized, grams))
+        kept.append(item)
+    return kept
+
+
+def merge_results(results: List[Dict[str, Any]], weights: List[float]) -> Dict[str, Any]:
+    """
+    合并各段评估结果
+
+    总分按各段步骤长度加权平均，风险等级取最高，风险点和建议按出现顺序合并去重。
+
+    Args:
+        results: 各段的评估结果
+        weights: 各段权重（通常为步骤令牌数）
+
+    Returns:
+        Dict[str, Any]: 合并后的评估结果
+    """
+    total_weight = sum(weights) or len(results)
+    score = sum(r['total_score'] * (w or 1) for r, w in zip(results, weights)) / total_weight
+    levels = [r.get('risk_level') for r in results if r.get('risk_level') in _RISK_LEVELS]
+    return {
+        'total_score': round(score, 1),
+        'risks': dedupe_items([risk for r in results for risk in r['risks']]),
+        'suggestions': dedupe_items([s for r in results for s in r['suggestions']]),
+        'risk_level': max(levels, key=_RISK_LEVELS.index) if levels else 'Unknown',
+    }
+
+
+def evaluate_long_record(surgery_steps: str, surgery_type: str,
+                         evaluate_fn: Callable[[str, str], Dict[str, Any]],
+                         max_segment_tokens: int = DEFAULT_SEGMENT_TOKENS,
+                         model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    分段并行评估长记录并合并结果（短记录直接整体评估）
+
+    Args:
+        surgery_steps: 手术步骤描述
+        surgery_type: 手术类型
+        evaluate_fn: 单段评估函数，签名为 (手术步骤, 手术类型) -> 评估结果
+        max_segment_tokens: 每段步骤的令牌预算
+        model: 目标模型名称
+
+    Returns:
+        Dict[str, Any]: 评估结果
+    """
+    segments = split_record(surgery_steps, max_segment_tokens, model)
+    if len(segments) == 1:
+        return evaluate_fn(surgery_steps, surgery_type)
+
+    profile = get_model_profile(model) if model else DEFAULT_PROFILE
+    weights = [estimate_text_tokens(segment, profile) for segment in segments]
+    with ThreadPoolExecutor(max_workers=min(len(segments), MAX_SEGMENT_WORKERS)) as executor:
+        results = list(executor.map(lambda segment: evaluate_fn(segment, surgery_type), segments))
+    return merge_results(results, weights)
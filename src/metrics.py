@@ -0,0 +1,404 @@
+"""
+运行指标模块
+按阶段记录每次调用的耗时和令牌用量，汇总为直方图，
+导出为Prometheus文本格式（写入文件或通过HTTP /metrics 端点暴露）
+"""
+
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# 记录的阶段（按一次评估中的先后顺序）
+STAGES = (
+    'config_load',   # 获取配置（含 .env 修改检查）
+    'prompt_build',  # 构建评估消息
+    'serialize',     # 请求体JSON序列化
+    'connect',       # 新建TCP/TLS连接（复用连接时不记录）
+    'ttfb',          # 发出请求到收到响应头
+    'body_read',     # 读取响应体（流式调用为读取整个事件流）
+    'json_extract',  # 从响应中提取评估JSON
+    'validate',      # 评估结果格式验证
+)
+
+# 耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 每次调用令牌数直方图的桶上界
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+# Prometheus指标名前缀
+METRIC_PREFIX = 'hospital_agent'
+
+
+class Histogram:
+    """
+    固定桶直方图（非线程安全，由 MetricsRegistry 加锁访问）
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        """
+        Args:
+            buckets: 递增的桶上界，最后隐含 +Inf 桶
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """记录一个观测值"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.count == 1 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        按桶内线性插值估算分位数（与Prometheus的 histogram_quantile 相同的近似）
+
+        Args:
+            q: 分位数（0-1）
+
+        Returns:
+            float: 估算值，限制在观测到的最小值和最大值之间；没有观测值时为0
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                estimate = lower + (upper - lower) * (rank - cumulative) / bucket_count
+                return min(max(estimate, self.min), self.max)
+            cumulative += bucket_count
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """返回次数、合计、均值、p50、p95和最大值"""
+        return {
+            'count': self.count,
+            'total': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': self.max,
+        }
+
+
+@dataclass
+class CallMetrics:
+    """
+    一次调用范围内（见 track_call）各阶段的累计耗时和令牌用量
+    """
+    stages: Dict[str, float] = field(default_factory=dict)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    completions: int = 0
+
+    @property
+    def has_usage(self) -> bool:
+        """是否收到过上游返回的令牌用量"""
+        return self.completions > 0
+
+
+_current_call: contextvars.ContextVar[Optional[CallMetrics]] = \
+    contextvars.ContextVar('current_call_metrics', default=None)
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表，线程安全
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Histogram] = {}
+        self._tokens: Dict[str, Histogram] = {}
+        self._token_totals: Dict[Tuple[str, str], int] = {}
+        self._completions: Dict[str, int] = {}
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        """记录一个阶段的耗时"""
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def record_usage(self, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """记录一次补全的令牌用量"""
+        with self._lock:
+            self._completions[model] = self._completions.get(model, 0) + 1
+            for kind, tokens in (('prompt', prompt_tokens), ('completion', completion_tokens)):
+                histogram = self._tokens.get(kind)
+                if histogram is None:
+                    histogram = self._tokens[kind] = Histogram(TOKEN_BUCKETS)
+                histogram.observe(tokens)
+                key = (kind, model)
+                self._token_totals[key] = self._token_totals.get(key, 0) + tokens
+
+    def stage_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        获取各阶段的耗时统计
+
+        Returns:
+            Dict[str, Dict[str, float]]: 阶段 -> 次数、合计、均值、p50、p95和最大值（秒），按 STAGES 顺序
+        """
+        with self._lock:
+            return {stage: self._stages[stage].summary()
+                    for stage in sorted(self._stages, key=_stage_order)}
+
+    def token_stats(self) -> Dict[str, Any]:
+        """
+        获取令牌用量统计
+
+        Returns:
+            Dict[str, Any]: 补全次数，以及提示/生成令牌的合计和每次调用的均值、p95
+        """
+        with self._lock:
+            stats: Dict[str, Any] = {'completions': sum(self._completions.values())}
+            for kind, histogram in self._tokens.items():
+                summary = histogram.summary()
+                stats[kind] = {'total': int(summary['total']), 'mean': summary['mean'],
+                               'p95': summary['p95']}
+            return stats
+
+    def render(self) -> str:
+        """
+        以Prometheus文本格式（0.0.4）输出所有指标
+
+        Returns:
+            str: 指标文本
+        """
+        lines: List[str] = []
+        with self._lock:
+            name = f"{METRIC_PREFIX}_stage_duration_seconds"
+            lines.append(f"# HELP {name} Time spent in each evaluation stage.")
+            lines.append(f"# TYPE {name} histogram")
+            for stage in sorted(self._stages, key=_stage_order):
+                lines.extend(_histogram_lines(name, f'stage="{stage}"', self._stages[stage]))
+
+            name = f"{METRIC_PREFIX}_call_tokens"
+            lines.append(f"# HELP {name} Tokens used per completion, as reported by the API.")
+            lines.append(f"# TYPE {name} histogram")
+            for kind in sorted(self._tokens):
+                lines.extend(_histogram_lines(name, f'kind="{kind}"', self._tokens[kind]))
+
+            name = f"{METRIC_PREFIX}_tokens_total"
+            lines.append(f"# HELP {name} Tokens used, as reported by the API.")
+            lines.append(f"# TYPE {name} counter")
+            for (kind, model), total in sorted(self._token_totals.items()):
+                lines.append(f'{name}{{kind="{kind}",model="{_escape(model)}"}} {total}')
+
+            name = f"{METRIC_PREFIX}_completions_total"
+            lines.append(f"# HELP {name} Completions with a usage block.")
+            lines.append(f"# TYPE {name} counter")
+            for model, count in sorted(self._completions.items()):
+                lines.append(f'{name}{{model="{_escape(model)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """清空所有指标"""
+        with self._lock:
+            self._stages.clear()
+            self._tokens.clear()
+            self._token_totals.clear()
+            self._completions.clear()
+
+
+def _stage_order(stage: str) -> Tuple[int, str]:
+    """按 STAGES 中的顺序排序，未知阶段排在最后"""
+    return (STAGES.index(stage) if stage in STAGES else len(STAGES), stage)
+
+
+def _escape(value: str) -> str:
+    """转义Prometheus标签值"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram) -> Iterator[str]:
+    """输出一个直方图的累计桶、合计和次数"""
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{labels},le="{_format_number(bound)}"}} {cumulative}'
+    yield f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}'
+    yield f'{name}_sum{{{labels}}} {histogram.sum!r}'
+    yield f'{name}_count{{{labels}}} {histogram.count}'
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    """获取进程共享的指标注册表"""
+    return _registry
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """
+    记录一个阶段的耗时（同时累计到当前调用范围，见 track_call）
+
+    Args:
+        stage: 阶段名称（见 STAGES）
+        seconds: 耗时（秒）
+    """
+    _registry.observe_stage(stage, seconds)
+    call = _current_call.get()
+    if call is not None:
+        call.stages[stage] = call.stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    记录代码块耗时的上下文管理器（代码块抛出异常时同样记录）
+
+    Args:
+        stage: 阶段名称（见 STAGES）
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def record_usage(usage: Any, model: str) -> None:
+    """
+    记录Chat Completions响应中的 ``usage`` 字段（缺失或格式不符时忽略）
+
+    Args:
+        usage: 响应的 usage 字段
+        model: 响应的模型名称
+    """
+    if not isinstance(usage, dict):
+        return
+    prompt_tokens = usage.get('prompt_tokens')
+    completion_tokens = usage.get('completion_tokens')
+    if not isinstance(prompt_tokens, int) or not isinstance(completion_tokens, int):
+        return
+    _registry.record_usage(model or 'unknown', prompt_tokens, completion_tokens)
+    call = _current_call.get()
+    if call is not None:
+        call.prompt_tokens += prompt_tokens
+        call.completion_tokens += completion_tokens
+        call.completions += 1
+
+
+@contextmanager
+def track_call() -> Iterator[CallMetrics]:
+    """
+    在代码块范围内（当前线程或异步任务）单独累计各阶段耗时和令牌用量
+
+    Yields:
+        CallMetrics: 本次调用的指标，代码块结束后仍可读取
+    """
+    call = CallMetrics()
+    token = _current_call.set(call)
+    try:
+        yield call
+    finally:
+        _current_call.reset(token)
+
+
+def write_metrics(path: str) -> None:
+    """
+    将Prometheus文本格式的指标原子写入文件（可供node_exporter的textfile收集器读取）
+
+    Args:
+        path: 输出文件路径
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(_registry.render())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """只提供 GET /metrics 的请求处理器"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = _registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    在后台线程启动 /metrics 端点
+
+    Args:
+        port: 监听端口
+        host: 监听地址
+
+    Returns:
+        ThreadingHTTPServer: 服务对象（调用 shutdown() 停止）
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+def format_timings() -> str:
+    """
+    格式化各阶段耗时和令牌用量摘要（供 --timings 输出）
+
+    Returns:
+        str: 多行摘要文本
+    """
+    stage_stats = _registry.stage_stats()
+    if not stage_stats:
+        return "阶段耗时: 无记录"
+    lines = ["阶段耗时 (毫秒):",
+             f"  {'阶段':<14}{'次数':>8}{'均值':>10}{'p50':>10}{'p95':>10}{'最大':>10}{'合计':>12}"]
+    for stage, stats in stage_stats.items():
+        lines.append(
+            f"  {stage:<16}{stats['count']:>10}{stats['mean'] * 1000:>12.2f}"
+            f"{stats['p50'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}"
+            f"{stats['max'] * 1000:>12.2f}{stats['total'] * 1000:>14.1f}"
+        )
+    tokens = _registry.token_stats()
+    if tokens['completions']:
+        prompt = tokens.get('prompt', {})
+        completion = tokens.get('completion', {})
+        lines.append(
+            f"令牌用量: {tokens['completions']} 次补全，"
+            f"提示 {prompt.get('total', 0)}（均值 {prompt.get('mean', 0):.0f}，p95 {prompt.get('p95', 0):.0f}），"
+            f"生成 {completion.get('total', 0)}（均值 {completion.get('mean', 0):.0f}，p95 {completion.get('p95', 0):.0f}）"
+        )
+    else:
+        lines.append("令牌用量: 响应中没有 usage 字段")
+    return "\n".join(lines)
@@ -0,0 +1,585 @@
+"""
+本地模拟服务模块
+提供与OpenAI兼容的 /v1/chat/completions 本地替身，返回符合评估格式的JSON，
+支持可配置的延迟分布、错误率、429注入、无效结果注入与结果修复、SSE流式输出、多记录打包请求，
+以及 /v1/files 和 /v1/batches 离线批处理接口，用于离线压测和调优
+"""
+
+import argparse
+import email.parser
+import email.policy
+import hashlib
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def parse_latency_spec(spec: str) -> Callable[[random.Random], float]:
+    """
+    解析延迟分布描述
+
+    支持的格式（单位: 秒）:
+      - ``fixed:0.5``
+      - ``uniform:0.2,1.0``
+      - ``normal:0.8,0.2``（截断到非负）
+      - ``lognormal:-0.5,0.6``（参数为对数空间的 mu,sigma）
+
+    Args:
+        spec: 延迟分布描述
+
+    Returns:
+        Callable[[random.Random], float]: 采样函数
+    """
+    kind, _, params = spec.partition(':')
+    try:
+        values = [float(v) for v in params.split(',')] if params else []
+    except ValueError:
+        raise ValueError(f"延迟分布参数无效: {spec}")
+
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal' and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal' and len(values) == 2:
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+
+def _risk_level(score: int) -> str:
+    if score >= 90:
+        return 'Low'
+    if score >= 75:
+        return 'Medium'
+    return 'High'
+
+
+def build_mock_evaluation(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    根据请求消息生成确定性的评估结果（相同输入得到相同输出）
+
+    Args:
+        messages: 请求中的消息列表
+
+    Returns:
+        Dict[str, Any]: 符合评估格式的结果
+    """
+    content = messages[-1].get('content', '') if messages else ''
+    digest = hashlib.sha256(content.encode('utf-8')).digest()
+    score = 60 + digest[0] % 39
+    return {
+        'total_score': score,
+        'risks': [f"模拟风险点{i + 1}" for i in range(1 + digest[1] % 3)],
+        'suggestions': [f"模拟改进建议{i + 1}" for i in range(1 + digest[2] % 3)],
+        'risk_level': _risk_level(score),
+    }
+
+
+# 打包评估的记录头（与 prompt.PACKED_RECORD_TEMPLATE 一致）
+_PACKED_RECORD_HEADER = re.compile(r'^【记录ID: (.+?)】$', re.MULTILINE)
+
+
+def build_mock_packed_evaluation(content: str, drop: Callable[[], bool]) -> Optional[Dict[str, Any]]:
+    """
+    若用户消息是打包评估请求，按记录ID逐条生成结果
+
+    Args:
+        content: 用户消息内容
+        drop: 判断是否故意遗漏某条记录的函数（用于演练回退逻辑）
+
+    Returns:
+        Optional[Dict[str, Any]]: {"results": [...]}，不是打包请求时返回None
+    """
+    headers = list(_PACKED_RECORD_HEADER.finditer(content))
+    if not headers:
+        return None
+    results = []
+    for i, match in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(content)
+        if drop():
+            continue
+        record = build_mock_evaluation([{'content': content[match.end():end].strip()}])
+        results.append({'id': match.group(1), **record})
+    return {'results': results}
+
+
+# 结果修复请求（与 prompt.REPAIR_PROMPT_TEMPLATE 一致）及其中列出的问题字段
+_REPAIR_PREFIX = "你上一次输出的评估结果"
+_REPAIR_FIELD = re.compile(r'^- (\w+)[（：]', re.MULTILINE)
+
+
+def build_mock_repair(messages: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    """
+    若最后一条消息是结果修复请求，只返回其中列出的字段（取值与原评估请求的结果一致）
+
+    Args:
+        messages: 请求中的消息列表
+
+    Returns:
+        Optional[Dict[str, Any]]: 问题字段组成的结果，不是修复请求时返回None
+    """
+    content = messages[-1].get('content', '') if messages else ''
+    if len(messages) < 3 or not content.startswith(_REPAIR_PREFIX):
+        return None
+    evaluation = build_mock_evaluation(messages[:-2])
+    return {field: evaluation[field] for field in _REPAIR_FIELD.findall(content) if field in evaluation}
+
+
+def corrupt_mock_evaluation(evaluation: Dict[str, Any]) -> Dict[str, Any]:
+    """制造一个常见的无效结果：缺少建议、分数不是数字、风险等级无效"""
+    corrupted = {k: v for k, v in evaluation.items() if k != 'suggestions'}
+    corrupted['total_score'] = "八十分"
+    corrupted['risk_level'] = "Unsure"
+    return corrupted
+
+
+def build_mock_completion(request: Dict[str, Any], drop: Callable[[], bool],
+                          completion_id: str, invalid: bool = False) -> Dict[str, Any]:
+    """
+    根据Chat Completions请求体生成完整的响应体（在线调用与批处理共用）
+
+    Args:
+        request: 请求体
+        drop: 打包请求中决定是否遗漏某条记录的函数
+        completion_id: 响应ID
+        invalid: 为True时返回无效的评估结果（修复请求和打包请求不受影响）
+
+    Returns:
+        Dict[str, Any]: chat.completion 响应体
+    """
+    messages = request.get('messages', [])
+    evaluation = build_mock_repair(messages)
+    if evaluation is None:
+        evaluation = build_mock_packed_evaluation(
+            messages[-1].get('content', '') if messages else '', drop
+        )
+    if evaluation is None:
+        evaluation = build_mock_evaluation(messages)
+        if invalid:
+            evaluation = corrupt_mock_evaluation(evaluation)
+    content = json.dumps(evaluation, ensure_ascii=False)
+    usage = {
+        'prompt_tokens': sum(len(m.get('content', '')) for m in messages),
+        'completion_tokens': len(content),
+    }
+    usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+    return {
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': request.get('model', 'mock-chat'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop',
+        }],
+        'usage': usage,
+    }
+
+
+class MockOptions:
+    """模拟服务的行为参数"""
+
+    def __init__(self, latency: str = 'fixed:0', error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 1.0,
+                 stream_chunk_size: int = 8, stream_chunk_delay: float = 0.0,
+                 pack_drop_rate: float = 0.0, batch_delay: float = 1.0,
+                 invalid_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        Args:
+            latency: 响应延迟分布（见 parse_latency_spec）
+            error_rate: 返回500错误的概率
+            throttle_rate: 返回429限流的概率
+            retry_after: 429响应携带的Retry-After秒数
+            stream_chunk_size: 流式输出时每个SSE事件包含的字符数
+            stream_chunk_delay: 流式输出时相邻事件的间隔（秒）
+            pack_drop_rate: 打包请求中每条记录被遗漏的概率
+            batch_delay: 批处理作业从创建到完成的时间（秒）
+            invalid_rate: 返回无效评估结果（需要结果修复）的概率
+            seed: 随机种子，便于复现
+        """
+        self.latency_spec = latency
+        self.sample_latency = parse_latency_spec(latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.stream_chunk_size = max(1, stream_chunk_size)
+        self.stream_chunk_delay = stream_chunk_delay
+        self.pack_drop_rate = pack_drop_rate
+        self.batch_delay = batch_delay
+        self.invalid_rate = invalid_rate
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.request_count = 0
+
+    def draw(self) -> Tuple[float, float]:
+        """线程安全地抽取 (延迟, 故障随机数)"""
+        with self.rng_lock:
+            self.request_count += 1
+            return self.sample_latency(self.rng), self.rng.random()
+
+    def drop_packed_record(self) -> bool:
+        """线程安全地决定是否遗漏一条打包记录"""
+        with self.rng_lock:
+            return self.rng.random() < self.pack_drop_rate
+
+    def invalid_result(self) -> bool:
+        """线程安全地决定是否返回无效结果"""
+        with self.rng_lock:
+            return self.rng.random() < self.invalid_rate
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """OpenAI兼容接口的请求处理器（保持HTTP/1.1长连接）"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'HospitalMock/0.1'
+    # 头部和响应体分两次写出，长连接上Nagle算法与延迟ACK叠加会让每个请求多等约40ms
+    disable_nagle_algorithm = True
+
+    @property
+    def options(self) -> MockOptions:
+        return self.server.options
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any],
+                   headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length)
+
+    def _not_found(self) -> None:
+        self._send_json(404, {'error': {'message': f"未知路径: {self.path}"}})
+
+    def do_GET(self) -> None:
+        parts = self.path.strip('/').split('/')
+        if parts == ['v1', 'models']:
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'mock-chat', 'object': 'model'}]})
+        elif len(parts) == 4 and parts[:2] == ['v1', 'files'] and parts[3] == 'content':
+            self._send_file(parts[2])
+        elif len(parts) == 3 and parts[:2] == ['v1', 'batches']:
+            batch = self.server.get_batch(parts[2])
+            if batch is None:
+                self._not_found()
+            else:
+                self._send_json(200, batch)
+        else:
+            self._not_found()
+
+    def do_POST(self) -> None:
+        body = self._read_body()
+        parts = self.path.strip('/').split('/')
+
+        if parts == ['v1', 'files']:
+            self._upload_file(body)
+            return
+
+        try:
+            request = json.loads(body or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': '请求体不是有效JSON'}})
+            return
+
+        if parts == ['v1', 'chat', 'completions']:
+            self._chat_completion(request)
+        elif parts == ['v1', 'batches']:
+            if request.get('input_file_id') not in self.server.files:
+                self._send_json(400, {'error': {'message': f"文件不存在: {request.get('input_file_id')}"}})
+                return
+            self._send_json(200, self.server.create_batch(request))
+        elif len(parts) == 4 and parts[:2] == ['v1', 'batches'] and parts[3] == 'cancel':
+            batch = self.server.cancel_batch(parts[2])
+            if batch is None:
+                self._not_found()
+            else:
+                self._send_json(200, batch)
+        else:
+            self._not_found()
+
+    def _upload_file(self, body: bytes) -> None:
+        """解析multipart/form-data上传的文件"""
+        content_type = self.headers.get('Content-Type', '')
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body
+        )
+        fields: Dict[str, Tuple[Optional[str], bytes]] = {}
+        if message.is_multipart():
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                fields[name] = (part.get_filename(), part.get_payload(decode=True) or b'')
+        if 'file' not in fields:
+            self._send_json(400, {'error': {'message': '缺少 file 字段'}})
+            return
+        filename, content = fields['file']
+        purpose = fields.get('purpose', (None, b'batch'))[1].decode('utf-8')
+        self._send_json(200, self.server.store_file(content, filename or 'upload.jsonl', purpose))
+
+    def _send_file(self, file_id: str) -> None:
+        content = self.server.files.get(file_id)
+        if content is None:
+            self._not_found()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _chat_completion(self, request: Dict[str, Any]) -> None:
+        latency, fault = self.options.draw()
+        if fault < self.options.throttle_rate:
+            self._send_json(
+                429, {'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit'}},
+                headers={'Retry-After': f"{self.options.retry_after:g}"},
+            )
+            return
+        if fault < self.options.throttle_rate + self.options.error_rate:
+            time.sleep(latency)
+            self._send_json(500, {'error': {'message': 'Internal server error'}})
+            return
+
+        completion = build_mock_completion(
+            request, self.options.drop_packed_record, f"chatcmpl-mock-{self.options.request_count}",
+            invalid=self.options.invalid_result(),
+        )
+        if request.get('stream'):
+            content = completion['choices'][0]['message']['content']
+            self._stream_completion(completion['model'], content, latency)
+            return
+
+        time.sleep(latency)
+        self._send_json(200, completion)
+
+    def _stream_completion(self, model: str, content: str, latency: float) -> None:
+        """以SSE分块输出回复（延迟视为首字节时间）"""
+        time.sleep(latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write_event(data: str) -> None:
+            payload = f"data: {data}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(payload):x}\r\n".encode('ascii') + payload + b"\r\n")
+            self.wfile.flush()
+
+        size = self.options.stream_chunk_size
+        for i in range(0, len(content), size):
+            if i and self.options.stream_chunk_delay:
+                time.sleep(self.options.stream_chunk_delay)
+            write_event(json.dumps({
+                'object': 'chat.completion.chunk',
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': content[i:i + size]}, 'finish_reason': None}],
+            }, ensure_ascii=False))
+        write_event('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class MockServer(ThreadingHTTPServer):
+    """模拟服务（每个连接一个线程）"""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address: Tuple[str, int], options: MockOptions, verbose: bool = False):
+        super().__init__(address, MockRequestHandler)
+        self.options = options
+        self.verbose = verbose
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self._store_lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def store_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        """保存文件并返回文件对象"""
+        with self._store_lock:
+            file_id = f"file-mock-{next(self._ids)}"
+            self.files[file_id] = content
+        return {'id': file_id, 'object': 'file', 'bytes': len(content), 'filename': filename,
+                'purpose': purpose, 'created_at': int(time.time())}
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._store_lock:
+            batch = self.batches.get(batch_id)
+            return dict(batch) if batch is not None else None
+
+    def create_batch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """创建批处理作业，并在后台线程中按 batch_delay 完成"""
+        with self._store_lock:
+            batch_id = f"batch-mock-{next(self._ids)}"
+            batch = {
+                'id': batch_id,
+                'object': 'batch',
+                'endpoint': request.get('endpoint', '/v1/chat/completions'),
+                'input_file_id': request['input_file_id'],
+                'completion_window': request.get('completion_window', '24h'),
+                'status': 'validating',
+                'output_file_id': None,
+                'error_file_id': None,
+                'created_at': int(time.time()),
+                'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+                'metadata': request.get('metadata') or {},
+            }
+            self.batches[batch_id] = batch
+        threading.Thread(target=self._run_batch, args=(batch_id,), daemon=True).start()
+        return dict(batch)
+
+    def cancel_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._store_lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            if batch['status'] not in ('completed', 'failed', 'expired', 'cancelled'):
+                batch['status'] = 'cancelling'
+            return dict(batch)
+
+    def _update_batch(self, batch_id: str, **changes: Any) -> str:
+        with self._store_lock:
+            batch = self.batches[batch_id]
+            if batch['status'] == 'cancelling':
+                batch['status'] = 'cancelled'
+            elif batch['status'] != 'cancelled':
+                batch.update(changes)
+            return batch['status']
+
+    def _run_batch(self, batch_id: str) -> None:
+        """逐行执行批处理请求，错误率注入的请求写入错误文件"""
+        with self._store_lock:
+            lines = self.files[self.batches[batch_id]['input_file_id']].decode('utf-8').splitlines()
+        requests = [json.loads(line) for line in lines if line.strip()]
+        counts = {'total': len(requests), 'completed': 0, 'failed': 0}
+        if self._update_batch(batch_id, status='in_progress', request_counts=dict(counts)) == 'cancelled':
+            return
+
+        outputs, errors = [], []
+        for index, entry in enumerate(requests):
+            _, fault = self.options.draw()
+            if fault < self.options.error_rate:
+                counts['failed'] += 1
+                errors.append({'id': f"batch_req_{index}", 'custom_id': entry.get('custom_id'),
+                               'response': None,
+                               'error': {'code': 'server_error', 'message': 'Internal server error'}})
+            else:
+                counts['completed'] += 1
+                completion = build_mock_completion(entry.get('body') or {}, self.options.drop_packed_record,
+                                                   f"chatcmpl-batch-{index}")
+                outputs.append({'id': f"batch_req_{index}", 'custom_id': entry.get('custom_id'),
+                                'response': {'status_code': 200, 'body': completion}, 'error': None})
+        time.sleep(self.options.batch_delay)
+
+        def dump(entries: List[Dict[str, Any]]) -> Optional[str]:
+            if not entries:
+                return None
+            content = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+            return self.store_file(content.encode('utf-8'), 'batch_output.jsonl', 'batch_output')['id']
+
+        self._update_batch(batch_id, status='completed', request_counts=counts,
+                           output_file_id=dump(outputs), error_file_id=dump(errors),
+                           completed_at=int(time.time()))
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_mock_server(host: str = '127.0.0.1', port: int = 0,
+                      options: Optional[MockOptions] = None,
+                      verbose: bool = False) -> MockServer:
+    """
+    在后台线程启动模拟服务
+
+    Args:
+        host: 监听地址
+        port: 监听端口，0 表示自动分配
+        options: 行为参数
+        verbose: 是否打印访问日志
+
+    Returns:
+        MockServer: 已启动的服务，可通过 base_url 获取地址，调用 shutdown() 停止
+    """
+    server = MockServer((host, port), options or MockOptions(), verbose=verbose)
+    thread = threading.Thread(target=server.serve_forever, name='mock-server', daemon=True)
+    thread.start()
+    return server
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+    """添加模拟服务行为参数（供本模块和压测工具共用）"""
+    parser.add_argument("--latency", default="fixed:0.2",
+                        help="延迟分布: fixed:S | uniform:A,B | normal:MEAN,STD | lognormal:MU,SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的概率")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回429的概率")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429携带的Retry-After秒数")
+    parser.add_argument("--stream-chunk-size", type=int, default=8, help="流式输出每块字符数")
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.0, help="流式输出块间隔（秒）")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="批处理作业完成所需秒数")
+    parser.add_argument("--pack-drop-rate", type=float, default=0.0,
+                        help="打包请求中每条记录被遗漏的概率（演练回退）")
+    parser.add_argument("--invalid-rate", type=float, default=0.0,
+                        help="返回无效评估结果的概率（演练结果修复）")
+    parser.add_argument("--seed", type=int, help="随机种子")
+
+
+def mock_options_from_args(args: argparse.Namespace) -> MockOptions:
+    """由命令行参数构造模拟服务行为参数"""
+    return MockOptions(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        stream_chunk_size=args.stream_chunk_size,
+        stream_chunk_delay=args.stream_chunk_delay,
+        pack_drop_rate=args.pack_drop_rate,
+        batch_delay=args.batch_delay,
+        invalid_rate=args.invalid_rate,
+        seed=args.seed,
+    )
+
+
+def main() -> int:
+    """命令行入口: 前台运行模拟服务"""
+    parser = argparse.ArgumentParser(description="OpenAI兼容的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--verbose", "-v", action="store_true", help="打印访问日志")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer((args.host, args.port), mock_options_from_args(args), verbose=args.verbose)
+    print(f"模拟服务已启动: {server.base_url}/v1 (延迟 {args.latency}, "
+          f"错误率 {args.error_rate}, 限流率 {args.throttle_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n模拟服务已停止")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
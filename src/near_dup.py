@@ -0,0 +1,370 @@
+"""
+近似重复记录索引
+模板化的手术记录往往只在患者信息、空白或编号上不同，精确哈希缓存无法命中。
+本模块先规范化记录文本，再以字符shingle的MinHash签名和LSH分桶索引已评估记录；
+相似度达到阈值的只是候选，还需逐个步骤比对：步骤数相同、每步只有少量措辞差异，
+且差异不涉及数字、否定词或并发症表述时才复用已有评估结果
+（"夹闭"改为"未夹闭"、出血量10ml改为100ml的记录整体相似度很高，却是完全不同的手术过程）
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+try:
+    from .utils import AppConfig
+except ImportError:
+    from utils import AppConfig
+
+
+# 患者信息等记录头字段（整行删除）
+_HEADER_LINE = re.compile(
+    r'^\s*(患者|姓名|性别|年龄|住院号|病案号|病历号|床号|科室|日期|手术日期|手术时间|'
+    r'术者|主刀|助手|记录者|记录时间)\s*[:：]'
+)
+
+# 行首的步骤编号，如 "1. "、"2、"、"(3)"、"第4步："、"⑤"
+_STEP_NUMBER = re.compile(r'^\s*(?:第?\d+\s*(?:步\s*[:：]?|[.、．)）])|[(（]\d+[)）]|[①-⑳])\s*')
+
+# 标点和空白统一为单个逗号
+_PUNCTUATION = re.compile(r'[\s,.;:!?、。·…]+')
+
+# 签名参数: 64个哈希函数，分为16个band，每个band 4行
+NUM_PERM = 64
+BANDS = 16
+SHINGLE_SIZE = 3
+
+# 单个步骤允许的最大改动比例（按字符计，相对较长的一方）
+MAX_STEP_EDIT_RATIO = 0.2
+
+# 步骤比对的守卫词：数字、否定词和并发症表述在两条记录的对应步骤中必须完全一致
+_GUARD_TOKEN = re.compile(
+    r'\d+(?:\.\d+)?|出血|渗血|渗漏|损伤|破裂|撕裂|穿孔|中转|开腹|失败|困难|[未不无没非否勿禁]'
+)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_record(surgery_steps: str) -> str:
+    """
+    规范化手术记录文本
+
+    删除患者信息等记录头行，去掉步骤编号，全角字符转半角，
+    标点和空白统一为逗号，并去除空行。
+
+    Args:
+        surgery_steps: 手术步骤描述
+
+    Returns:
+        str: 规范化后的文本（每个步骤一行）
+    """
+    lines = []
+    for line in unicodedata.normalize('NFKC', surgery_steps).lower().splitlines():
+        if _HEADER_LINE.match(line):
+            continue
+        line = _PUNCTUATION.sub(',', _STEP_NUMBER.sub('', line)).strip(',')
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """
+    字符shingle集合（文本短于size时为整段文本）
+
+    Args:
+        text: 规范化后的文本
+        size: shingle长度
+
+    Returns:
+        Set[str]: shingle集合
+    """
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    """两个集合的Jaccard相似度"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+# 固定种子生成的哈希函数参数，签名在进程间保持一致
+_rng = random.Random(20240101)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(NUM_PERM)]
+
+
+def minhash(shingle_set: Set[str]) -> Tuple[int, ...]:
+    """
+    计算MinHash签名
+
+    Args:
+        shingle_set: shingle集合
+
+    Returns:
+        Tuple[int, ...]: NUM_PERM 个最小哈希值
+    """
+    hashes = [zlib.crc32(s.encode('utf-8')) for s in shingle_set]
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def _step_edit_ratio(a: str, b: str) -> float:
+    """两个步骤间改动的字符数占较长一方的比例"""
+    edited = sum(max(i2 - i1, j2 - j1)
+                 for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+                 if tag != 'equal')
+    return edited / max(len(a), len(b), 1)
+
+
+def steps_match(normalized: str, other: str) -> bool:
+    """
+    逐个步骤比对两条规范化记录
+
+    步骤数必须相同；对应步骤中的数字、否定词和并发症表述必须完全一致，
+    其余措辞的改动不超过 MAX_STEP_EDIT_RATIO（步骤调换或替换会超过该比例）。
+
+    Args:
+        normalized: 规范化后的记录文本
+        other: 另一条规范化后的记录文本
+
+    Returns:
+        bool: 两条记录是否描述同一手术过程
+    """
+    steps, other_steps = normalized.split("\n"), other.split("\n")
+    if len(steps) != len(other_steps):
+        return False
+    for step, other_step in zip(steps, other_steps):
+        if step == other_step:
+            continue
+        if _GUARD_TOKEN.findall(step) != _GUARD_TOKEN.findall(other_step):
+            return False
+        if _step_edit_ratio(step, other_step) > MAX_STEP_EDIT_RATIO:
+            return False
+    return True
+
+
+def _band_buckets(scope: str, signature: Sequence[int]) -> List[str]:
+    """将签名按band分桶，桶名包含作用域，不同模型或手术类型互不匹配"""
+    rows = NUM_PERM // BANDS
+    buckets = []
+    for band in range(BANDS):
+        chunk = ','.join(str(v) for v in signature[band * rows:(band + 1) * rows])
+        digest = hashlib.blake2b(f"{scope}|{band}|{chunk}".encode('utf-8'), digest_size=8).hexdigest()
+        buckets.append(digest)
+    return buckets
+
+
+class NearDuplicateIndex:
+    """
+    基于SQLite的近似重复记录索引，线程安全
+
+    同一作用域（模型 + 手术类型）内，shingle Jaccard相似度达到 ``threshold`` 的已评估记录
+    作为候选，逐步比对通过（见 steps_match）的候选中取相似度最高的一条视为重复；
+    条目的有效期和容量与响应缓存一致。
+    """
+
+    def __init__(self, path: str, threshold: float = 0.9,
+                 max_entries: int = 10000, ttl: float = 30 * 86400):
+        """
+        Args:
+            path: SQLite数据库文件路径（可与响应缓存共用同一文件）
+            threshold: 复用所需的最低相似度（0-1）
+            max_entries: 最大条目数
+            ttl: 条目有效期（秒），0 表示永不过期
+        """
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if path != ':memory:' and directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ':memory:':
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS near_dup_records ("
+            " key TEXT PRIMARY KEY,"
+            " scope TEXT NOT NULL,"
+            " normalized TEXT NOT NULL,"
+            " result TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS near_dup_bands ("
+            " bucket TEXT NOT NULL,"
+            " key TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_near_dup_bucket ON near_dup_bands (bucket)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_near_dup_key ON near_dup_bands (key)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_scope(model: str, surgery_type: str) -> str:
+        """作用域：只有同一模型、同一手术类型的评估结果可以互相复用"""
+        return f"{model}:{surgery_type}"
+
+    def lookup(self, surgery_steps: str, scope: str) -> Optional[Dict[str, Any]]:
+        """
+        查找近似重复记录的评估结果（候选需通过逐步比对）
+
+        Args:
+            surgery_steps: 手术步骤描述
+            scope: 作用域（见 make_scope）
+
+        Returns:
+            Optional[Dict[str, Any]]: 命中时返回评估结果的副本，附带
+            ``reused`` 字段（来源条目和相似度）；否则返回None
+        """
+        normalized = normalize_record(surgery_steps)
+        grams = shingles(normalized)
+        buckets = _band_buckets(scope, minhash(grams))
+        placeholders = ','.join('?' * len(buckets))
+        min_created = time.time() - self.ttl if self.ttl > 0 else 0
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, normalized, result FROM near_dup_records"
+                " WHERE created_at >= ? AND scope = ? AND key IN ("
+                f"  SELECT key FROM near_dup_bands WHERE bucket IN ({placeholders}))",
+                (min_created, scope, *buckets),
+            ).fetchall()
+
+        best: Optional[Tuple[float, str, str]] = None
+        for key, other, result in rows:
+            similarity = jaccard(grams, shingles(other))
+            if similarity < self.threshold or (best is not None and similarity <= best[0]):
+                continue
+            if steps_match(normalized, other):
+                best = (similarity, key, result)
+
+        with self._lock:
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        similarity, key, result = best
+        reused = json.loads(result)
+        reused['reused'] = {'source': key[:16], 'similarity': round(similarity, 4)}
+        return reused
+
+    def add(self, surgery_steps: str, scope: str, result: Dict[str, Any]) -> None:
+        """
+        将已评估记录加入索引
+
+        Args:
+            surgery_steps: 手术步骤描述
+            scope: 作用域（见 make_scope）
+            result: 评估结果（复用得到的结果不应再加入）
+        """
+        normalized = normalize_record(surgery_steps)
+        key = hashlib.sha256(f"{scope}\n{normalized}".encode('utf-8')).hexdigest()
+        buckets = _band_buckets(scope, minhash(shingles(normalized)))
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM near_dup_bands WHERE key = ?", (key,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO near_dup_records (key, scope, normalized, result, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, scope, normalized, json.dumps(result, ensure_ascii=False), now),
+            )
+            self._conn.executemany(
+                "INSERT INTO near_dup_bands (bucket, key) VALUES (?, ?)",
+                [(bucket, key) for bucket in buckets],
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """删除过期条目，再删除超出容量的最旧条目（调用方持有锁）"""
+        if self.ttl > 0:
+            self._conn.execute(
+                "DELETE FROM near_dup_records WHERE created_at < ?", (now - self.ttl,)
+            )
+        count = self._conn.execute("SELECT COUNT(*) FROM near_dup_records").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM near_dup_records WHERE key IN ("
+                " SELECT key FROM near_dup_records ORDER BY created_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self._conn.execute(
+            "DELETE FROM near_dup_bands WHERE key NOT IN (SELECT key FROM near_dup_records)"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取索引统计
+
+        Returns:
+            Dict[str, Any]: 复用数、未命中数、复用率和当前条目数
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM near_dup_records").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': entries,
+        }
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+_default_index: Optional[NearDuplicateIndex] = None
+_default_index_lock = threading.Lock()
+
+
+def get_default_index(config: AppConfig, threshold: Optional[float] = None) -> NearDuplicateIndex:
+    """
+    获取进程内共享的近似重复索引（与响应缓存共用数据库文件，首次调用时创建）
+
+    Args:
+        config: 运行配置
+        threshold: 相似度阈值，默认取配置中的 NEAR_DUP_THRESHOLD
+
+    Returns:
+        NearDuplicateIndex: 共享索引实例
+    """
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = NearDuplicateIndex(
+                config.cache_path,
+                threshold=config.near_dup_threshold,
+                max_entries=config.cache_max_entries,
+                ttl=config.cache_ttl_seconds,
+            )
+        if threshold is not None:
+            _default_index.threshold = threshold
+        return _default_index
@@ -1,161 +1,1026 @@
 """
 OpenAI API调用模块
-使用urllib.request实现HTTP调用，避免第三方依赖
+使用标准库http.client持久连接池实现HTTP调用，避免第三方依赖
 """
 
+import asyncio
+import dataclasses
+import functools
+import http.client
 import json
-import urllib.request
-import urllib.error
-from typing import List, Dict, Any, Optional
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from typing import List, Dict, Any, Awaitable, Callable, Iterator, Optional, Sequence, Tuple, TypeVar
 
 try:
-    from .utils import load_env_config, validate_config
+    from .utils import AppConfig, get_config
+    from .http_pool import PooledResponse, get_pool_manager
+    from .async_http import get_async_pool_manager
+    from .cache import ResponseCache
+    from .stream_parser import IncrementalEvaluationParser, StreamEvent
+    from .rate_limit import RetryPolicy, get_limiters, parse_retry_after
+    from .tokens import TokenEstimate, check_context, estimate_request, get_model_profile
+    from .prompt import build_repair_messages
+    from .failover import SendTimer, acall_with_failover, call_with_failover, endpoint_chain
+    from .metrics import record_usage, timed
 except ImportError:
-    from utils import load_env_config, validate_config
+    from utils import AppConfig, get_config
+    from http_pool import PooledResponse, get_pool_manager
+    from async_http import get_async_pool_manager
+    from cache import ResponseCache
+    from stream_parser import IncrementalEvaluationParser, StreamEvent
+    from rate_limit import RetryPolicy, get_limiters, parse_retry_after
+    from tokens import TokenEstimate, check_context, estimate_request, get_model_profile
+    from prompt import build_repair_messages
+    from failover import SendTimer, acall_with_failover, call_with_failover, endpoint_chain
+    from metrics import record_usage, timed
 
 
-def call_openai_api(messages: List[Dict[str, str]], model: str = "deepseek-chat") -> Dict[str, Any]:
+T = TypeVar('T')
+
+# 一次请求的准备结果: (请求URL, 请求体, 请求头, 预约令牌数)
+PreparedRequest = Tuple[str, bytes, Dict[str, str], int]
+
+# 模块级JSON解码器，以及提取JSON时单遍扫描关注的结构字符
+_JSON_DECODER = json.JSONDecoder()
+_JSON_STRUCTURE = re.compile(r'[{}\[\]",]')
+_JSON_STRING_REST = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+# 修复截断的JSON时最多回退的逗号个数
+_MAX_REPAIR_ATTEMPTS = 8
+
+# 结果修复请求的生成上限（只重新生成问题字段）
+REPAIR_MAX_TOKENS = 400
+
+# 风险等级的常见写法 -> 标准值
+_RISK_LEVEL_ALIASES = {
+    'low': 'Low', '低': 'Low', '低风险': 'Low',
+    'medium': 'Medium', '中': 'Medium', '中等': 'Medium', '中风险': 'Medium', '中等风险': 'Medium',
+    'high': 'High', '高': 'High', '高风险': 'High',
+}
+
+
+def api_base_url(config: AppConfig) -> str:
+    """返回以 /v1 结尾的API根地址（兼容DeepSeek和OpenAI的写法）"""
+    base_url = config.base_url
+    if not base_url.endswith('/v1'):
+        base_url = base_url.rstrip('/') + '/v1'
+    return base_url
+
+
+def api_headers(config: AppConfig) -> Dict[str, str]:
+    """返回带鉴权信息的公共请求头"""
+    return {
+        'Authorization': f'Bearer {config.api_key}',
+        'Content-Type': 'application/json',
+        'User-Agent': 'HospitalAgent/0.1.0'
+    }
+
+
+def chat_request_body(messages: List[Dict[str, str]], model: str, config: AppConfig,
+                      stream: bool = False) -> Dict[str, Any]:
     """
-    调用OpenAI Chat Completions API
+    构造Chat Completions请求体（在线调用与离线批处理共用）
     
     Args:
-        messages: 消息列表，格式为 [{"role": "system", "content": "..."}, ...]
+        messages: 消息列表
         model: 使用的模型名称
+        config: 运行配置
+        stream: 是否请求SSE流式响应
         
     Returns:
-        Dict[str, Any]: 解析后的响应数据
-        
-    Raises:
-        Exception: API调用失败或响应解析错误
+        Dict[str, Any]: 请求体
     """
-    # 2.2.4: 配置管理
-    config = load_env_config()
-    if not validate_config(config):
-        raise ValueError("配置验证失败")
-    
-    # 2.2.1: 基础HTTP调用实现
-    api_key = config['OPENAI_API_KEY']
-    base_url = config['OPENAI_BASE_URL']
-    # 确保URL格式正确，支持DeepSeek和OpenAI
-    if not base_url.endswith('/v1'):
-        base_url = base_url.rstrip('/') + '/v1'
-    url = f"{base_url}/chat/completions"
-    
-    # 构造请求数据
     data = {
         "model": model,
         "messages": messages,
         "temperature": 0.1,
-        "max_tokens": 1000
+        "max_tokens": config.max_tokens
     }
     
     # 如果是OpenAI API，添加response_format参数
-    if 'openai.com' in base_url:
+    if 'openai.com' in config.base_url:
         data["response_format"] = {"type": "json_object"}
     
-    # 构造HTTP请求
-    json_data = json.dumps(data).encode('utf-8')
-    
-    request = urllib.request.Request(
-        url,
-        data=json_data,
-        headers={
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json',
-            'User-Agent': 'HospitalAgent/0.1.0'
-        },
-        method='POST'
+    if stream:
+        data["stream"] = True
+    return data
+
+
+def _build_chat_request(messages: List[Dict[str, str]], model: str,
+                        config: AppConfig,
+                        stream: bool = False) -> Tuple[str, bytes, Dict[str, str]]:
+    """
+    构造Chat Completions请求（同步、异步与流式调用共用）
+    
+    Args:
+        messages: 消息列表
+        model: 使用的模型名称
+        config: 运行配置
+        stream: 是否请求SSE流式响应
+        
+    Returns:
+        Tuple[str, bytes, Dict[str, str]]: (请求URL, 请求体, 请求头)
+    """
+    # 2.2.1: 基础HTTP调用实现
+    url = f"{api_base_url(config)}/chat/completions"
+    with timed('serialize'):
+        json_data = json.dumps(chat_request_body(messages, model, config, stream)).encode('utf-8')
+    return url, json_data, api_headers(config)
+
+
+class APIError(Exception):
+    """
+    API调用错误
+    
+    Attributes:
+        status: HTTP状态码（网络错误时为None）
+        retry_after: 服务端要求的重试等待秒数
+        retryable: 是否为可重试的瞬时错误（限流、服务端错误、网络错误）
+    """
+    
+    def __init__(self, message: str, status: Optional[int] = None,
+                 retry_after: Optional[float] = None, retryable: bool = False):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+class EvaluationValidationError(ValueError):
+    """
+    评估结果字段缺失或格式无效
+    
+    Attributes:
+        partial: 回复中解析出的原始结果（可能缺少字段）
+        problems: 字段 -> 问题说明
+    """
+    
+    def __init__(self, partial: Dict[str, Any], problems: Dict[str, str]):
+        super().__init__("评估结果格式无效: " + "；".join(
+            f"{field} {reason}" for field, reason in problems.items()
+        ))
+        self.partial = partial
+        self.problems = problems
+    
+    @property
+    def invalid_fields(self) -> List[str]:
+        return list(self.problems)
+
+
+def http_error(status: int, body: str, headers: Dict[str, str]) -> APIError:
+    """由非200响应构造API错误"""
+    # 2.2.3a: HTTP错误处理
+    return APIError(
+        f"OpenAI API HTTP错误 {status}: {body or '无错误详情'}",
+        status=status,
+        retry_after=parse_retry_after(headers.get('retry-after')),
+        retryable=status in RetryPolicy.RETRYABLE_STATUS,
     )
+
+
+def network_error(error: Exception) -> APIError:
+    """由网络异常构造可重试的API错误"""
+    # 2.2.3a: 网络错误处理
+    return APIError(f"网络连接错误: {error}", retryable=True)
+
+
+# 视为端点故障的非瞬时状态码（密钥、权限或地址配置错误）；400等请求本身的错误换端点也无济于事
+_ENDPOINT_FAILURE_STATUS = (401, 403, 404)
+
+
+def _is_endpoint_failure(error: BaseException) -> bool:
+    """是否为端点故障（计入熔断并切换到后备端点）"""
+    return isinstance(error, APIError) and (error.retryable or error.status in _ENDPOINT_FAILURE_STATUS)
+
+
+def _handle_chat_response(response: PooledResponse) -> Dict[str, Any]:
+    """
+    解析状态为200的响应（同步与异步调用共用）
     
+    Args:
+        response: 完整读取的HTTP响应
+        
+    Returns:
+        Dict[str, Any]: 解析后的评分数据
+    """
     try:
-        # 2.2.1c: 执行HTTP调用并获取响应
-        with urllib.request.urlopen(request, timeout=30) as response:
-            if response.status != 200:
-                raise Exception(f"HTTP错误: {response.status}")
-            
-            response_data = response.read().decode('utf-8')
-            
         # 2.2.2: JSON处理与解析
-        return _parse_openai_response(response_data)
+        return parse_openai_response(response.text())
+    except EvaluationValidationError:
+        # 交给调用方发起结果修复
+        raise
+    except Exception as e:
+        # 2.2.3b: 其他错误处理
+        raise Exception(f"API调用失败: {str(e)}")
+
+
+def resolve_config(config: Optional[AppConfig]) -> AppConfig:
+    """未显式传入配置时使用进程共享配置，并确认配置有效"""
+    # 2.2.4: 配置管理（配置只加载和验证一次）
+    config = config or get_config()
+    if not config.is_valid:
+        raise ValueError("配置验证失败")
+    return config
+
+
+def _cache_lookup(cache: Optional[ResponseCache], refresh: bool,
+                  json_data: bytes) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    查询响应缓存
+    
+    Returns:
+        Tuple[Optional[str], Optional[Dict[str, Any]]]: (缓存键, 命中的结果)
+    """
+    if cache is None:
+        return None, None
+    key = cache.make_key(json_data)
+    if refresh:
+        return key, None
+    return key, cache.get(key)
+
+
+def estimate_chat_request(messages: List[Dict[str, str]], model: Optional[str] = None,
+                          config: Optional[AppConfig] = None) -> TokenEstimate:
+    """
+    按配置的模型和生成上限预估一次请求（不发送请求）
+    
+    Args:
+        messages: 消息列表
+        model: 模型名称，默认使用配置中的 OPENAI_MODEL
+        config: 运行配置，默认使用 get_config() 的进程共享配置
         
-    except urllib.error.HTTPError as e:
-        # 2.2.3a: HTTP错误处理
-        error_body = e.read().decode('utf-8') if e.fp else "无错误详情"
-        raise Exception(f"OpenAI API HTTP错误 {e.code}: {error_body}")
+    Returns:
+        TokenEstimate: 令牌数、费用和延迟预估
+    """
+    config = config or get_config()
+    return estimate_request(messages, model or config.model, config.max_tokens,
+                            config.context_window or None)
+
+
+def _preflight(messages: List[Dict[str, str]], model: str, config: AppConfig) -> int:
+    """
+    发送前检查上下文长度，并返回用于TPM限流预约的令牌数
+    
+    Raises:
+        ContextLengthError: 预计超出模型上下文长度
+    """
+    return check_context(estimate_chat_request(messages, model, config)).budget_tokens
+
+
+def _retry_policy(config: AppConfig) -> RetryPolicy:
+    return RetryPolicy(config.max_retries, config.retry_base_delay, config.retry_max_delay,
+                       config.retry_after_max)
+
+
+def send_with_retries(send: Callable[[], T], config: AppConfig, tokens: int) -> T:
+    """
+    在限流器和自适应并发控制下执行请求，瞬时错误按退避策略重试
+    
+    Args:
+        send: 发送一次请求的函数，失败时抛出 APIError
+        config: 运行配置
+        tokens: 本次请求预计消耗的令牌数
         
-    except urllib.error.URLError as e:
-        # 2.2.3a: 网络错误处理
-        raise Exception(f"网络连接错误: {e.reason}")
+    Returns:
+        T: send 的返回值
+    """
+    limiter, concurrency = get_limiters(config)
+    policy = _retry_policy(config)
+    attempt = 0
+    while True:
+        limiter.acquire(tokens)
+        concurrency.acquire()
+        try:
+            result = send()
+        except APIError as e:
+            throttled = e.status == 429
+            concurrency.release(success=False, throttled=throttled)
+            if not e.retryable or attempt >= policy.max_retries:
+                raise
+            delay = policy.delay(attempt, e.retry_after)
+            if throttled:
+                # 限流时暂停该端点的所有请求，避免其他线程继续触发429
+                limiter.pause(delay)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException:
+            concurrency.release(success=False)
+            raise
+        concurrency.release(success=True)
+        return result
+
+
+async def _asend_with_retries(send: Callable[[], Awaitable[T]], config: AppConfig,
+                              tokens: int) -> T:
+    """send_with_retries 的异步版本"""
+    limiter, concurrency = get_limiters(config)
+    policy = _retry_policy(config)
+    attempt = 0
+    while True:
+        await limiter.aacquire(tokens)
+        await concurrency.aacquire()
+        try:
+            result = await send()
+        except APIError as e:
+            throttled = e.status == 429
+            concurrency.release(success=False, throttled=throttled)
+            if not e.retryable or attempt >= policy.max_retries:
+                raise
+            delay = policy.delay(attempt, e.retry_after)
+            if throttled:
+                limiter.pause(delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException:
+            concurrency.release(success=False)
+            raise
+        concurrency.release(success=True)
+        return result
+
+
+def call_openai_api(messages: List[Dict[str, str]], model: Optional[str] = None,
+                    cache: Optional[ResponseCache] = None,
+                    refresh: bool = False,
+                    config: Optional[AppConfig] = None) -> Dict[str, Any]:
+    """
+    调用OpenAI Chat Completions API
+    
+    请求受端点共享的RPM/TPM限流和自适应并发控制；429、5xx和网络错误
+    会按抖动退避自动重试（优先遵循Retry-After）。
+    配置了后备端点（OPENAI_FALLBACK_ENDPOINTS）时，端点故障会切换到下一个端点，
+    主端点超过其延迟分位数仍未返回时发出对冲请求；连续失败的端点会被熔断。
+    结果按主端点的请求缓存；后备端点给出的结果带 ``fallback`` 字段（实际作答的模型），不写入缓存。
+    
+    Args:
+        messages: 消息列表，格式为 [{"role": "system", "content": "..."}, ...]
+        model: 使用的模型名称，默认使用配置中的 OPENAI_MODEL
+        cache: 响应缓存（可选），命中时直接返回缓存的评估结果
+        refresh: 为True时忽略已有缓存并用新结果覆盖
+        config: 运行配置，默认使用 get_config() 的进程共享配置
+        
+    Returns:
+        Dict[str, Any]: 解析后的响应数据
+        
+    Raises:
+        ContextLengthError: 预计超出模型上下文长度（发送前拒绝）
+        CircuitOpenError: 所有端点都处于熔断状态
+        APIError: HTTP错误或网络错误（重试耗尽后）
+        Exception: 响应解析错误
+    """
+    config = resolve_config(config)
+    endpoints = endpoint_chain(config, model)
+    prepare = functools.partial(_prepare_chat_request, messages)
+    prepared = prepare(endpoints[0])
+    
+    cache_key, cached = _cache_lookup(cache, refresh, prepared[1])
+    if cached is not None:
+        return cached
+    
+    response, endpoint = _complete_with_failover(endpoints, prepare, prepared)
+    try:
+        result = _handle_chat_response(response)
+    except EvaluationValidationError as e:
+        result = _repair_result(messages, e, endpoint.model, endpoint)
+    if not _mark_fallback(result, endpoint, endpoints) and cache_key is not None:
+        cache.put(cache_key, result)
+    return result
+
+
+def _mark_fallback(result: Dict[str, Any], endpoint: AppConfig, endpoints: List[AppConfig]) -> bool:
+    """
+    后备端点给出的结果标记 ``fallback`` 字段（实际作答的模型）
+    
+    后备端点使用其他模型，其结果不能当作主端点请求的结果缓存或复用
+    
+    Returns:
+        bool: 是否为后备端点的结果
+    """
+    if endpoint is endpoints[0]:
+        return False
+    result['fallback'] = {'model': endpoint.model}
+    return True
+
+
+def _prepare_chat_request(messages: List[Dict[str, str]], endpoint: AppConfig) -> PreparedRequest:
+    """按端点的模型检查上下文长度并构造请求"""
+    tokens = _preflight(messages, endpoint.model, endpoint)
+    url, json_data, headers = _build_chat_request(messages, endpoint.model, endpoint)
+    return url, json_data, headers, tokens
+
+
+def _attempt_config(endpoint: AppConfig, last: bool) -> AppConfig:
+    """还有后备端点时本端点不重试，失败直接切换（重试留给故障转移）"""
+    return endpoint if last else dataclasses.replace(endpoint, max_retries=0)
+
+
+def _complete_with_failover(endpoints: List[AppConfig],
+                            prepare: Callable[[AppConfig], PreparedRequest],
+                            prepared: PreparedRequest) -> Tuple[PooledResponse, AppConfig]:
+    """
+    经故障转移发送请求（见 failover.call_with_failover）
+    
+    Args:
+        endpoints: 端点配置（见 failover.endpoint_chain）
+        prepare: 为端点准备请求的函数（后备端点按各自的模型重新准备）
+        prepared: 主端点已准备好的请求
         
+    Returns:
+        Tuple[PooledResponse, AppConfig]: (状态为200的响应, 给出响应的端点)
+    """
+    primary = endpoints[0]
+    
+    def attempt(endpoint: AppConfig, last: bool, timer: SendTimer) -> PooledResponse:
+        url, json_data, headers, tokens = prepared if endpoint is primary else prepare(endpoint)
+        return _complete(url, json_data, headers, _attempt_config(endpoint, last), tokens, timer)
+    
+    return call_with_failover(endpoints, attempt, _is_endpoint_failure)
+
+
+async def _acomplete_with_failover(endpoints: List[AppConfig],
+                                   prepare: Callable[[AppConfig], PreparedRequest],
+                                   prepared: PreparedRequest,
+                                   semaphore: Optional[asyncio.Semaphore] = None
+                                   ) -> Tuple[PooledResponse, AppConfig]:
+    """_complete_with_failover 的异步版本（对冲胜出后取消落败的请求）"""
+    primary = endpoints[0]
+    
+    async def attempt(endpoint: AppConfig, last: bool, timer: SendTimer) -> PooledResponse:
+        url, json_data, headers, tokens = prepared if endpoint is primary else prepare(endpoint)
+        return await _acomplete(url, json_data, headers, _attempt_config(endpoint, last),
+                                tokens, semaphore, timer)
+    
+    return await acall_with_failover(endpoints, attempt, _is_endpoint_failure)
+
+
+def _complete(url: str, json_data: bytes, headers: Dict[str, str],
+              config: AppConfig, tokens: int, timer: Optional[SendTimer] = None) -> PooledResponse:
+    """
+    经共享连接池发送请求（受限流、并发控制和重试约束），返回状态为200的响应
+    
+    ``timer`` 只对取得限流配额后的实际发送计时（供故障转移的对冲和延迟统计使用）
+    """
+    # 2.2.1c: 通过共享连接池执行HTTP调用，复用keep-alive连接
+    pool = get_pool_manager(
+        maxsize=config.pool_size,
+        idle_timeout=config.pool_idle_timeout
+    )
+    
+    def send() -> PooledResponse:
+        try:
+            response = pool.request('POST', url, body=json_data, headers=headers,
+                                    timeout=config.request_timeout)
+        except (OSError, http.client.HTTPException) as e:
+            raise network_error(e)
+        if response.status != 200:
+            raise http_error(response.status, response.text(), response.headers)
+        return response
+    
+    return send_with_retries(send if timer is None else timer.wrap(send), config, tokens)
+
+
+async def _acomplete(url: str, json_data: bytes, headers: Dict[str, str], config: AppConfig,
+                     tokens: int, semaphore: Optional[asyncio.Semaphore] = None,
+                     timer: Optional[SendTimer] = None) -> PooledResponse:
+    """_complete 的异步版本（可选并发信号量限制在途请求数，计时从取得信号量后开始）"""
+    pool = get_async_pool_manager(
+        maxsize=config.pool_size,
+        idle_timeout=config.pool_idle_timeout
+    )
+    
+    async def request() -> PooledResponse:
+        async with asyncio.timeout(config.request_timeout):
+            return await pool.request('POST', url, body=json_data, headers=headers)
+    
+    if timer is not None:
+        request = timer.awrap(request)
+    
+    async def send() -> PooledResponse:
+        try:
+            if semaphore is None:
+                response = await request()
+            else:
+                async with semaphore:
+                    response = await request()
+        except (OSError, http.client.HTTPException, asyncio.IncompleteReadError) as e:
+            # 单次请求超时（TimeoutError是OSError的子类）同样视为可重试的网络错误
+            raise network_error(e)
+        if response.status != 200:
+            raise http_error(response.status, response.text(), response.headers)
+        return response
+    
+    return await _asend_with_retries(send, config, tokens)
+
+
+# 结果修复统计（进程内累计）
+_repair_lock = threading.Lock()
+_repair_counts = {'attempted': 0, 'succeeded': 0}
+
+
+def _record_repair(success: bool) -> None:
+    with _repair_lock:
+        _repair_counts['attempted'] += 1
+        if success:
+            _repair_counts['succeeded'] += 1
+
+
+def get_repair_stats() -> Dict[str, Any]:
+    """
+    获取结果修复统计
+    
+    Returns:
+        Dict[str, Any]: 修复次数、成功数、失败数和成功率
+    """
+    with _repair_lock:
+        attempted = _repair_counts['attempted']
+        succeeded = _repair_counts['succeeded']
+    return {
+        'attempted': attempted,
+        'succeeded': succeeded,
+        'failed': attempted - succeeded,
+        'success_rate': round(succeeded / attempted, 4) if attempted else 0.0,
+    }
+
+
+def _repair_request(messages: List[Dict[str, str]], error: EvaluationValidationError,
+                    model: str, config: AppConfig) -> Tuple[str, bytes, Dict[str, str], AppConfig, int]:
+    """构建结果修复请求，返回 (URL, 请求体, 请求头, 修复请求的配置, 预约令牌数)"""
+    repair_config = dataclasses.replace(config, max_tokens=min(config.max_tokens, REPAIR_MAX_TOKENS))
+    repair_messages = build_repair_messages(messages, error.partial, error.problems)
+    tokens = _preflight(repair_messages, model, repair_config)
+    url, json_data, headers = _build_chat_request(repair_messages, model, repair_config)
+    return url, json_data, headers, repair_config, tokens
+
+
+def _merge_repair(error: EvaluationValidationError, response_data: str) -> Dict[str, Any]:
+    """用修复回复中的问题字段覆盖部分结果，并重新验证"""
+    reply = _response_json(response_data)
+    if not isinstance(reply, dict):
+        raise ValueError("修复回复不是JSON对象")
+    merged = dict(error.partial)
+    merged.update((field, reply[field]) for field in error.problems if field in reply)
+    return validate_evaluation_result(merged)
+
+
+def _repair_result(messages: List[Dict[str, str]], error: EvaluationValidationError,
+                   model: str, config: AppConfig) -> Dict[str, Any]:
+    """
+    结果修复：评估结果验证失败时，带上原对话和上一次的部分结果追问一次，
+    只要求模型给出缺失或无效的字段（生成上限 REPAIR_MAX_TOKENS），合并后重新验证
+    
+    Args:
+        messages: 原评估请求的消息列表
+        error: 验证错误（携带部分结果和问题字段）
+        model: 模型名称
+        config: 运行配置
+        
+    Returns:
+        Dict[str, Any]: 合并并验证后的评估结果
+        
+    Raises:
+        Exception: 修复请求失败或合并后仍无效
+    """
+    try:
+        url, json_data, headers, repair_config, tokens = _repair_request(messages, error, model, config)
+        response = _complete(url, json_data, headers, repair_config, tokens)
+        result = _merge_repair(error, response.text())
+    except Exception as e:
+        _record_repair(False)
+        raise Exception(f"API调用失败: {error}（结果修复失败: {e}）")
+    _record_repair(True)
+    return result
+
+
+async def _arepair_result(messages: List[Dict[str, str]], error: EvaluationValidationError,
+                          model: str, config: AppConfig,
+                          semaphore: Optional[asyncio.Semaphore] = None) -> Dict[str, Any]:
+    """_repair_result 的异步版本"""
+    try:
+        url, json_data, headers, repair_config, tokens = _repair_request(messages, error, model, config)
+        response = await _acomplete(url, json_data, headers, repair_config, tokens, semaphore)
+        result = _merge_repair(error, response.text())
+    except Exception as e:
+        _record_repair(False)
+        raise Exception(f"API调用失败: {error}（结果修复失败: {e}）")
+    _record_repair(True)
+    return result
+
+
+def request_key(messages: List[Dict[str, str]], model: Optional[str] = None,
+                config: Optional[AppConfig] = None) -> str:
+    """
+    计算请求的规范化键（序列化请求体的摘要，内容相同的请求键相同）
+    
+    Args:
+        messages: 消息列表
+        model: 模型名称，默认使用配置中的 OPENAI_MODEL
+        config: 运行配置
+        
+    Returns:
+        str: SHA-256十六进制摘要
+    """
+    config = config or get_config()
+    _, json_data, _ = _build_chat_request(messages, model or config.model, config)
+    return ResponseCache.make_key(json_data)
+
+
+def chat_cache_key(cache: ResponseCache, messages: List[Dict[str, str]],
+                   model: Optional[str] = None,
+                   config: Optional[AppConfig] = None) -> str:
+    """
+    计算单条评估请求的缓存键（与 call_openai_api 使用的键一致）
+    
+    Args:
+        cache: 响应缓存
+        messages: 单条评估的消息列表
+        model: 模型名称，默认使用配置中的 OPENAI_MODEL
+        config: 运行配置
+        
+    Returns:
+        str: 缓存键
+    """
+    config = config or get_config()
+    _, json_data, _ = _build_chat_request(messages, model or config.model, config)
+    return cache.make_key(json_data)
+
+
+def call_openai_api_packed(messages: List[Dict[str, str]], record_ids: Sequence[str],
+                           model: Optional[str] = None,
+                           config: Optional[AppConfig] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    以一次请求评估多条记录（消息由 build_packed_evaluation_messages 构建）
+    
+    生成上限按记录数放大（不超过模型的最大输出长度）。回复中缺失、ID不匹配
+    或格式无效的记录不出现在返回结果中，由调用方回退为单条调用。
+    
+    Args:
+        messages: 打包评估的消息列表
+        record_ids: 本次请求包含的记录ID
+        model: 模型名称，默认使用配置中的 OPENAI_MODEL
+        config: 运行配置，默认使用 get_config() 的进程共享配置
+        
+    Returns:
+        Dict[str, Dict[str, Any]]: 记录ID -> 验证后的评估结果（后备端点作答时带 ``fallback`` 字段）
+        
+    Raises:
+        ContextLengthError: 预计超出模型上下文长度（发送前拒绝）
+        APIError: HTTP错误或网络错误（重试耗尽后）
+        Exception: 响应解析错误
+    """
+    config = resolve_config(config)
+    endpoints = endpoint_chain(config, model)
+    
+    def prepare(endpoint: AppConfig) -> PreparedRequest:
+        # 生成上限按记录数放大，不超过该端点模型的最大输出长度
+        max_tokens = min(endpoint.max_tokens * len(record_ids),
+                         get_model_profile(endpoint.model).max_output_tokens)
+        endpoint = dataclasses.replace(endpoint, max_tokens=max(endpoint.max_tokens, max_tokens))
+        return _prepare_chat_request(messages, endpoint)
+    
+    response, endpoint = _complete_with_failover(endpoints, prepare, prepare(endpoints[0]))
+    try:
+        results = _parse_packed_response(response.text(), record_ids)
     except Exception as e:
-        # 2.2.3b: 其他错误处理
         raise Exception(f"API调用失败: {str(e)}")
+    for result in results.values():
+        _mark_fallback(result, endpoint, endpoints)
+    return results
 
 
-def _extract_json_from_content(content: str) -> Dict[str, Any]:
+async def acall_openai_api(messages: List[Dict[str, str]], model: Optional[str] = None,
+                           semaphore: Optional[asyncio.Semaphore] = None,
+                           timeout: Optional[float] = None,
+                           cache: Optional[ResponseCache] = None,
+                           refresh: bool = False,
+                           config: Optional[AppConfig] = None) -> Dict[str, Any]:
+    """
+    call_openai_api 的异步版本，基于非阻塞的asyncio HTTP传输
+    
+    Args:
+        messages: 消息列表
+        model: 使用的模型名称，默认使用配置中的 OPENAI_MODEL
+        semaphore: 并发信号量（可选），用于限制同时在途的请求数
+        timeout: 单次调用截止时间（秒，含排队、限流等待和重试），默认30秒
+        cache: 响应缓存（可选）
+        refresh: 为True时忽略已有缓存并用新结果覆盖
+        config: 运行配置，默认使用 get_config() 的进程共享配置
+        
+    Returns:
+        Dict[str, Any]: 解析后的响应数据
+        
+    Raises:
+        TimeoutError: 超过截止时间
+        asyncio.CancelledError: 调用方取消了请求
+        ContextLengthError: 预计超出模型上下文长度（发送前拒绝）
+        APIError: HTTP错误或网络错误（重试耗尽后）
+        Exception: 响应解析错误
+    """
+    config = resolve_config(config)
+    endpoints = endpoint_chain(config, model)
+    prepare = functools.partial(_prepare_chat_request, messages)
+    prepared = prepare(endpoints[0])
+    deadline = 30.0 if timeout is None else timeout
+    
+    cache_key, cached = _cache_lookup(cache, refresh, prepared[1])
+    if cached is not None:
+        return cached
+    
+    try:
+        async with asyncio.timeout(deadline):
+            response, endpoint = await _acomplete_with_failover(endpoints, prepare, prepared, semaphore)
+            try:
+                result = _handle_chat_response(response)
+            except EvaluationValidationError as e:
+                result = await _arepair_result(messages, e, endpoint.model, endpoint, semaphore)
+    except TimeoutError:
+        raise TimeoutError(f"请求超时: 超过截止时间 {deadline} 秒")
+    
+    if not _mark_fallback(result, endpoint, endpoints) and cache_key is not None:
+        cache.put(cache_key, result)
+    return result
+
+
+def _result_events(result: Dict[str, Any]) -> Iterator[StreamEvent]:
+    """将完整结果拆分为流式事件（用于缓存命中时的流式输出）"""
+    yield 'total_score', result['total_score']
+    yield 'risk_level', result['risk_level']
+    for risk in result['risks']:
+        yield 'risk', risk
+    for suggestion in result['suggestions']:
+        yield 'suggestion', suggestion
+
+
+def stream_openai_api(messages: List[Dict[str, str]], model: Optional[str] = None,
+                      cache: Optional[ResponseCache] = None,
+                      refresh: bool = False,
+                      config: Optional[AppConfig] = None) -> Iterator[StreamEvent]:
+    """
+    以SSE流式方式调用Chat Completions API，边接收边增量解析评估JSON
+    
+    依次产出 ("total_score", 分数)、("risk_level", 等级)、("risk", 风险点)、
+    ("suggestion", 建议) 等事件（顺序与模型输出顺序一致），
+    最后产出 ("result", 验证后的完整结果)。
+    建立连接阶段与 call_openai_api 一样受限流和重试控制；流开始后出错不再重试。
+    
+    Args:
+        messages: 消息列表
+        model: 使用的模型名称，默认使用配置中的 OPENAI_MODEL
+        cache: 响应缓存（可选），与非流式调用共用缓存键
+        refresh: 为True时忽略已有缓存并用新结果覆盖
+        config: 运行配置，默认使用 get_config() 的进程共享配置
+        
+    Yields:
+        StreamEvent: (事件类型, 值)
+        
+    Raises:
+        ContextLengthError: 预计超出模型上下文长度（发送前拒绝）
+        APIError: HTTP错误或网络错误
+        Exception: 响应解析错误
+    """
+    config = resolve_config(config)
+    model = model or config.model
+    tokens = _preflight(messages, model, config)
+    
+    cache_key, cached = None, None
+    if cache is not None:
+        _, plain_body, _ = _build_chat_request(messages, model, config)
+        cache_key, cached = _cache_lookup(cache, refresh, plain_body)
+    if cached is not None:
+        yield from _result_events(cached)
+        yield 'result', cached
+        return
+    
+    url, json_data, headers = _build_chat_request(messages, model, config, stream=True)
+    headers['Accept'] = 'text/event-stream'
+    parser = IncrementalEvaluationParser()
+    pool = get_pool_manager(maxsize=config.pool_size, idle_timeout=config.pool_idle_timeout)
+    
+    def open_stream() -> Tuple[ExitStack, http.client.HTTPResponse]:
+        stack = ExitStack()
+        try:
+            response = stack.enter_context(
+                pool.stream('POST', url, body=json_data, headers=headers, timeout=config.request_timeout)
+            )
+            if response.status != 200:
+                body = response.read().decode('utf-8', errors='replace')
+                raise http_error(response.status, body, dict(
+                    (k.lower(), v) for k, v in response.getheaders()
+                ))
+        except (OSError, http.client.HTTPException) as e:
+            stack.close()
+            raise network_error(e)
+        except BaseException:
+            stack.close()
+            raise
+        return stack, response
+    
+    stack, response = send_with_retries(open_stream, config, tokens)
+    try:
+        with stack, timed('body_read'):
+            for raw_line in response:
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                payload = line[5:].strip()
+                if payload == '[DONE]':
+                    break
+                chunk = json.loads(payload)
+                if chunk.get('usage'):
+                    # 服务端开启了流式用量统计时，最后一个数据块携带整次调用的用量
+                    record_usage(chunk['usage'], chunk.get('model') or model)
+                choices = chunk.get('choices') or [{}]
+                content = (choices[0].get('delta') or {}).get('content')
+                if content:
+                    yield from parser.feed(content)
+            # 读完剩余内容以便连接复用
+            response.read()
+    except (OSError, http.client.HTTPException) as e:
+        raise network_error(e)
+    except json.JSONDecodeError as e:
+        raise Exception(f"API调用失败: 流式数据解析错误: {e}")
+    
+    try:
+        with timed('json_extract'):
+            content_json = extract_json_from_content(parser.text)
+        with timed('validate'):
+            result = validate_evaluation_result(content_json)
+    except EvaluationValidationError as e:
+        result = _repair_result(messages, e, model, config)
+    except Exception as e:
+        raise Exception(f"API调用失败: 响应解析失败: {e}")
+    
+    if cache_key is not None:
+        cache.put(cache_key, result)
+    yield 'result', result
+
+
+def extract_json_from_content(content: str) -> Dict[str, Any]:
     """
     从内容中提取JSON，处理可能包含其他文字的情况
     
+    整段内容是JSON、或从第一个左花括号起是完整对象时直接解码；否则单遍扫描内容（跳过字符串内的括号），
+    对每个顶层 {...} 片段尝试解码，返回第一个有效对象。末尾对象未闭合（输出被截断）时
+    补全括号修复，保留已完整生成的字段。
+    
     Args:
         content: 原始内容字符串
         
     Returns:
         Dict[str, Any]: 解析后的JSON对象
+        
+    Raises:
+        json.JSONDecodeError: 内容中没有可解析或可修复的JSON对象
     """
-    import re
-    
-    # 首先尝试直接解析
+    text = content.strip()
     try:
-        return json.loads(content.strip())
+        return _JSON_DECODER.decode(text)
     except json.JSONDecodeError:
         pass
     
-    # 尝试提取JSON代码块
-    json_match = re.search(r'```json\s*(\{.*?\})\s*```', content, re.DOTALL)
-    if json_match:
+    # 代码块或前后说明文字包裹的对象：从第一个左花括号起解码，忽略其后的内容
+    first = text.find('{')
+    if first > 0:
         try:
-            return json.loads(json_match.group(1))
+            result, _ = _JSON_DECODER.raw_decode(text, first)
+            if isinstance(result, dict):
+                return result
         except json.JSONDecodeError:
             pass
     
-    # 尝试提取花括号内的内容
-    brace_match = re.search(r'\{.*\}', content, re.DOTALL)
-    if brace_match:
-        try:
-            return json.loads(brace_match.group(0))
-        except json.JSONDecodeError:
-            pass
+    stack: List[str] = []
+    commas: List[Tuple[int, str]] = []
+    start = 0
+    in_string = False
+    pos = 0
+    while True:
+        match = _JSON_STRUCTURE.search(text, pos)
+        if match is None:
+            break
+        char, i = match.group(), match.start()
+        pos = i + 1
+        if not stack:
+            if char == '{':
+                stack.append('}')
+                start = i
+                commas = []
+        elif char == '"':
+            # 整个字符串（含转义字符）一次跳过
+            string_end = _JSON_STRING_REST.match(text, pos)
+            if string_end is None:
+                in_string = True
+                break
+            pos = string_end.end()
+        elif char == '{':
+            stack.append('}')
+        elif char == '[':
+            stack.append(']')
+        elif char == ',':
+            commas.append((i, ''.join(reversed(stack))))
+        elif char != stack.pop():
+            # 括号不匹配，放弃当前片段
+            stack.clear()
+        elif not stack:
+            try:
+                result = _JSON_DECODER.decode(text[start:i + 1])
+            except json.JSONDecodeError:
+                continue
+            if isinstance(result, dict):
+                return result
     
-    # 如果都失败了，抛出异常
-    raise json.JSONDecodeError(f"无法从内容中提取有效JSON: {content[:200]}...")
+    if stack:
+        repaired = _repair_truncated_json(text[start:], ''.join(reversed(stack)), in_string,
+                                          [(pos - start, closing) for pos, closing in commas])
+        if repaired is not None:
+            return repaired
+    
+    raise json.JSONDecodeError("无法从内容中提取有效JSON", content[:200], 0)
 
 
-def _parse_openai_response(response_data: str) -> Dict[str, Any]:
+def _repair_truncated_json(fragment: str, closing: str, in_string: bool,
+                           commas: List[Tuple[int, str]]) -> Optional[Dict[str, Any]]:
     """
-    解析OpenAI API响应
+    修复被截断的JSON对象
+    
+    片段以完整的字符串、数组或对象结尾时直接补全括号；截断处在字符串、键或数值的中间时
+    （数值可能只生成了一部分，如85被截成8），回退到最近的逗号处，丢弃未生成完的元素或字段后再补全括号。
     
     Args:
-        response_data: 原始响应字符串
+        fragment: 从对象起始到内容末尾的片段
+        closing: 末尾需要补齐的闭合括号
+        in_string: 片段是否结束在字符串内部
+        commas: 片段中结构逗号的位置及该处需要补齐的闭合括号
         
     Returns:
-        Dict[str, Any]: 解析后的评分数据
+        Optional[Dict[str, Any]]: 修复后的对象，无法修复时为None
     """
-    try:
+    complete = not in_string and fragment.rstrip()[-1:] in ('"', ']', '}')
+    candidates = [fragment + closing] if complete else []
+    candidates += [fragment[:pos] + comma_closing
+                   for pos, comma_closing in reversed(commas[-_MAX_REPAIR_ATTEMPTS:])]
+    for candidate in candidates:
+        try:
+            result = _JSON_DECODER.decode(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(result, dict):
+            return result
+    return None
+
+
+def _response_json(response_data: str) -> Any:
+    """
+    从Chat Completions响应体中取出消息内容并提取JSON（不做格式验证），并记录响应中的令牌用量
+    
+    Raises:
+        json.JSONDecodeError: 响应体或消息内容中没有有效JSON
+        KeyError: 响应缺少消息字段
+        ValueError: 响应中没有choices
+    """
+    with timed('json_extract'):
         # 2.2.2a: 响应JSON解析
         raw_response = json.loads(response_data)
         
         # 提取消息内容
         if 'choices' not in raw_response or not raw_response['choices']:
             raise ValueError("响应中没有choices字段")
+        record_usage(raw_response.get('usage'), raw_response.get('model', ''))
             
-        message_content = raw_response['choices'][0]['message']['content']
+        choice = raw_response['choices'][0]
+        message_content = choice['message']['content']
+        if choice.get('finish_reason') == 'length':
+            print("警告: 模型输出达到 max_tokens 上限被截断，仅保留已完整生成的字段", file=sys.stderr)
         
-        # 提取JSON内容（处理可能包含其他文字的情况）
-        evaluation_result = _extract_json_from_content(message_content)
+        # 提取JSON内容（处理可能包含其他文字的情况，截断的JSON会被修复）
+        return extract_json_from_content(message_content)
+
+
+def parse_openai_response(response_data: str) -> Dict[str, Any]:
+    """
+    解析OpenAI API响应
+    
+    Args:
+        response_data: 原始响应字符串
+        
+    Returns:
+        Dict[str, Any]: 解析后的评分数据
+        
+    Raises:
+        EvaluationValidationError: 评估结果字段缺失或格式无效（可发起结果修复）
+    """
+    try:
+        evaluation_result = _response_json(response_data)
         
         # 2.2.2b: 输出格式验证
-        return _validate_evaluation_result(evaluation_result)
+        with timed('validate'):
+            return validate_evaluation_result(evaluation_result)
         
+    except EvaluationValidationError:
+        raise
     except json.JSONDecodeError as e:
         # 2.2.3b: JSON解析错误处理
         raise Exception(f"JSON解析错误: {e}")
@@ -167,7 +1032,51 @@ def _parse_openai_response(response_data: str) -> Dict[str, Any]:
         raise Exception(f"响应解析失败: {e}")
 
 
-def _validate_evaluation_result(result: Dict[str, Any]) -> Dict[str, Any]:
+def _parse_packed_response(response_data: str,
+                           record_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    解析打包评估的响应，按记录ID拆分并逐条验证
+    
+    Args:
+        response_data: 原始响应字符串
+        record_ids: 请求中的记录ID
+        
+    Returns:
+        Dict[str, Dict[str, Any]]: 记录ID -> 验证后的评估结果（无效条目被跳过）
+    """
+    try:
+        with timed('json_extract'):
+            raw_response = json.loads(response_data)
+            if 'choices' not in raw_response or not raw_response['choices']:
+                raise ValueError("响应中没有choices字段")
+            record_usage(raw_response.get('usage'), raw_response.get('model', ''))
+            payload = extract_json_from_content(raw_response['choices'][0]['message']['content'])
+    except json.JSONDecodeError as e:
+        raise Exception(f"JSON解析错误: {e}")
+    except KeyError as e:
+        raise Exception(f"响应格式错误，缺少字段: {e}")
+    
+    items = payload if isinstance(payload, list) else payload.get('results')
+    if not isinstance(items, list):
+        raise ValueError("响应中没有results数组")
+    
+    wanted = set(record_ids)
+    results: Dict[str, Dict[str, Any]] = {}
+    with timed('validate'):
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            record_id = str(item.get('id', ''))
+            if record_id not in wanted or record_id in results:
+                continue
+            try:
+                results[record_id] = validate_evaluation_result(item)
+            except ValueError:
+                continue
+    return results
+
+
+def validate_evaluation_result(result: Dict[str, Any]) -> Dict[str, Any]:
     """
     验证评估结果格式
     
@@ -176,38 +1085,64 @@ def _validate_evaluation_result(result: Dict[str, Any]) -> Dict[str, Any]:
         
     Returns:
         Dict[str, Any]: 验证并标准化后的结果
+        
+    Raises:
+        EvaluationValidationError: 字段缺失或格式无效（列出全部问题字段，并携带原始结果）
     """
+    if not isinstance(result, dict):
+        raise ValueError("评估结果必须是JSON对象")
+    problems: Dict[str, str] = {}
+    
     # 检查必需字段
     required_fields = ['total_score', 'risks', 'suggestions']
     for field in required_fields:
         if field not in result:
-            raise ValueError(f"缺少必需字段: {field}")
+            problems[field] = "缺少必需字段"
     
-    # 基础数据类型验证
-    if not isinstance(result['total_score'], (int, float)):
-        raise ValueError("total_score必须是数字")
-        
-    if not isinstance(result['risks'], list):
-        raise ValueError("risks必须是列表")
-        
-    if not isinstance(result['suggestions'], list):
-        raise ValueError("suggestions必须是列表")
+    # 基础数据类型验证（数字字符串按数字接受）
+    total_score = None
+    if 'total_score' in result:
+        try:
+            if isinstance(result['total_score'], bool):
+                raise TypeError
+            total_score = float(result['total_score'])
+        except (TypeError, ValueError):
+            problems['total_score'] = "必须是数字"
+    
+    for field in ('risks', 'suggestions'):
+        if field in result and not isinstance(result[field], list):
+            problems[field] = "必须是列表"
+    
+    risk_level = 'Unknown'
+    if 'risk_level' in result:
+        risk_level = _RISK_LEVEL_ALIASES.get(str(result['risk_level']).strip().lower())
+        if risk_level is None:
+            problems['risk_level'] = f"无效的风险等级 {result['risk_level']!r}"
+    
+    if problems:
+        raise EvaluationValidationError(result, problems)
     
     # 标准化输出格式
     standardized_result = {
-        'total_score': float(result['total_score']),
+        'total_score': total_score,
         'risks': [str(risk) for risk in result['risks']],
         'suggestions': [str(suggestion) for suggestion in result['suggestions']],
-        'risk_level': result.get('risk_level', 'Unknown')
+        'risk_level': risk_level
     }
     
     # 分数范围验证
     if not (0 <= standardized_result['total_score'] <= 100):
-        print(f"警告: 分数超出范围 [0-100]: {standardized_result['total_score']}")
+        print(f"警告: 分数超出范围 [0-100]: {standardized_result['total_score']}", file=sys.stderr)
     
     return standardized_result
 
 
+# 旧的模块私有名称，保留给已有的调用方
+_extract_json_from_content = extract_json_from_content
+_parse_openai_response = parse_openai_response
+_validate_evaluation_result = validate_evaluation_result
+
+
 def test_api_connection() -> bool:
     """
     测试API连接是否正常
@@ -0,0 +1,456 @@
+"""
+性能剖析模块
+对评估流程做CPU剖析（cProfile统计 + 按墙钟时间采样的调用栈）和内存剖析（tracemalloc），
+结果保存为pstats、折叠调用栈（可直接生成火焰图）和tracemalloc快照，并输出热点摘要
+"""
+
+import atexit
+import cProfile
+import functools
+import inspect
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    from .utils import get_config
+except ImportError:
+    from utils import get_config
+
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+# 支持的剖析模式
+PROFILE_MODES = ('cpu', 'mem')
+
+# 调用栈采样间隔（秒）
+DEFAULT_SAMPLE_INTERVAL = 0.01
+
+# tracemalloc为每次分配保留的调用栈深度
+MEM_TRACE_FRAMES = 10
+
+# 摘要中列出的热点数
+TOP_ENTRIES = 15
+
+# Python 3.12起cProfile基于sys.monitoring：同一时刻只能启用一个剖析器，且它覆盖所有线程
+_PROCESS_WIDE_PROFILE = sys.version_info >= (3, 12)
+
+# 线程名中的序号（ThreadPoolExecutor-0_3 -> ThreadPoolExecutor），同一线程池的采样合并到一个根节点
+_THREAD_INDEX = re.compile(r'[-_]\d+$')
+
+
+def parse_profile_modes(value: str) -> Tuple[str, ...]:
+    """
+    解析剖析模式（逗号分隔，如 "cpu"、"mem"、"cpu,mem"；空字符串表示关闭）
+
+    Args:
+        value: 模式字符串
+
+    Returns:
+        Tuple[str, ...]: 去重后的模式
+
+    Raises:
+        ValueError: 包含不支持的模式
+    """
+    modes = []
+    for mode in value.split(','):
+        mode = mode.strip().lower()
+        if not mode:
+            continue
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"不支持的剖析模式: {mode}（可选 {', '.join(PROFILE_MODES)}）")
+        if mode not in modes:
+            modes.append(mode)
+    return tuple(modes)
+
+
+def output_prefix(output: Optional[str], profile_dir: str) -> str:
+    """
+    剖析结果的文件路径前缀：有输出文件时放在其旁边（results.jsonl -> results.cpu.pstats），
+    否则放在 profile_dir 下按时间和进程号命名
+
+    Args:
+        output: 评估结果输出文件路径（可选）
+        profile_dir: 剖析结果目录（EVAL_PROFILE_DIR）
+
+    Returns:
+        str: 文件路径前缀
+    """
+    if output:
+        return os.path.splitext(output)[0]
+    return os.path.join(profile_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """进程的峰值常驻内存（字节），平台不支持时为None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _ThreadProfile:
+    """单个线程的cProfile及其嵌套深度（3.12之前cProfile只剖析启用它的线程）"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.depth = 0
+        self.enabled = False
+
+
+class Profiler:
+    """
+    一次运行的性能剖析
+
+    CPU模式下，Python 3.12及以上在整个剖析期间启用一个进程级cProfile（覆盖所有线程）；
+    更早的版本由经 profile_thread() 进入的线程各自启用cProfile（批量模式的工作线程、
+    服务模式的请求线程同样被统计），结束时合并。cProfile无法启用（如已有其他剖析工具）时
+    只打印警告，不影响评估。另有后台线程按固定间隔采样所有线程的调用栈，
+    生成按墙钟时间计的折叠调用栈（包括等待网络的时间）。内存模式下启用tracemalloc。
+    """
+
+    def __init__(self, modes: Sequence[str], prefix: str,
+                 sample_interval: float = DEFAULT_SAMPLE_INTERVAL):
+        """
+        Args:
+            modes: 剖析模式（见 PROFILE_MODES）
+            prefix: 输出文件路径前缀（如 results -> results.cpu.pstats）
+            sample_interval: 调用栈采样间隔（秒）
+        """
+        self.modes = tuple(modes)
+        self.prefix = prefix
+        self.sample_interval = sample_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiles: List[_ThreadProfile] = []
+        self._caller: Optional[_ThreadProfile] = None
+        self._process: Optional[cProfile.Profile] = None
+        self._cpu_failed = False
+        self._samples: Counter = Counter()
+        self._stop_sampling = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started = 0.0
+
+    @property
+    def cpu(self) -> bool:
+        return 'cpu' in self.modes
+
+    @property
+    def mem(self) -> bool:
+        return 'mem' in self.modes
+
+    def start(self, profile_caller: bool = True) -> None:
+        """
+        开始剖析
+
+        Args:
+            profile_caller: 是否从现在起剖析调用线程（直到 stop，须在同一线程调用 stop）
+        """
+        self._started = time.perf_counter()
+        if self.mem:
+            tracemalloc.start(MEM_TRACE_FRAMES)
+        if self.cpu:
+            if _PROCESS_WIDE_PROFILE:
+                profile = cProfile.Profile()
+                if self._enable(profile):
+                    self._process = profile
+            elif profile_caller:
+                self._caller = self._enter_thread()
+            self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+            self._sampler.start()
+
+    def _enable(self, profile: cProfile.Profile) -> bool:
+        """启用cProfile；失败时只警告一次，之后只保留调用栈采样"""
+        try:
+            profile.enable()
+            return True
+        except (ValueError, RuntimeError) as e:
+            with self._lock:
+                warn, self._cpu_failed = not self._cpu_failed, True
+            if warn:
+                print(f"警告: 无法启用cProfile，仅采样调用栈: {e}", file=sys.stderr)
+            return False
+
+    def _enter_thread(self) -> _ThreadProfile:
+        """当前线程的剖析嵌套深度加一，从0变为1时启用该线程的cProfile"""
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            state = self._local.state = _ThreadProfile()
+            with self._lock:
+                self._profiles.append(state)
+        state.depth += 1
+        if state.depth == 1:
+            state.enabled = self._enable(state.profile)
+        return state
+
+    @staticmethod
+    def _exit_thread(state: _ThreadProfile) -> None:
+        state.depth -= 1
+        if state.depth == 0 and state.enabled:
+            state.profile.disable()
+            state.enabled = False
+
+    @contextmanager
+    def profile_thread(self) -> Iterator[None]:
+        """
+        在代码块范围内剖析当前线程（可嵌套；同一线程的并发异步任务按深度计数共用一个cProfile）
+
+        进程级cProfile已覆盖所有线程，或cProfile无法启用时不做任何事
+        """
+        if not self.cpu or _PROCESS_WIDE_PROFILE or self._cpu_failed:
+            yield
+            return
+        state = self._enter_thread()
+        try:
+            yield
+        finally:
+            self._exit_thread(state)
+
+    def _sample(self) -> None:
+        """后台采样所有线程的调用栈（折叠格式: 线程;外层函数;...;内层函数）"""
+        own = threading.get_ident()
+        while not self._stop_sampling.wait(self.sample_interval):
+            names = {thread.ident: _THREAD_INDEX.sub('', thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                self._samples[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> str:
+        """
+        停止剖析，写出结果文件
+
+        Returns:
+            str: 热点摘要（含峰值内存和输出文件路径）
+        """
+        elapsed = time.perf_counter() - self._started
+        directory = os.path.dirname(self.prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        lines = [f"性能剖析 ({','.join(self.modes)}): 耗时 {elapsed:.2f} 秒"]
+        peak = peak_rss_bytes()
+        if peak is not None:
+            lines[0] += f"，峰值RSS {peak / 1024 / 1024:.1f} MB"
+        saved: List[str] = []
+        if self.cpu:
+            lines.extend(self._stop_cpu(saved))
+        if self.mem:
+            lines.extend(self._stop_mem(saved))
+        if saved:
+            lines.append(f"已保存: {', '.join(saved)}")
+        return "\n".join(lines)
+
+    def _stop_cpu(self, saved: List[str]) -> List[str]:
+        """停止CPU剖析，写出pstats和折叠调用栈，返回热点摘要行"""
+        if self._caller is not None:
+            self._exit_thread(self._caller)
+            self._caller = None
+        self._stop_sampling.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+        folded_path = f"{self.prefix}.cpu.folded"
+        with open(folded_path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self._samples.items()):
+                f.write(f"{stack} {count}\n")
+        saved.append(folded_path)
+
+        if self._process is not None:
+            self._process.disable()
+            profiles = [self._process]
+            scope = "所有线程"
+        else:
+            with self._lock:
+                # 仍在其他线程中运行的剖析无法安全停止，跳过
+                profiles = [state.profile for state in self._profiles if state.depth == 0]
+            scope = f"{len(profiles)} 个线程"
+        if self._cpu_failed:
+            return ["CPU热点: cProfile不可用，仅保存了采样调用栈"]
+        if not profiles:
+            return ["CPU热点: 没有剖析到评估调用"]
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats_path = f"{self.prefix}.cpu.pstats"
+        stats.dump_stats(stats_path)
+        saved.append(stats_path)
+
+        lines = [f"CPU热点（按自身耗时，{scope}）:",
+                 f"  {'自身(ms)':>10}{'累计(ms)':>10}{'调用次数':>8}  函数"]
+        entries = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+        for func, (_, calls, self_time, cumulative, _) in entries[:TOP_ENTRIES]:
+            lines.append(f"  {self_time * 1000:>12.1f}{cumulative * 1000:>12.1f}{calls:>12}  {_func_label(func)}")
+        return lines
+
+    def _stop_mem(self, saved: List[str]) -> List[str]:
+        """停止内存剖析，写出tracemalloc快照和分配排行，返回摘要行"""
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        snapshot_path = f"{self.prefix}.mem.tracemalloc"
+        snapshot.dump(snapshot_path)
+        saved.append(snapshot_path)
+        top_stats = snapshot.statistics('lineno')
+        top_path = f"{self.prefix}.mem.txt"
+        with open(top_path, 'w', encoding='utf-8') as f:
+            f.write(f"traced current={current} peak={peak}\n")
+            for stat in top_stats[:100]:
+                f.write(f"{stat}\n")
+        saved.append(top_path)
+
+        lines = [f"内存分配（tracemalloc）: 当前 {current / 1024 / 1024:.1f} MB，峰值 {peak / 1024 / 1024:.1f} MB，"
+                 f"分配最多的位置:"]
+        for stat in top_stats[:TOP_ENTRIES]:
+            frame = stat.traceback[0]
+            lines.append(f"  {stat.size / 1024:>10.1f} KB {stat.count:>8} 块  "
+                         f"{os.path.basename(frame.filename)}:{frame.lineno}")
+        return lines
+
+
+def _func_label(func: Tuple[str, int, str]) -> str:
+    """pstats的函数键 -> 文件名:行号(函数名)"""
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+# 进程内当前的剖析（同一时间只有一个）
+_active: Optional[Profiler] = None
+_active_lock = threading.Lock()
+_env_checked = False
+
+
+def start_profiling(modes: Sequence[str], prefix: str, profile_caller: bool = True) -> Profiler:
+    """
+    开始进程内剖析；经 profiled 装饰的评估入口在剖析期间自动被统计
+
+    Args:
+        modes: 剖析模式（见 PROFILE_MODES）
+        prefix: 输出文件路径前缀
+        profile_caller: 是否同时剖析调用线程
+
+    Returns:
+        Profiler: 剖析对象
+
+    Raises:
+        RuntimeError: 已有进行中的剖析
+    """
+    global _active, _env_checked
+    with _active_lock:
+        if _active is not None:
+            raise RuntimeError("已有进行中的性能剖析")
+        _env_checked = True
+        profiler = Profiler(modes, prefix)
+        profiler.start(profile_caller)
+        _active = profiler
+        return profiler
+
+
+def stop_profiling() -> Optional[str]:
+    """
+    停止进程内剖析并写出结果
+
+    Returns:
+        Optional[str]: 热点摘要，没有进行中的剖析时为None
+    """
+    global _active
+    with _active_lock:
+        profiler, _active = _active, None
+    if profiler is None:
+        return None
+    return profiler.stop()
+
+
+def _stop_at_exit() -> None:
+    report = stop_profiling()
+    if report is not None:
+        print(report, file=sys.stderr)
+
+
+def _profiler_from_env() -> Optional[Profiler]:
+    """首次调用评估入口时按 EVAL_PROFILE 配置开始剖析，进程退出时写出结果"""
+    global _env_checked
+    with _active_lock:
+        if _env_checked:
+            return _active
+        _env_checked = True
+    config = get_config()
+    try:
+        modes = parse_profile_modes(config.profile)
+    except ValueError as e:
+        print(f"警告: EVAL_PROFILE 无效，不进行性能剖析: {e}", file=sys.stderr)
+        return None
+    if not modes:
+        return None
+    try:
+        profiler = start_profiling(modes, output_prefix(None, config.profile_dir), profile_caller=False)
+    except RuntimeError:
+        return _active
+    atexit.register(_stop_at_exit)
+    return profiler
+
+
+def _current_profiler() -> Optional[Profiler]:
+    return _active if _env_checked else _profiler_from_env()
+
+
+def profiled(fn: F) -> F:
+    """
+    评估入口装饰器：剖析进行中时在当前线程统计该调用（支持普通函数、生成器和协程函数）
+
+    未开始剖析时首次调用会检查 EVAL_PROFILE 配置，此后未启用剖析的调用几乎没有额外开销。
+    """
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            profiler = _current_profiler()
+            if profiler is None:
+                return await fn(*args, **kwargs)
+            with profiler.profile_thread():
+                return await fn(*args, **kwargs)
+        return async_wrapper
+
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            profiler = _current_profiler()
+            if profiler is None:
+                return (yield from fn(*args, **kwargs))
+            with profiler.profile_thread():
+                return (yield from fn(*args, **kwargs))
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profiler = _current_profiler()
+        if profiler is None:
+            return fn(*args, **kwargs)
+        with profiler.profile_thread():
+            return fn(*args, **kwargs)
+    return wrapper
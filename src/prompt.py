@@ -3,7 +3,19 @@ Prompt模板管理模块
 提供手术质控评估的Prompt模板和拼装功能
 """
 
-from typing import List, Dict, Any
+import json
+import sys
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    from .tokens import DEFAULT_PROFILE, estimate_text_tokens, get_model_profile
+except ImportError:
+    from tokens import DEFAULT_PROFILE, estimate_text_tokens, get_model_profile
+
+
+# Prompt版本：修改系统Prompt、用户Prompt模板或手术类型指导时递增，
+# 随评估结果写入结果库，便于区分不同Prompt下的评估结果
+PROMPT_VERSION = "2"
 
 
 # 系统Prompt模板
@@ -47,6 +59,64 @@ USER_PROMPT_TEMPLATE = """请评估以下{surgery_type}手术的操作步骤：
 请根据医学标准和安全规范，对上述手术步骤进行全面评估。"""
 
 
+# 本地规则预检提示（附加在用户Prompt之后）
+HINTS_TEMPLATE = """
+
+本地规则预检提示（仅供参考，请以记录内容为准）：
+{hints}"""
+
+
+# 打包评估的系统Prompt：评估标准与单条评估相同，输出改为按记录ID组织的结果数组
+PACKED_SYSTEM_PROMPT = SYSTEM_PROMPT.split("请严格按照")[0] + """下面会提供多条手术记录，每条记录以"【记录ID: xxx】"开头。请逐条独立评估，严格按照以下JSON格式输出结果，必须是有效的JSON，不要包含任何其他文字说明：
+
+```json
+{
+  "results": [
+    {
+      "id": "记录ID",
+      "total_score": 85,
+      "risks": ["风险点1", "风险点2"],
+      "suggestions": ["改进建议1", "改进建议2"],
+      "risk_level": "Medium"
+    }
+  ]
+}
+```
+
+重要要求：
+1. 只输出JSON格式的内容，不要有其他解释文字
+2. results中每条记录对应一个结果，id必须与记录ID完全一致，不要遗漏或合并记录
+3. risk_level的值只能是：Low（低风险）、Medium（中风险）、High（高风险）
+4. total_score必须是0-100之间的数字"""
+
+
+# 打包评估中每条记录的模板（记录头格式需与 PACKED_SYSTEM_PROMPT 的说明一致）
+PACKED_RECORD_TEMPLATE = """【记录ID: {record_id}】
+手术类型：{surgery_type}
+手术步骤：
+{surgery_steps}"""
+
+
+# 结果修复Prompt：只要求模型重新给出缺失或无效的字段
+REPAIR_PROMPT_TEMPLATE = """你上一次输出的评估结果中以下字段缺失或格式无效：
+{problems}
+
+请只输出这些字段组成的JSON对象，不要重复其他字段，不要包含任何其他文字说明。"""
+
+# 评估结果各字段的格式说明（用于结果修复Prompt）
+FIELD_FORMATS = {
+    "total_score": "0-100之间的数字",
+    "risks": "字符串数组，每项为一个风险点",
+    "suggestions": "字符串数组，每项为一条改进建议",
+    "risk_level": "Low、Medium、High之一",
+}
+
+
+# 手术步骤描述的令牌数阈值（按目标模型的分词粒度估算）
+MIN_STEP_TOKENS = 30
+MAX_STEP_TOKENS = 4000
+
+
 # 手术类型映射
 SURGERY_TYPES = {
     "appendectomy": "阑尾切除术",
@@ -56,13 +126,15 @@ SURGERY_TYPES = {
 }
 
 
-def build_evaluation_messages(surgery_steps: str, surgery_type: str = "general") -> List[Dict[str, str]]:
+def build_evaluation_messages(surgery_steps: str, surgery_type: str = "general",
+                              hints: Optional[List[str]] = None) -> List[Dict[str, str]]:
     """
     构建用于评估的消息列表
     
     Args:
         surgery_steps: 手术步骤描述
         surgery_type: 手术类型（appendectomy/cholecystectomy/gastric_perforation/general）
+        hints: 本地规则预检提示（可选），附加在用户消息末尾
         
     Returns:
         List[Dict[str, str]]: 格式化的消息列表
@@ -75,6 +147,8 @@ def build_evaluation_messages(surgery_steps: str, surgery_type: str = "general")
         surgery_type=surgery_type_cn,
         surgery_steps=surgery_steps.strip()
     )
+    if hints:
+        user_content += HINTS_TEMPLATE.format(hints="\n".join(f"- {hint}" for hint in hints))
     
     # 返回消息列表
     messages = [
@@ -91,6 +165,59 @@ def build_evaluation_messages(surgery_steps: str, surgery_type: str = "general")
     return messages
 
 
+def build_packed_evaluation_messages(records: List[Tuple[str, str, str]]) -> List[Dict[str, str]]:
+    """
+    构建多条记录打包评估的消息列表（系统Prompt只发送一次）
+    
+    Args:
+        records: (记录ID, 手术类型, 手术步骤) 列表
+        
+    Returns:
+        List[Dict[str, str]]: 格式化的消息列表
+    """
+    blocks = [
+        PACKED_RECORD_TEMPLATE.format(
+            record_id=record_id,
+            surgery_type=SURGERY_TYPES.get(surgery_type, "一般手术"),
+            surgery_steps=surgery_steps.strip()
+        )
+        for record_id, surgery_type, surgery_steps in records
+    ]
+    user_content = (
+        f"请分别评估以下{len(records)}条手术记录的操作步骤：\n\n"
+        + "\n\n".join(blocks)
+        + "\n\n请根据医学标准和安全规范，对每条记录进行全面评估。"
+    )
+    return [
+        {"role": "system", "content": PACKED_SYSTEM_PROMPT},
+        {"role": "user", "content": user_content}
+    ]
+
+
+def build_repair_messages(messages: List[Dict[str, str]], partial: Dict[str, Any],
+                          problems: Dict[str, str]) -> List[Dict[str, str]]:
+    """
+    构建结果修复的消息列表：原评估对话 + 上一次的部分结果 + 只针对问题字段的追问
+    
+    Args:
+        messages: 原评估请求的消息列表
+        partial: 上一次回复中解析出的部分结果
+        problems: 字段 -> 问题说明
+        
+    Returns:
+        List[Dict[str, str]]: 格式化的消息列表
+    """
+    lines = [
+        f"- {field}（应为{FIELD_FORMATS[field]}）：{reason}" if field in FIELD_FORMATS
+        else f"- {field}：{reason}"
+        for field, reason in problems.items()
+    ]
+    return messages + [
+        {"role": "assistant", "content": json.dumps(partial, ensure_ascii=False)},
+        {"role": "user", "content": REPAIR_PROMPT_TEMPLATE.format(problems="\n".join(lines))}
+    ]
+
+
 def get_surgery_specific_guidance(surgery_type: str) -> str:
     """
     获取手术类型特定的评估指导
@@ -142,12 +269,13 @@ def get_surgery_specific_guidance(surgery_type: str) -> str:
     return guidance.get(surgery_type, guidance["general"])
 
 
-def validate_surgery_steps(surgery_steps: str) -> bool:
+def validate_surgery_steps(surgery_steps: str, model: Optional[str] = None) -> bool:
     """
     验证手术步骤描述是否有效
     
     Args:
         surgery_steps: 手术步骤描述
+        model: 目标模型名称，用于按其分词粒度估算令牌数（默认按保守参数估算）
         
     Returns:
         bool: 是否有效
@@ -155,12 +283,14 @@ def validate_surgery_steps(surgery_steps: str) -> bool:
     if not surgery_steps or not surgery_steps.strip():
         return False
         
-    # 基本长度检查
-    if len(surgery_steps.strip()) < 50:
-        print("警告: 手术步骤描述过短，可能影响评估质量")
+    # 基本长度检查（按令牌数而非字符数，中文字符的令牌开销与英文不同）
+    profile = get_model_profile(model) if model else DEFAULT_PROFILE
+    tokens = estimate_text_tokens(surgery_steps.strip(), profile)
+    if tokens < MIN_STEP_TOKENS:
+        print(f"警告: 手术步骤描述过短（约 {tokens} 令牌），可能影响评估质量", file=sys.stderr)
         
-    if len(surgery_steps.strip()) > 2000:
-        print("警告: 手术步骤描述过长，可能超出模型处理能力")
+    if tokens > MAX_STEP_TOKENS:
+        print(f"警告: 手术步骤描述过长（约 {tokens} 令牌），可能影响评估质量", file=sys.stderr)
         
     return True
 
@@ -0,0 +1,291 @@
+"""
+限流与重试模块
+提供按请求数/令牌数每分钟限流的令牌桶、AIMD自适应并发控制，以及支持Retry-After的抖动重试策略
+"""
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from .utils import AppConfig
+except ImportError:
+    from utils import AppConfig
+
+
+class TokenBucket:
+    """
+    令牌桶（预约式）
+
+    reserve() 立即扣减令牌并返回调用方需要等待的秒数，允许令牌为负（欠账），
+    因此并发调用方按预约顺序依次放行，同步和异步代码都可使用。
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate_per_minute: 每分钟补充的令牌数
+            capacity: 桶容量（允许的突发量），默认为10秒的补充量
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate * 10)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """
+        预约令牌
+
+        Args:
+            amount: 需要的令牌数（超过桶容量时按容量计）
+
+        Returns:
+            float: 需要等待的秒数
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class RateLimiter:
+    """
+    组合请求数/分钟（RPM）与令牌数/分钟（TPM）限制，并支持服务端要求的全局暂停
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        """
+        Args:
+            requests_per_minute: 每分钟请求数上限，0 表示不限制
+            tokens_per_minute: 每分钟令牌数上限，0 表示不限制
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 0) -> float:
+        """
+        为一次请求预约配额
+
+        Args:
+            tokens: 本次请求预计消耗的令牌数
+
+        Returns:
+            float: 需要等待的秒数
+        """
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and tokens > 0:
+            wait = max(wait, self.tokens.reserve(tokens))
+        with self._lock:
+            wait = max(wait, self._paused_until - time.monotonic())
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """
+        在指定时间内暂停所有请求（如收到429及Retry-After时）
+
+        Args:
+            seconds: 暂停秒数
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens: float = 0) -> None:
+        """阻塞直到配额可用"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 0) -> None:
+        """异步等待直到配额可用"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD自适应并发控制
+
+    每次成功请求使并发上限加法增长（约每个窗口+1），收到限流响应时乘法减半；
+    一个冷却期内的连续限流只减半一次，避免单次突发把并发压到最低。
+    """
+
+    def __init__(self, max_limit: int = 32, min_limit: int = 1,
+                 initial_limit: Optional[int] = None,
+                 decrease_factor: float = 0.5, cooldown: float = 1.0):
+        """
+        Args:
+            max_limit: 并发上限的最大值
+            min_limit: 并发上限的最小值
+            initial_limit: 初始并发上限，默认为 max_limit
+            decrease_factor: 限流时的乘法减小系数
+            cooldown: 两次减小之间的最短间隔（秒）
+        """
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(initial_limit or self.max_limit)
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.throttle_count = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def try_acquire(self) -> bool:
+        """不阻塞地尝试占用一个并发槽位"""
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        """阻塞直到获得并发槽位"""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def aacquire(self) -> None:
+        """异步等待直到获得并发槽位（由 release 唤醒，不轮询）"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self._cond:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+    def release(self, success: bool = True, throttled: bool = False) -> None:
+        """
+        释放并发槽位并根据结果调整上限
+
+        Args:
+            success: 请求是否成功
+            throttled: 是否收到限流响应（429）
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttle_count += 1
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            elif success:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        # release 可能来自其他线程或事件循环，只能通过 call_soon_threadsafe 唤醒
+        for loop, future in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_wake, future)
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class RetryPolicy:
+    """指数退避 + 全抖动的重试策略，优先遵循服务端的Retry-After"""
+
+    RETRYABLE_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0,
+                 retry_after_max: float = 300.0):
+        """
+        Args:
+            max_retries: 最大重试次数
+            base_delay: 退避基数（秒）
+            max_delay: 自行退避时单次等待上限（秒）
+            retry_after_max: 服务端Retry-After的等待上限（秒），防止异常的超长值卡住调用方
+        """
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_after_max = retry_after_max
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        计算第 attempt 次重试前的等待时间
+
+        Args:
+            attempt: 已失败的次数（从0开始）
+            retry_after: 服务端要求的等待秒数
+
+        Returns:
+            float: 等待秒数
+        """
+        if retry_after is not None:
+            # 服务端明确给出的等待时间不受退避上限约束，提前重试只会再次被限流
+            return min(self.retry_after_max, max(0.0, retry_after))
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析Retry-After响应头（秒数或HTTP日期）
+
+    Args:
+        value: 响应头的值
+
+    Returns:
+        Optional[float]: 等待秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_limiters: Dict[str, Tuple[RateLimiter, AdaptiveConcurrency]] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiters(config: AppConfig) -> Tuple[RateLimiter, AdaptiveConcurrency]:
+    """
+    获取端点共享的限流器和并发控制器（按 base_url 区分，首次调用时按配置创建）
+
+    Args:
+        config: 运行配置
+
+    Returns:
+        Tuple[RateLimiter, AdaptiveConcurrency]: (限流器, 并发控制器)
+    """
+    with _limiters_lock:
+        limiters = _limiters.get(config.base_url)
+        if limiters is None:
+            limiters = (
+                RateLimiter(config.requests_per_minute, config.tokens_per_minute),
+                AdaptiveConcurrency(max_limit=config.max_concurrency),
+            )
+            _limiters[config.base_url] = limiters
+        return limiters
@@ -0,0 +1,415 @@
+"""
+评估结果库模块
+将每次评估结果连同元数据（手术类型、来源摘要、模型、Prompt版本、耗时和令牌数）
+写入本地SQLite，按手术类型、风险等级、总分和日期建立索引；
+stats 子命令直接在库内用SQL聚合生成分数分布、风险等级构成和高频风险点报表
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from .prompt import PROMPT_VERSION, SURGERY_TYPES
+    from .utils import AppConfig, get_config
+except ImportError:
+    from prompt import PROMPT_VERSION, SURGERY_TYPES
+    from utils import AppConfig, get_config
+
+
+# 分数分布的分档宽度
+SCORE_BUCKET_WIDTH = 10
+
+
+def source_hash(surgery_steps: str) -> str:
+    """
+    计算记录内容的摘要（同一份手术记录多次评估得到相同摘要）
+
+    Args:
+        surgery_steps: 手术步骤描述
+
+    Returns:
+        str: SHA-256十六进制摘要
+    """
+    return hashlib.sha256(surgery_steps.encode('utf-8')).hexdigest()
+
+
+def result_source(result: Dict[str, Any]) -> str:
+    """评估结果的来源: rules（规则预检）、near_dup（近似重复复用）或 model"""
+    if 'triage' in result:
+        return 'rules'
+    if 'reused' in result:
+        return 'near_dup'
+    return 'model'
+
+
+class ResultsStore:
+    """
+    基于SQLite的评估结果库，线程安全
+
+    ``evaluations`` 每次评估一行，风险点另存于 ``evaluation_risks``（每个风险点一行），
+    使高频风险点统计也能用索引上的 GROUP BY 完成，无需在Python中解析JSON。
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite数据库文件路径（":memory:" 表示内存库）
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if path != ':memory:' and directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ':memory:':
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS evaluations ("
+            " id INTEGER PRIMARY KEY,"
+            " created_at REAL NOT NULL,"
+            " surgery_type TEXT NOT NULL,"
+            " source_hash TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " prompt_version TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " total_score REAL NOT NULL,"
+            " risk_level TEXT NOT NULL,"
+            " risk_count INTEGER NOT NULL,"
+            " suggestion_count INTEGER NOT NULL,"
+            " latency REAL,"
+            " prompt_tokens INTEGER,"
+            " completion_tokens INTEGER,"
+            " result TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS evaluation_risks ("
+            " evaluation_id INTEGER NOT NULL REFERENCES evaluations (id),"
+            " risk TEXT NOT NULL)"
+        )
+        for name, columns in (
+            ('idx_evaluations_type_date', 'evaluations (surgery_type, created_at)'),
+            ('idx_evaluations_date', 'evaluations (created_at)'),
+            ('idx_evaluations_risk_level', 'evaluations (risk_level, created_at)'),
+            ('idx_evaluations_score', 'evaluations (total_score)'),
+            ('idx_evaluations_source_hash', 'evaluations (source_hash)'),
+            ('idx_evaluation_risks_evaluation', 'evaluation_risks (evaluation_id)'),
+            ('idx_evaluation_risks_risk', 'evaluation_risks (risk)'),
+        ):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+        self._conn.commit()
+
+    def add(self, result: Dict[str, Any], surgery_type: str, surgery_steps: str, model: str,
+            latency: Optional[float] = None, prompt_tokens: Optional[int] = None,
+            completion_tokens: Optional[int] = None, prompt_version: str = PROMPT_VERSION, created_at: Optional[float] = None) -> int:
+        """
+        写入一次评估结果
+
+        Args:
+            result: 验证后的评估结果
+            surgery_type: 手术类型
+            surgery_steps: 手术步骤描述（只保存其摘要）
+            model: 模型名称
+            latency: 评估耗时（秒）
+            prompt_tokens: 提示令牌数
+            completion_tokens: 生成令牌数
+            prompt_version: Prompt版本，默认为当前的 PROMPT_VERSION
+            created_at: 评估时间戳，默认为当前时间
+
+        Returns:
+            int: 新行的ID
+        """
+        risks = [str(risk).strip() for risk in result.get('risks', []) if str(risk).strip()]
+        row = (
+            time.time() if created_at is None else created_at,
+            surgery_type,
+            source_hash(surgery_steps),
+            model,
+            prompt_version,
+            result_source(result),
+            float(result['total_score']),
+            result['risk_level'],
+            len(risks),
+            len(result.get('suggestions', [])),
+            latency,
+            prompt_tokens,
+            completion_tokens,
+            json.dumps(result, ensure_ascii=False),
+        )
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO evaluations (created_at, surgery_type, source_hash, model,"
+                " prompt_version, source, total_score, risk_level, risk_count, suggestion_count,"
+                " latency, prompt_tokens, completion_tokens, result)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            evaluation_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO evaluation_risks (evaluation_id, risk) VALUES (?, ?)",
+                [(evaluation_id, risk) for risk in dict.fromkeys(risks)],
+            )
+            self._conn.commit()
+        return evaluation_id
+
+    @staticmethod
+    def _where(surgery_type: Optional[str], since: Optional[float], until: Optional[float],
+               model: Optional[str], prompt_version: Optional[str]) -> Tuple[str, List[Any]]:
+        """由过滤条件构造 WHERE 子句（列名均带 e. 前缀）"""
+        clauses: List[str] = []
+        params: List[Any] = []
+        for column, value in (('e.surgery_type = ?', surgery_type), ('e.created_at >= ?', since),
+                              ('e.created_at < ?', until), ('e.model = ?', model),
+                              ('e.prompt_version = ?', prompt_version)):
+            if value is not None:
+                clauses.append(column)
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query_stats(self, surgery_type: Optional[str] = None, since: Optional[float] = None,
+                    until: Optional[float] = None, model: Optional[str] = None,
+                    prompt_version: Optional[str] = None, top: int = 10) -> Dict[str, Any]:
+        """
+        聚合统计（全部在SQLite内完成，只返回汇总行）
+
+        Args:
+            surgery_type: 只统计该手术类型
+            since: 起始时间戳（含）
+            until: 截止时间戳（不含）
+            model: 只统计该模型
+            prompt_version: 只统计该Prompt版本
+            top: 高频风险点条数
+
+        Returns:
+            Dict[str, Any]: 总体指标（count、平均/最低/最高/中位分、平均耗时、令牌合计）、
+            score_distribution、risk_levels、by_surgery_type、sources 和 top_risks
+        """
+        where, params = self._where(surgery_type, since, until, model, prompt_version)
+        with self._lock:
+            overview = self._conn.execute(
+                "SELECT COUNT(*), AVG(e.total_score), MIN(e.total_score), MAX(e.total_score),"
+                " AVG(e.latency), SUM(e.prompt_tokens), SUM(e.completion_tokens),"
+                " MIN(e.created_at), MAX(e.created_at)"
+                f" FROM evaluations e{where}", params,
+            ).fetchone()
+            count = overview[0]
+            median = None
+            if count:
+                median = self._conn.execute(
+                    f"SELECT e.total_score FROM evaluations e{where}"
+                    " ORDER BY e.total_score LIMIT 1 OFFSET ?", params + [(count - 1) // 2],
+                ).fetchone()[0]
+            buckets = self._conn.execute(
+                f"SELECT MIN(CAST(e.total_score / {SCORE_BUCKET_WIDTH} AS INTEGER) * {SCORE_BUCKET_WIDTH},"
+                f" {100 - SCORE_BUCKET_WIDTH}) AS bucket, COUNT(*)"
+                f" FROM evaluations e{where} GROUP BY bucket ORDER BY bucket", params,
+            ).fetchall()
+            levels = self._conn.execute(
+                f"SELECT e.risk_level, COUNT(*) FROM evaluations e{where}"
+                " GROUP BY e.risk_level ORDER BY COUNT(*) DESC", params,
+            ).fetchall()
+            by_type = self._conn.execute(
+                "SELECT e.surgery_type, COUNT(*), AVG(e.total_score),"
+                " SUM(e.risk_level = 'High')"
+                f" FROM evaluations e{where} GROUP BY e.surgery_type ORDER BY COUNT(*) DESC", params,
+            ).fetchall()
+            sources = self._conn.execute(
+                f"SELECT e.source, COUNT(*) FROM evaluations e{where}"
+                " GROUP BY e.source ORDER BY COUNT(*) DESC", params,
+            ).fetchall()
+            top_risks = self._conn.execute(
+                "SELECT r.risk, COUNT(*) FROM evaluation_risks r"
+                f" JOIN evaluations e ON e.id = r.evaluation_id{where}"
+                " GROUP BY r.risk ORDER BY COUNT(*) DESC, r.risk LIMIT ?", params + [top],
+            ).fetchall()
+
+        def rounded(value: Optional[float], digits: int = 2) -> Optional[float]:
+            return None if value is None else round(value, digits)
+
+        return {
+            'count': count,
+            'mean_score': rounded(overview[1]),
+            'min_score': overview[2],
+            'max_score': overview[3],
+            'median_score': median,
+            'mean_latency': rounded(overview[4], 3),
+            'prompt_tokens': overview[5] or 0,
+            'completion_tokens': overview[6] or 0,
+            'first_at': overview[7],
+            'last_at': overview[8],
+            'score_distribution': [
+                {'range': f"{low}-{low + SCORE_BUCKET_WIDTH - 1 if low + SCORE_BUCKET_WIDTH < 100 else 100}",
+                 'count': n}
+                for low, n in buckets
+            ],
+            'risk_levels': {level: n for level, n in levels},
+            'by_surgery_type': [
+                {'surgery_type': name, 'count': n, 'mean_score': rounded(mean), 'high_risk': high}
+                for name, n, mean, high in by_type
+            ],
+            'sources': {name: n for name, n in sources},
+            'top_risks': [{'risk': risk, 'count': n} for risk, n in top_risks],
+        }
+
+    def count(self) -> int:
+        """结果总数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+_default_store: Optional[ResultsStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store(config: AppConfig) -> ResultsStore:
+    """
+    获取进程内共享的结果库（路径由 RESULTS_DB_PATH 配置，首次调用时创建）
+
+    Args:
+        config: 运行配置
+
+    Returns:
+        ResultsStore: 共享结果库实例
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ResultsStore(config.results_db_path)
+        return _default_store
+
+
+def _parse_date(value: str) -> float:
+    """解析 YYYY-MM-DD 日期为本地时间戳"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式应为 YYYY-MM-DD: {value}")
+
+
+def _month_range(value: str) -> Tuple[float, float]:
+    """解析 YYYY-MM 月份为 [月初, 下月初) 的时间戳区间"""
+    try:
+        start = datetime.strptime(value, '%Y-%m')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"月份格式应为 YYYY-MM: {value}")
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start.timestamp(), end.timestamp()
+
+
+def _format_time(timestamp: Optional[float]) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M') if timestamp else '-'
+
+
+def format_stats(stats: Dict[str, Any]) -> str:
+    """
+    格式化统计报表
+
+    Args:
+        stats: ResultsStore.query_stats 的返回值
+
+    Returns:
+        str: 可读的报表文本
+    """
+    if not stats['count']:
+        return "没有符合条件的评估结果"
+
+    count = stats['count']
+    lines = [
+        "=== 评估结果统计 ===",
+        f"评估次数: {count}（{_format_time(stats['first_at'])} 至 {_format_time(stats['last_at'])}）",
+        f"总分: 平均 {stats['mean_score']}，中位 {stats['median_score']}，"
+        f"最低 {stats['min_score']}，最高 {stats['max_score']}",
+    ]
+    if stats['mean_latency'] is not None:
+        lines.append(f"平均耗时: {stats['mean_latency']:.3f} 秒，令牌: 提示 {stats['prompt_tokens']}，"
+                     f"生成 {stats['completion_tokens']}")
+
+    lines.append("\n分数分布:")
+    width = max(stats['score_distribution'], key=lambda b: b['count'])['count']
+    for bucket in stats['score_distribution']:
+        bar = '█' * max(1, round(30 * bucket['count'] / width))
+        lines.append(f"  {bucket['range']:>7}  {bucket['count']:>6}  {bar}")
+
+    lines.append("\n风险等级:")
+    for level, n in stats['risk_levels'].items():
+        lines.append(f"  {level:<8} {n:>6}  {n / count:.1%}")
+
+    lines.append("\n按手术类型:")
+    for row in stats['by_surgery_type']:
+        name = SURGERY_TYPES.get(row['surgery_type'], row['surgery_type'])
+        lines.append(f"  {name}: {row['count']} 次，平均分 {row['mean_score']}，高风险 {row['high_risk']} 次")
+
+    lines.append("\n结果来源: " + "，".join(f"{name} {n}" for name, n in stats['sources'].items()))
+
+    if stats['top_risks']:
+        lines.append("\n高频风险点:")
+        for i, row in enumerate(stats['top_risks'], 1):
+            lines.append(f"  {i:>2}. {row['risk']}（{row['count']} 次）")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口（evaluate.py stats 子命令）"""
+    parser = argparse.ArgumentParser(
+        prog="evaluate.py stats",
+        description="汇总结果库中的评估结果：分数分布、风险等级构成和高频风险点",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+使用示例:
+  python src/evaluate.py stats --month 2024-06
+  python src/evaluate.py stats --type cholecystectomy --since 2024-01-01 --top 20
+  python src/evaluate.py stats --month 2024-06 --json > report.json
+        """
+    )
+    parser.add_argument("--db", help="结果库路径（默认取 RESULTS_DB_PATH）")
+    parser.add_argument("--type", "-T", choices=list(SURGERY_TYPES.keys()), help="只统计该手术类型")
+    period = parser.add_mutually_exclusive_group()
+    period.add_argument("--month", type=_month_range, metavar="YYYY-MM", help="只统计该月")
+    period.add_argument("--since", type=_parse_date, metavar="YYYY-MM-DD", help="起始日期（含）")
+    parser.add_argument("--until", type=_parse_date, metavar="YYYY-MM-DD", help="截止日期（不含）")
+    parser.add_argument("--model", help="只统计该模型")
+    parser.add_argument("--prompt-version", help="只统计该Prompt版本")
+    parser.add_argument("--top", type=int, default=10, help="高频风险点条数 (默认: 10)")
+    parser.add_argument("--json", action="store_true", help="以JSON输出")
+    args = parser.parse_args(argv)
+
+    if args.month and args.until:
+        parser.error("--month 不支持与 --until 同时使用")
+    since, until = args.month if args.month else (args.since, args.until)
+
+    path = args.db or get_config().results_db_path
+    if path != ':memory:' and not os.path.exists(path):
+        print(f"错误: 结果库不存在: {path}（评估时加 --store 写入结果库）", file=sys.stderr)
+        return 1
+
+    store = ResultsStore(path)
+    try:
+        stats = store.query_stats(args.type, since, until, args.model, args.prompt_version, max(0, args.top))
+    finally:
+        store.close()
+
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+    else:
+        print(format_stats(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
@@ -0,0 +1,336 @@
+"""
+本地规则预检模块
+按手术类型的评估要点（见 prompt.get_surgery_specific_guidance）构建检查清单，
+用Aho-Corasick多模式匹配一次扫描记录，给出确定性的预评分、缺失要点和异常提示；
+要点齐全且无异常提示的记录可直接判定为规范，无需调用模型
+"""
+
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick多模式匹配自动机
+
+    构建后一次扫描文本即可找出所有出现的模式，耗时与文本长度成正比，与模式数无关。
+    第i个模式对应位掩码的第i位，``match_mask`` 直接返回命中模式的位掩码。
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        """
+        Args:
+            patterns: 模式串（调用方负责与被搜索文本一致的规范化）
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[str, ...]] = [()]
+        self._mask: List[int] = [0]
+        self.patterns: List[str] = []
+
+        for pattern in patterns:
+            if pattern and pattern not in self.patterns:
+                self._insert(pattern, 1 << len(self.patterns))
+                self.patterns.append(pattern)
+        self._build_failure_links()
+
+    def _insert(self, pattern: str, bit: int) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._mask.append(0)
+            state = next_state
+        self._output[state] += (pattern,)
+        self._mask[state] |= bit
+
+    def _build_failure_links(self) -> None:
+        """按广度优先计算失配指针，并把后缀状态的输出并入当前状态"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+                self._mask[next_state] |= self._mask[self._fail[next_state]]
+
+    def search(self, text: str) -> Set[str]:
+        """
+        查找文本中出现的所有模式
+
+        Args:
+            text: 被搜索文本
+
+        Returns:
+            Set[str]: 出现过的模式
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        found: Set[str] = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def match_mask(self, text: str) -> int:
+        """
+        查找文本中出现的所有模式，以位掩码返回
+
+        Args:
+            text: 被搜索文本
+
+        Returns:
+            int: 命中模式对应位的按位或
+        """
+        goto, fail, masks = self._goto, self._fail, self._mask
+        found = 0
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            found |= masks[state]
+        return found
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    """
+    检查要点
+
+    ``groups`` 中每组至少有一个同义词出现在同一行（步骤）时视为满足，
+    如 (("阑尾动脉",), ("结扎", "夹闭")) 表示同一步骤中既提到阑尾动脉又提到结扎或夹闭。
+    """
+    name: str
+    groups: Tuple[Tuple[str, ...], ...]
+    weight: int = 1
+
+
+# 各类手术通用的要点
+_COMMON_CHECKPOINTS = (
+    Checkpoint("无菌消毒铺巾", (("消毒", "铺巾", "无菌"),)),
+    Checkpoint("止血确认", (("止血",),), weight=2),
+    Checkpoint("器械纱布计数", (("计数", "清点", "核对"), ("器械", "纱布", "敷料")), weight=2),
+    Checkpoint("逐层关闭切口", (("缝合", "关闭", "闭合"), ("切口", "腹膜", "戳孔", "皮肤", "逐层"))),
+)
+
+# 按手术类型的检查清单（由 get_surgery_specific_guidance 的评估要点整理）
+CHECKLISTS: Dict[str, Tuple[Checkpoint, ...]] = {
+    "appendectomy": (
+        Checkpoint("切口选择", (("mcburney", "麦氏", "右下腹", "腹腔镜"),)),
+        Checkpoint("阑尾动脉处理", (("阑尾动脉", "阑尾系膜"), ("结扎", "夹闭", "电凝", "切断", "处理")), weight=2),
+        Checkpoint("阑尾根部结扎", (("根部",), ("结扎", "套扎", "夹闭")), weight=2),
+        Checkpoint("残端处理", (("残端",), ("包埋", "荷包", "消毒", "电凝"))),
+        Checkpoint("腹腔冲洗", (("冲洗", "吸净", "吸引"),)),
+    ) + _COMMON_CHECKPOINTS,
+    "cholecystectomy": (
+        Checkpoint("Calot三角解剖", (("calot", "胆囊三角"), ("解剖", "显露", "暴露", "分离")), weight=2),
+        Checkpoint("胆囊动脉处理", (("胆囊动脉",), ("夹闭", "结扎", "切断", "离断")), weight=2),
+        Checkpoint("胆囊管处理", (("胆囊管",), ("夹闭", "结扎", "切断", "离断")), weight=2),
+        Checkpoint("胆囊床止血", (("胆囊床",), ("止血", "电凝"))),
+        Checkpoint("腹腔镜建立", (("气腹", "腹腔镜", "戳孔", "trocar"),)),
+    ) + _COMMON_CHECKPOINTS,
+    "gastric_perforation": (
+        Checkpoint("穿孔部位探查", (("穿孔",), ("探查", "发现", "明确", "位于")), weight=2),
+        Checkpoint("穿孔缝合修补", (("穿孔", "浆肌层", "修补"), ("缝合", "修补")), weight=2),
+        Checkpoint("大网膜覆盖", (("网膜",), ("覆盖", "填塞", "固定")), weight=2),
+        Checkpoint("腹腔冲洗", (("冲洗",),)),
+        Checkpoint("放置引流", (("引流",),)),
+    ) + _COMMON_CHECKPOINTS,
+    "general": (
+        Checkpoint("手术指征", (("诊断", "指征"),)),
+        Checkpoint("探查", (("探查",),)),
+    ) + _COMMON_CHECKPOINTS,
+}
+
+# 出现即需要模型复核的异常表述
+ALERT_PATTERNS = (
+    "计数有误", "计数不符", "清点不符", "纱布缺少", "器械缺少", "残留", "遗留", "误伤", "副损伤",
+    "胆总管损伤", "损伤胆总管", "肠管损伤", "血管损伤", "胆漏", "胆汁漏", "大出血", "止血不彻底",
+    "未结扎", "未止血", "未冲洗", "未计数", "未清点", "中转开腹", "污染严重", "心跳骤停",
+)
+
+# 否定或并发症线索：含这些表述的步骤不计入任何要点（"未能夹闭胆囊动脉"不算完成夹闭），
+# 且记录不能由规则直接判定。宁可多交给模型复核，也不让失败的操作被当作规范
+NEGATION_CUES = (
+    "未", "不能", "无法", "失败", "困难", "不全", "不彻底", "不清", "撕裂", "损伤", "破裂", "穿破",
+    "出血量", "出血约", "失血", "渗血", "渗漏", "中转",
+)
+
+# 含否定线索的器械名称（无损伤钳等），匹配前从步骤中去掉
+_INSTRUMENT_TERMS = re.compile("无损伤(抓钳|钳|缝线|线)")
+
+# 排除问题的表述（"确认无渗漏"、"未见活动性出血"），匹配前从步骤中去掉
+_RULED_OUT = re.compile("(?:无|未见|未发现|没有)(?:明显|活动性)?(?:出血|渗血|渗漏|损伤|破裂|撕裂)")
+
+# 常规记录的出血量（如"出血量：约20ml"）不超过该值（毫升）时视为正常，不作为并发症线索
+NORMAL_BLOOD_LOSS_ML = 100
+_BLOOD_LOSS = re.compile(r"(?:出血|失血)量?\s*[:：]?\s*约?\s*(\d+(?:\.\d+)?)\s*(?:ml|毫升)")
+
+# 规则判定为规范时给出的总分（"操作规范"档的下限：规则只能确认要点齐全，不评价操作质量）
+RULE_PASS_SCORE = 90
+
+
+# 全角字母和数字（清单中的英文模式需要与半角一致；中文标点不参与匹配，无需转换）
+_FULLWIDTH_ALNUM = re.compile('[\uff10-\uff19\uff21-\uff3a\uff41-\uff5a]')
+
+
+def _normalize(text: str) -> str:
+    return _FULLWIDTH_ALNUM.sub(lambda m: chr(ord(m.group()) - 0xFEE0), text).lower()
+
+
+class _CompiledChecklist:
+    """检查清单与其编译后的自动机"""
+
+    def __init__(self, checkpoints: Tuple[Checkpoint, ...]):
+        terms = sorted({_normalize(term) for cp in checkpoints for group in cp.groups for term in group}
+                       | {_normalize(p) for p in ALERT_PATTERNS}
+                       | {_normalize(cue) for cue in NEGATION_CUES})
+        self.matcher = AhoCorasick(terms)
+        # 要点的每组同义词合并为一个位掩码，与步骤的命中掩码相与即可判断
+        self.bits = {term: 1 << i for i, term in enumerate(self.matcher.patterns)}
+        self.checkpoints = [
+            (cp, [sum(self.bits[_normalize(term)] for term in set(group)) for group in cp.groups])
+            for cp in checkpoints
+        ]
+        self.alerts = [(self.bits[_normalize(p)], p) for p in ALERT_PATTERNS]
+        self.negation_mask = sum(self.bits[_normalize(cue)] for cue in set(NEGATION_CUES))
+
+
+def _strip_benign(line: str) -> str:
+    """去掉器械名称、排除问题的表述和正常范围内的出血量，剩下的否定线索才需要复核"""
+    line = _RULED_OUT.sub("", _INSTRUMENT_TERMS.sub(r"\1", line))
+    return _BLOOD_LOSS.sub(
+        lambda m: "" if float(m.group(1)) <= NORMAL_BLOOD_LOSS_ML else m.group(), line)
+
+
+_COMPILED = {surgery_type: _CompiledChecklist(checkpoints)
+             for surgery_type, checkpoints in CHECKLISTS.items()}
+
+
+@dataclass(frozen=True)
+class TriageResult:
+    """
+    规则预检结果
+
+    Attributes:
+        surgery_type: 手术类型
+        score: 按权重计算的要点覆盖率得分（0-100）
+        satisfied: 满足的要点
+        missing: 缺失的要点
+        alerts: 出现的异常表述
+        flagged: 含否定或并发症线索的步骤（不计入要点）
+    """
+    surgery_type: str
+    score: int
+    satisfied: Tuple[str, ...]
+    missing: Tuple[str, ...]
+    alerts: Tuple[str, ...]
+    flagged: Tuple[str, ...] = ()
+
+    @property
+    def conclusive(self) -> bool:
+        """要点齐全、无异常表述且没有否定或并发症线索时，规则可直接判定为规范"""
+        return not self.missing and not self.alerts and not self.flagged
+
+    def hints(self) -> List[str]:
+        """供模型参考的预检提示（结论明确时为空）"""
+        hints = []
+        if self.missing:
+            hints.append(f"记录中未见以下要点：{'、'.join(self.missing)}")
+        if self.alerts:
+            hints.append(f"记录提及需关注的情况：{'、'.join(self.alerts)}")
+        if self.flagged:
+            hints.append(f"以下步骤含否定或并发症表述，请重点核查：{'；'.join(self.flagged)}")
+        return hints
+
+    def as_evaluation(self) -> Dict[str, Any]:
+        """转换为评估结果格式（仅用于结论明确的记录），附带 ``triage`` 字段标明来源"""
+        return {
+            'total_score': RULE_PASS_SCORE,
+            'risks': [],
+            'suggestions': [],
+            'risk_level': 'Low',
+            'triage': {'source': 'rules', 'score': self.score, 'checkpoints': len(self.satisfied)},
+        }
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'surgery_type': self.surgery_type,
+            'score': self.score,
+            'conclusive': self.conclusive,
+            'satisfied': list(self.satisfied),
+            'missing': list(self.missing),
+            'alerts': list(self.alerts),
+            'flagged': list(self.flagged),
+        }
+
+
+def triage_record(surgery_steps: str, surgery_type: str = "general") -> TriageResult:
+    """
+    按检查清单预检手术记录
+
+    每个步骤（行）各扫描一次自动机，要点的各组同义词需出现在同一步骤中；
+    含否定或并发症线索（NEGATION_CUES）的步骤不计入要点，记录为 ``flagged``；
+    排除问题的表述（"确认无渗漏"）和不超过 NORMAL_BLOOD_LOSS_ML 的出血量不算线索。
+
+    Args:
+        surgery_steps: 手术步骤描述
+        surgery_type: 手术类型（未知类型按 general 处理）
+
+    Returns:
+        TriageResult: 预检结果
+    """
+    compiled = _COMPILED.get(surgery_type) or _COMPILED["general"]
+    masks: List[int] = []
+    flagged: List[str] = []
+    alert_mask = 0
+    for line in surgery_steps.splitlines():
+        mask = compiled.matcher.match_mask(_strip_benign(_normalize(line)))
+        alert_mask |= mask
+        if mask & compiled.negation_mask:
+            flagged.append(line.strip())
+        else:
+            masks.append(mask)
+
+    record_mask = 0
+    for mask in masks:
+        record_mask |= mask
+
+    satisfied: List[str] = []
+    missing: List[str] = []
+    earned = total = 0
+    for checkpoint, groups in compiled.checkpoints:
+        total += checkpoint.weight
+        # 先按整条记录的掩码排除，多组要点再逐步骤确认各组出现在同一步骤
+        ok = all(record_mask & group for group in groups)
+        if ok and len(groups) > 1:
+            ok = any(all(mask & group for group in groups) for mask in masks)
+        if ok:
+            satisfied.append(checkpoint.name)
+            earned += checkpoint.weight
+        else:
+            missing.append(checkpoint.name)
+    alerts = tuple(pattern for bit, pattern in compiled.alerts if alert_mask & bit)
+    return TriageResult(
+        surgery_type=surgery_type if surgery_type in _COMPILED else "general",
+        score=round(100 * earned / total) if total else 0,
+        satisfied=tuple(satisfied),
+        missing=tuple(missing),
+        alerts=alerts,
+        flagged=tuple(flagged),
+    )
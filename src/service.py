@@ -0,0 +1,507 @@
+"""
+常驻评估服务模块
+基于标准库ThreadingHTTPServer提供 POST /evaluate 和 POST /evaluate/batch，进程内共享配置、
+连接池、响应缓存和近似重复索引，避免每次评估重新启动进程；评估任务经优先级调度器执行，
+临床医生的交互式单条请求总是先于批量质控积压
+"""
+
+import argparse
+import functools
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from .evaluate import evaluate_surgery_steps, store_evaluations
+    from .batch import BatchRecord, _evaluate_record
+    from .prompt import SURGERY_TYPES, validate_surgery_steps
+    from .cache import get_default_cache
+    from .near_dup import get_default_index
+    from .results_store import get_default_store
+    from .metrics import get_registry
+    from .failover import reserve_hedge_threads
+    from .profiling import output_prefix, parse_profile_modes, start_profiling, stop_profiling
+    from .utils import get_config
+except ImportError:
+    from evaluate import evaluate_surgery_steps, store_evaluations
+    from batch import BatchRecord, _evaluate_record
+    from prompt import SURGERY_TYPES, validate_surgery_steps
+    from cache import get_default_cache
+    from near_dup import get_default_index
+    from results_store import get_default_store
+    from metrics import get_registry
+    from failover import reserve_hedge_threads
+    from profiling import output_prefix, parse_profile_modes, start_profiling, stop_profiling
+    from utils import get_config
+
+
+# 调度优先级（靠前的优先）
+PRIORITIES = ('interactive', 'bulk')
+
+# 请求体上限（字节）
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+
+class QueueFullError(Exception):
+    """调度队列已满"""
+
+
+class PriorityScheduler:
+    """
+    按优先级分队列的评估调度器，线程安全
+
+    工作线程总是先取交互队列中的任务；批量任务最多占用 ``workers - reserved`` 个工作线程，
+    保留的线程只执行交互任务，批量积压再多，交互请求也无需等待正在执行的批量任务结束。
+    同一优先级内按提交顺序执行。
+    """
+
+    def __init__(self, workers: int = 8, reserved: int = 1, max_queue: int = 10000):
+        """
+        Args:
+            workers: 工作线程数
+            reserved: 只执行交互任务的工作线程数（小于 workers）
+            max_queue: 每个优先级队列的最大排队任务数
+        """
+        self.workers = max(1, workers)
+        self.reserved = min(max(0, reserved), self.workers - 1)
+        self.max_queue = max_queue
+        self._queues: Dict[str, Deque[Tuple[Future, Callable[[], Any]]]] = {
+            priority: deque() for priority in PRIORITIES
+        }
+        self._running = {priority: 0 for priority in PRIORITIES}
+        self._completed = {priority: 0 for priority in PRIORITIES}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"evaluate-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn: Callable[[], Any], priority: str = 'interactive') -> Future:
+        """
+        提交任务
+
+        Args:
+            fn: 无参数的任务函数
+            priority: 优先级（见 PRIORITIES）
+
+        Returns:
+            Future: 任务结果（排队中的任务可取消）
+
+        Raises:
+            ValueError: 未知优先级
+            QueueFullError: 该优先级队列已满
+            RuntimeError: 调度器已关闭
+        """
+        if priority not in self._queues:
+            raise ValueError(f"未知优先级: {priority}（可选 {', '.join(PRIORITIES)}）")
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("调度器已关闭")
+            queue = self._queues[priority]
+            if len(queue) >= self.max_queue:
+                raise QueueFullError(f"{priority} 队列已满（{self.max_queue}）")
+            queue.append((future, fn))
+            self._cond.notify()
+        return future
+
+    def _next_task(self) -> Optional[Tuple[str, Future, Callable[[], Any]]]:
+        """取出下一个可执行的任务（调用方持有锁），没有时返回None"""
+        if self._queues['interactive']:
+            return ('interactive',) + self._queues['interactive'].popleft()
+        if self._queues['bulk'] and self._running['bulk'] < self.workers - self.reserved:
+            return ('bulk',) + self._queues['bulk'].popleft()
+        return None
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                task = self._next_task()
+                while task is None:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    task = self._next_task()
+                priority, future, fn = task
+                self._running[priority] += 1
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn())
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running[priority] -= 1
+                    self._completed[priority] += 1
+                    # 批量任务结束后可能有等待中的批量任务可以开始
+                    self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取调度统计
+
+        Returns:
+            Dict[str, Any]: 各优先级的排队数、执行中数和已完成数，以及工作线程配置
+        """
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'reserved_interactive': self.reserved,
+                'queued': {priority: len(queue) for priority, queue in self._queues.items()},
+                'running': dict(self._running),
+                'completed': dict(self._completed),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        关闭调度器：不再接受新任务，排队中的任务被取消
+
+        Args:
+            wait: 是否等待执行中的任务结束
+        """
+        with self._cond:
+            self._closed = True
+            for queue in self._queues.values():
+                while queue:
+                    future, _ = queue.popleft()
+                    future.cancel()
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+class RequestError(Exception):
+    """请求参数错误（返回400）"""
+
+
+def _parse_priority(payload: Dict[str, Any], default: str) -> str:
+    priority = payload.get('priority') or default
+    if priority not in PRIORITIES:
+        raise RequestError(f"未知优先级: {priority}（可选 {', '.join(PRIORITIES)}）")
+    return priority
+
+
+def _parse_record(entry: Any, index: int) -> BatchRecord:
+    """请求中的一条记录 {"id", "type", "text"} -> (记录ID, 手术类型, 手术步骤)，调度前先验证步骤文本"""
+    if not isinstance(entry, dict):
+        raise RequestError(f"第{index + 1}条记录不是JSON对象")
+    if 'text' not in entry:
+        raise RequestError(f"第{index + 1}条记录缺少 text 字段")
+    text = entry['text']
+    if not isinstance(text, str) or not validate_surgery_steps(text, get_config().model):
+        raise RequestError(f"第{index + 1}条记录的 text 字段必须是非空字符串")
+    surgery_type = entry.get('type') or 'general'
+    if surgery_type not in SURGERY_TYPES:
+        raise RequestError(f"未知手术类型: {surgery_type}（可选 {', '.join(SURGERY_TYPES)}）")
+    return str(entry.get('id') or f"record-{index + 1}"), surgery_type, text
+
+
+class EvaluationService:
+    """
+    评估服务的请求处理逻辑（与HTTP层分离，便于在其他传输方式中复用）
+    """
+
+    def __init__(self, evaluate_fn: Callable[..., Dict[str, Any]], scheduler: PriorityScheduler,
+                 timeout: float = 120.0, max_batch_records: int = 1000):
+        """
+        Args:
+            evaluate_fn: 评估函数，签名同 evaluate_surgery_steps(steps, type, refresh=...)
+            scheduler: 优先级调度器
+            timeout: 单条记录的等待上限（秒，含排队时间；批量请求中自前一条记录返回起计）
+            max_batch_records: 一次批量请求的最大记录数
+        """
+        self.evaluate_fn = evaluate_fn
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.max_batch_records = max_batch_records
+
+    def evaluate(self, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        评估单条记录（默认交互优先级）
+
+        Args:
+            payload: {"text": 手术步骤, "type": 手术类型, "id": 记录ID, "priority": 优先级, "refresh": 是否忽略缓存}
+
+        Returns:
+            Tuple[int, Dict[str, Any]]: (HTTP状态码, 响应体)
+        """
+        record_id, surgery_type, surgery_steps = _parse_record(payload, 0)
+        priority = _parse_priority(payload, 'interactive')
+        refresh = bool(payload.get('refresh'))
+        start = time.perf_counter()
+        future = self.scheduler.submit(
+            functools.partial(self.evaluate_fn, surgery_steps, surgery_type, refresh=refresh), priority
+        )
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            return 504, {'id': record_id, 'status': 'error',
+                         'error': f"评估超时: 超过 {self.timeout} 秒"}
+        except ValueError as e:
+            return 400, {'id': record_id, 'status': 'error', 'error': str(e)}
+        except Exception as e:
+            return 502, {'id': record_id, 'status': 'error', 'error': str(e)}
+        return 200, {'id': record_id, 'surgery_type': surgery_type, 'status': 'ok', 'result': result,
+                     'elapsed': round(time.perf_counter() - start, 3)}
+
+    def evaluate_batch(self, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        评估多条记录（默认批量优先级，每条记录单独调度，交互请求可以插在记录之间执行）
+
+        Args:
+            payload: {"records": [{"id", "type", "text"}, ...], "priority": 优先级}
+
+        Returns:
+            Tuple[int, Dict[str, Any]]: (HTTP状态码, {"results": 与输入顺序一致的结果行, "summary": 汇总})
+        """
+        entries = payload.get('records')
+        if not isinstance(entries, list) or not entries:
+            raise RequestError("缺少 records 数组")
+        if len(entries) > self.max_batch_records:
+            raise RequestError(f"单次最多 {self.max_batch_records} 条记录，实际 {len(entries)} 条")
+        records = [_parse_record(entry, i) for i, entry in enumerate(entries)]
+        priority = _parse_priority(payload, 'bulk')
+
+        start = time.perf_counter()
+        futures: List[Future] = []
+        try:
+            for record in records:
+                futures.append(self.scheduler.submit(
+                    functools.partial(_evaluate_record, self.evaluate_fn, record), priority
+                ))
+        except (QueueFullError, RuntimeError):
+            for future in futures:
+                future.cancel()
+            raise
+
+        results = [self._wait_record(future, record) for future, record in zip(futures, records)]
+        succeeded = sum(1 for line in results if line['status'] == 'ok')
+        return 200, {
+            'results': results,
+            'summary': {
+                'total': len(results),
+                'succeeded': succeeded,
+                'failed': len(results) - succeeded,
+                'elapsed': round(time.perf_counter() - start, 3),
+            },
+        }
+
+
+    def _wait_record(self, future: Future, record: BatchRecord) -> Dict[str, Any]:
+        """等待批量请求中的一条记录，超时时取消（尚未开始的）任务并返回该记录的错误行"""
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            return {'id': record[0], 'surgery_type': record[1], 'status': 'error',
+                    'error': f"评估超时: 超过 {self.timeout} 秒"}
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """评估服务的HTTP请求处理器（保持HTTP/1.1长连接）"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'HospitalAgent/0.1'
+    # 头部和响应体分两次写出，长连接上Nagle算法与延迟ACK叠加会让每个请求多等约40ms
+    disable_nagle_algorithm = True
+
+    @property
+    def service(self) -> EvaluationService:
+        return self.server.service
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_body(self, status: int, body: bytes, content_type: str,
+                   headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict[str, Any],
+                   headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self._send_body(status, body, 'application/json; charset=utf-8', headers)
+
+    def _send_error(self, status: int, message: str,
+                    headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_json(status, {'status': 'error', 'error': message}, headers)
+
+    def do_GET(self) -> None:
+        path = self.path.split('?', 1)[0]
+        if path == '/health':
+            self._send_json(200, {'status': 'ok', 'scheduler': self.service.scheduler.stats()})
+        elif path == '/metrics':
+            self._send_body(200, get_registry().render().encode('utf-8'),
+                            'text/plain; version=0.0.4; charset=utf-8')
+        else:
+            self._send_error(404, f"未知路径: {self.path}")
+
+    def do_POST(self) -> None:
+        # 请求体读不完整时连接上残留的数据无法解析，出错后一律关闭连接
+        if 'Content-Length' not in self.headers:
+            self.close_connection = True
+            self._send_error(411, "缺少 Content-Length 请求头")
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._send_error(400, f"无效的 Content-Length: {self.headers['Content-Length']}")
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send_error(413, f"请求体超过 {MAX_BODY_BYTES} 字节")
+            return
+        body = self.rfile.read(length)
+
+        path = self.path.split('?', 1)[0]
+        handlers = {'/evaluate': self.service.evaluate, '/evaluate/batch': self.service.evaluate_batch}
+        if path not in handlers:
+            self._send_error(404, f"未知路径: {self.path}")
+            return
+
+        try:
+            payload = json.loads(body or b'{}')
+            if not isinstance(payload, dict):
+                raise RequestError("请求体必须是JSON对象")
+            status, response = handlers[path](payload)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self._send_error(400, "请求体不是有效JSON")
+        except RequestError as e:
+            self._send_error(400, str(e))
+        except QueueFullError as e:
+            self._send_error(503, str(e), {'Retry-After': '5'})
+        except RuntimeError as e:
+            # 调度器已关闭（服务正在停止）
+            self.close_connection = True
+            self._send_error(503, str(e))
+        except Exception as e:
+            self._send_error(500, f"服务内部错误: {e}")
+        else:
+            self._send_json(status, response)
+
+
+class EvaluationServer(ThreadingHTTPServer):
+    """评估服务（每个连接一个线程，评估在调度器的工作线程中执行）"""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address: Tuple[str, int], service: EvaluationService, verbose: bool = False):
+        super().__init__(address, ServiceRequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def _interrupt(signum: int, frame: Any) -> None:
+    """SIGTERM按Ctrl-C处理，停止服务前写出剖析结果"""
+    raise KeyboardInterrupt
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口（evaluate.py serve）：前台运行评估服务"""
+    parser = argparse.ArgumentParser(
+        prog="evaluate.py serve",
+        description="常驻评估服务: POST /evaluate（交互优先）和 POST /evaluate/batch（批量）",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址 (默认: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="监听端口 (默认: 8080)")
+    parser.add_argument("--workers", "-w", type=int, default=8, help="评估工作线程数 (默认: 8)")
+    parser.add_argument("--reserved", type=int, default=1,
+                        help="只处理交互请求的工作线程数，批量积压时交互请求仍可立即执行 (默认: 1)")
+    parser.add_argument("--max-queue", type=int, default=10000,
+                        help="每个优先级队列的最大排队数，超出时返回503 (默认: 10000)")
+    parser.add_argument("--timeout", type=float, default=120.0,
+                        help="单条评估请求的等待上限（秒，含排队） (默认: 120)")
+    parser.add_argument("--max-batch", type=int, default=1000, help="单次批量请求的最大记录数 (默认: 1000)")
+    parser.add_argument("--no-cache", action="store_true", help="不使用本地响应缓存")
+    parser.add_argument("--store", action="store_true", help="将评估结果写入结果库（RESULTS_DB_PATH）")
+    parser.add_argument("--profile", type=str, metavar="cpu|mem",
+                        help="性能剖析，服务停止时写出结果到 EVAL_PROFILE_DIR，默认取 EVAL_PROFILE")
+    parser.add_argument("--verbose", "-v", action="store_true", help="打印访问日志")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers 必须大于0")
+
+    config = get_config()
+    if not config.is_valid:
+        print("错误: 配置验证失败")
+        return 1
+    try:
+        profile_modes = parse_profile_modes(config.profile if args.profile is None else args.profile)
+    except ValueError as e:
+        parser.error(str(e))
+
+    cache = None if args.no_cache else get_default_cache(config)
+    near_dup = None
+    if config.near_dup_threshold > 0 and cache is not None:
+        near_dup = get_default_index(config, config.near_dup_threshold)
+    # 不绑定配置：每次评估取进程共享配置，.env 修改后自动生效
+    evaluate_fn = functools.partial(evaluate_surgery_steps, cache=cache, near_dup=near_dup)
+    store = get_default_store(config) if args.store else None
+    if store is not None:
+        evaluate_fn = store_evaluations(evaluate_fn, store, config)
+
+    scheduler = PriorityScheduler(args.workers, args.reserved, args.max_queue)
+    reserve_hedge_threads(scheduler.workers)
+    service = EvaluationService(evaluate_fn, scheduler, args.timeout, args.max_batch)
+    try:
+        server = EvaluationServer((args.host, args.port), service, verbose=args.verbose)
+    except OSError as e:
+        print(f"错误: 无法在 {args.host}:{args.port} 启动服务: {e}")
+        scheduler.shutdown()
+        return 1
+    if profile_modes:
+        start_profiling(profile_modes, output_prefix(None, config.profile_dir), profile_caller=False)
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    print(f"评估服务已启动: {server.base_url} (工作线程 {scheduler.workers}，"
+          f"其中 {scheduler.reserved} 个只处理交互请求)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n评估服务已停止")
+    finally:
+        server.server_close()
+        scheduler.shutdown()
+        report = stop_profiling()
+        if report is not None:
+            print(report, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
@@ -0,0 +1,146 @@
+"""
+请求合并模块
+同一时刻内容相同的评估请求只向上游发起一次调用，其余调用方等待并共享该结果
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+
+T = TypeVar('T')
+
+
+class _Call:
+    """一次进行中的调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    线程版请求合并
+
+    首个调用方（leader）执行函数，其余持有相同键的并发调用方阻塞等待，
+    得到同一个结果或同一个异常；调用结束后键即被移除，之后的调用重新执行。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """
+        执行或加入一次调用
+
+        Args:
+            key: 请求键（内容相同的请求键相同）
+            fn: 实际执行的函数
+
+        Returns:
+            T: 函数结果（合并的调用方得到同一个对象）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        合并统计
+
+        Returns:
+            Dict[str, int]: executed（实际执行次数）、coalesced（被合并的调用数）、in_flight（进行中的键数）
+        """
+        with self._lock:
+            return {'executed': self.executed, 'coalesced': self.coalesced,
+                    'in_flight': len(self._calls)}
+
+
+class _AsyncCall:
+    """一次进行中的协程调用及其等待方数"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    协程版请求合并
+
+    首个调用方创建任务执行协程，其余调用方等待同一任务；某个调用方被取消（或超时）时
+    只取消它自己的等待，最后一个等待方离开时才取消共享任务，上游请求不会在无人等待时继续占用资源。
+    共享任务内不应包含调用方各自的截止时间或信号量，这些由调用方在 ``do`` 之外控制。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Tuple[int, Hashable], _AsyncCall] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        执行或加入一次调用
+
+        Args:
+            key: 请求键
+            fn: 返回协程的函数
+
+        Returns:
+            T: 协程结果
+        """
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        call = self._calls.get(call_key)
+        if call is not None:
+            self.coalesced += 1
+        else:
+            self.executed += 1
+            call = self._calls[call_key] = _AsyncCall(loop.create_task(fn()))
+            call.task.add_done_callback(lambda _: self._forget(call_key, call))
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 最后一个等待方已离开，之后的调用重新执行而不是加入正在取消的任务
+                self._forget(call_key, call)
+                call.task.cancel()
+
+    def _forget(self, call_key: Tuple[int, Hashable], call: _AsyncCall) -> None:
+        if self._calls.get(call_key) is call:
+            del self._calls[call_key]
+
+    def stats(self) -> Dict[str, int]:
+        """合并统计（字段同 SingleFlight.stats）"""
+        return {'executed': self.executed, 'coalesced': self.coalesced,
+                'in_flight': len(self._calls)}
@@ -0,0 +1,136 @@
+"""
+增量JSON解析模块
+在流式响应逐块到达时解析评估结果JSON，字段一完整就产出事件，无需等待整个回复生成结束
+"""
+
+import json
+from typing import Any, List, Optional, Tuple
+
+
+# 流式事件: (事件类型, 值)
+# 事件类型: total_score / risk_level / risk / suggestion，完整结果由调用方以 result 事件产出
+StreamEvent = Tuple[str, Any]
+
+_WHITESPACE = ' \t\r\n'
+_SCALAR_END = ',}]' + _WHITESPACE
+
+
+class IncrementalEvaluationParser:
+    """
+    评估结果的增量解析器
+
+    逐块 feed() 模型输出的文本，在顶层对象中:
+      - total_score / risk_level 的值完整时产出对应事件
+      - risks / suggestions 数组中的每个字符串元素完整时分别产出 risk / suggestion 事件
+
+    顶层 ``{`` 之前的内容（如 ```json 代码块标记）会被跳过；解析器只识别结构，
+    完整结果仍应在流结束后用 ``text`` 做一次完整解析和验证。
+    """
+
+    SCALAR_FIELDS = ('total_score', 'risk_level')
+    ARRAY_FIELDS = {'risks': 'risk', 'suggestions': 'suggestion'}
+
+    def __init__(self):
+        self.text = ''
+        self.done = False
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._token_start = -1
+        self._scalar_start = -1
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._array_key: Optional[str] = None
+
+    def feed(self, chunk: str) -> List[StreamEvent]:
+        """
+        追加一段文本并返回新产生的事件
+
+        Args:
+            chunk: 新到达的文本片段
+
+        Returns:
+            List[StreamEvent]: 本次解析出的事件列表
+        """
+        self.text += chunk
+        events: List[StreamEvent] = []
+        text = self.text
+        i = self._pos
+
+        while i < len(text) and not self.done:
+            c = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._on_string(text[self._token_start:i + 1], events)
+                i += 1
+                continue
+
+            if self._scalar_start >= 0:
+                if c not in _SCALAR_END:
+                    i += 1
+                    continue
+                # 数字/字面量结束，分隔符本身继续按结构处理
+                self._on_scalar(text[self._scalar_start:i], events)
+                self._scalar_start = -1
+
+            if not self._stack:
+                if c == '{':
+                    self._stack.append(c)
+                    self._expect_key = True
+            elif c == '"':
+                self._in_string = True
+                self._token_start = i
+            elif c in '{[':
+                if len(self._stack) == 1:
+                    self._array_key = self._key if c == '[' else None
+                self._stack.append(c)
+            elif c in '}]':
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+                elif len(self._stack) == 1:
+                    self._array_key = None
+            elif c == ':':
+                if len(self._stack) == 1:
+                    self._expect_key = False
+            elif c == ',':
+                if len(self._stack) == 1:
+                    self._expect_key = True
+            elif c not in _WHITESPACE:
+                self._scalar_start = i
+            i += 1
+
+        self._pos = i
+        return events
+
+    def _on_string(self, raw: str, events: List[StreamEvent]) -> None:
+        """处理一个完整的字符串token"""
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+
+        depth = len(self._stack)
+        if depth == 1:
+            if self._expect_key:
+                self._key = value
+            elif self._key in self.SCALAR_FIELDS:
+                events.append((self._key, value))
+        elif depth == 2 and self._stack[-1] == '[' and self._array_key in self.ARRAY_FIELDS:
+            events.append((self.ARRAY_FIELDS[self._array_key], value))
+
+    def _on_scalar(self, raw: str, events: List[StreamEvent]) -> None:
+        """处理一个完整的数字或字面量token"""
+        if len(self._stack) != 1 or self._key not in self.SCALAR_FIELDS:
+            return
+        try:
+            events.append((self._key, json.loads(raw)))
+        except json.JSONDecodeError:
+            pass
@@ -0,0 +1,221 @@
+"""
+令牌估算模块
+在发送请求前本地估算提示与生成令牌数、费用和预期延迟，
+用于TPM限流预约和上下文长度的预检（超出上下文的记录不再浪费一次网络往返）
+"""
+
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+# 中日韩文字及全角标点：各家分词器对这类字符的切分粒度远细于英文
+_CJK_PATTERN = re.compile('[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]')
+
+# 每条消息的格式开销（角色标记、分隔符）及回复起始开销
+_MESSAGE_OVERHEAD = 4
+_REPLY_OVERHEAD = 3
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    """
+    模型族的估算参数
+
+    价格单位为美元/百万令牌，延迟参数为经验值，仅用于预算和排期，不作计费依据。
+    """
+    name: str
+    context_window: int
+    cjk_tokens_per_char: float
+    chars_per_token: float
+    input_price: float
+    output_price: float
+    first_token_latency: float
+    output_tokens_per_second: float
+    typical_completion_tokens: int = 300
+    max_output_tokens: int = 4096
+
+
+# 按模型名前缀匹配，取最长的前缀
+MODEL_PROFILES: Dict[str, ModelProfile] = {
+    'deepseek-chat': ModelProfile('deepseek-chat', 65536, 0.6, 3.5, 0.27, 1.10, 1.0, 30.0,
+                                  max_output_tokens=8192),
+    'deepseek-reasoner': ModelProfile('deepseek-reasoner', 65536, 0.6, 3.5, 0.55, 2.19, 5.0, 25.0,
+                                      typical_completion_tokens=1500, max_output_tokens=32768),
+    'gpt-4o-mini': ModelProfile('gpt-4o-mini', 128000, 0.8, 4.0, 0.15, 0.60, 0.5, 80.0,
+                                max_output_tokens=16384),
+    'gpt-4o': ModelProfile('gpt-4o', 128000, 0.8, 4.0, 2.50, 10.00, 0.6, 60.0,
+                           max_output_tokens=16384),
+    'gpt-4': ModelProfile('gpt-4', 8192, 1.2, 4.0, 30.00, 60.00, 1.0, 20.0, max_output_tokens=8192),
+    'gpt-3.5-turbo': ModelProfile('gpt-3.5-turbo', 16385, 1.2, 4.0, 0.50, 1.50, 0.4, 60.0),
+}
+
+# 未知模型使用保守参数（按每个中文字符一个令牌估算）
+DEFAULT_PROFILE = ModelProfile('default', 8192, 1.0, 4.0, 1.00, 2.00, 1.0, 30.0)
+
+
+def get_model_profile(model: str) -> ModelProfile:
+    """
+    获取模型的估算参数
+
+    Args:
+        model: 模型名称
+
+    Returns:
+        ModelProfile: 最长前缀匹配的参数，未匹配时为 DEFAULT_PROFILE
+    """
+    best = ''
+    for prefix in MODEL_PROFILES:
+        if model.startswith(prefix) and len(prefix) > len(best):
+            best = prefix
+    return MODEL_PROFILES[best] if best else DEFAULT_PROFILE
+
+
+def estimate_text_tokens(text: str, profile: ModelProfile = DEFAULT_PROFILE) -> int:
+    """
+    估算一段文本的令牌数（中文按字符、其他按平均字符数折算，向上取整）
+
+    Args:
+        text: 文本
+        profile: 模型估算参数
+
+    Returns:
+        int: 估算的令牌数
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return math.ceil(cjk * profile.cjk_tokens_per_char + other / profile.chars_per_token)
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]],
+                            profile: ModelProfile = DEFAULT_PROFILE) -> int:
+    """
+    估算消息列表的提示令牌数（含每条消息的格式开销）
+
+    Args:
+        messages: 消息列表
+        profile: 模型估算参数
+
+    Returns:
+        int: 估算的提示令牌数
+    """
+    return _REPLY_OVERHEAD + sum(
+        _MESSAGE_OVERHEAD + estimate_text_tokens(message.get('content', ''), profile)
+        for message in messages
+    )
+
+
+@dataclass(frozen=True)
+class TokenEstimate:
+    """
+    单次请求的预估
+
+    Attributes:
+        model: 模型名称
+        prompt_tokens: 提示令牌数
+        completion_tokens: 预期生成令牌数
+        max_tokens: 生成令牌上限（max_tokens请求参数）
+        context_window: 模型上下文长度
+        cost: 预期费用（美元）
+        latency: 预期延迟（秒）
+    """
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    max_tokens: int
+    context_window: int
+    cost: float
+    latency: float
+
+    @property
+    def budget_tokens(self) -> int:
+        """按生成上限计的最坏情况令牌数（用于TPM限流预约和上下文检查）"""
+        return self.prompt_tokens + self.max_tokens
+
+    @property
+    def fits(self) -> bool:
+        """提示加生成上限是否在上下文长度之内"""
+        return self.budget_tokens <= self.context_window
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            'model': self.model,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'max_tokens': self.max_tokens,
+            'context_window': self.context_window,
+            'cost': round(self.cost, 6),
+            'latency': round(self.latency, 2),
+            'fits': self.fits,
+        }
+
+
+class ContextLengthError(ValueError):
+    """请求超出模型上下文长度（发送前即拒绝）"""
+
+    def __init__(self, estimate: TokenEstimate):
+        super().__init__(
+            f"请求超出模型上下文长度: 预计提示 {estimate.prompt_tokens} + 生成上限 "
+            f"{estimate.max_tokens} > {estimate.context_window} 令牌（{estimate.model}）"
+        )
+        self.estimate = estimate
+
+
+def estimate_request(messages: List[Dict[str, str]], model: str, max_tokens: int,
+                     context_window: Optional[int] = None) -> TokenEstimate:
+    """
+    预估一次Chat Completions请求
+
+    Args:
+        messages: 消息列表
+        model: 模型名称
+        max_tokens: 生成令牌上限
+        context_window: 上下文长度，默认取模型估算参数中的值
+
+    Returns:
+        TokenEstimate: 令牌数、费用和延迟预估
+    """
+    profile = get_model_profile(model)
+    prompt_tokens = estimate_message_tokens(messages, profile)
+    completion_tokens = min(max_tokens, profile.typical_completion_tokens)
+    cost = (prompt_tokens * profile.input_price + completion_tokens * profile.output_price) / 1e6
+    latency = profile.first_token_latency + completion_tokens / profile.output_tokens_per_second
+    return TokenEstimate(
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        max_tokens=max_tokens,
+        context_window=context_window or profile.context_window,
+        cost=cost,
+        latency=latency,
+    )
+
+
+def check_context(estimate: TokenEstimate) -> TokenEstimate:
+    """
+    上下文长度预检
+
+    Args:
+        estimate: 请求预估
+
+    Returns:
+        TokenEstimate: 原样返回，便于链式使用
+
+    Raises:
+        ContextLengthError: 超出上下文长度
+    """
+    if not estimate.fits:
+        raise ContextLengthError(estimate)
+    return estimate
+
+
+def format_estimate(estimate: TokenEstimate) -> str:
+    """格式化单次请求预估"""
+    return (f"模型: {estimate.model}，提示 {estimate.prompt_tokens} 令牌，"
+            f"预期生成 {estimate.completion_tokens} 令牌（上限 {estimate.max_tokens}），"
+            f"上下文 {estimate.budget_tokens}/{estimate.context_window}"
+            f"{'' if estimate.fits else '（超出）'}，"
+            f"预计费用 ${estimate.cost:.5f}，预计延迟 {estimate.latency:.1f} 秒")
@@ -4,35 +4,233 @@
 """
 
 import os
-from typing import Dict, Any
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, Any, Optional, Tuple
 
+try:
+    from .metrics import observe_stage
+except ImportError:
+    from metrics import observe_stage
 
-def load_env_config() -> Dict[str, str]:
+
+# 默认的 .env 文件路径（相对当前工作目录）
+ENV_FILE = '.env'
+
+
+def _parse_env_file(env_file: str) -> Dict[str, str]:
     """
-    加载环境变量配置
+    解析 .env 文件（不修改 os.environ）
+    
+    Args:
+        env_file: 文件路径
+        
+    Returns:
+        Dict[str, str]: 键值对
+    """
+    values = {}
+    with open(env_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                key, value = line.split('=', 1)
+                values[key.strip()] = value.strip()
+    return values
+
+
+class _EnvReader:
+    """按 .env 文件优先、环境变量其次的顺序读取配置项"""
+    
+    def __init__(self, file_values: Dict[str, str]):
+        self.file_values = file_values
+    
+    def text(self, name: str, default: str) -> str:
+        value = self.file_values.get(name)
+        return value if value is not None else os.getenv(name, default)
+    
+    def integer(self, name: str, default: int) -> int:
+        try:
+            return int(self.text(name, str(default)))
+        except ValueError:
+            print(f"警告: 配置项 {name} 不是有效整数，使用默认值 {default}", file=sys.stderr)
+            return default
+    
+    def number(self, name: str, default: float) -> float:
+        try:
+            return float(self.text(name, str(default)))
+        except ValueError:
+            print(f"警告: 配置项 {name} 不是有效数字，使用默认值 {default}", file=sys.stderr)
+            return default
+    
+    def flag(self, name: str, default: bool) -> bool:
+        return self.text(name, 'true' if default else 'false').lower() == 'true'
+
+
+@dataclass(frozen=True)
+class AppConfig:
+    """
+    不可变的运行配置，进程内加载一次后在各线程间共享
+    
+    通过 get_config() 获取；.env 文件修改时间变化时才会重新加载。
+    """
+    api_key: str = ''
+    model: str = 'deepseek-chat'
+    base_url: str = 'https://api.deepseek.com'
+    max_tokens: int = 1000
+    context_window: int = 0
+    request_timeout: float = 30.0
+    fallback_endpoints: str = ''
+    hedge_quantile: float = 0.95
+    circuit_failure_threshold: int = 5
+    circuit_reset_seconds: float = 30.0
+    pool_size: int = 10
+    pool_idle_timeout: float = 60.0
+    requests_per_minute: float = 0
+    tokens_per_minute: float = 0
+    max_concurrency: int = 32
+    max_retries: int = 3
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 30.0
+    retry_after_max: float = 300.0
+    cache_path: str = os.path.join('.cache', 'responses.sqlite3')
+    cache_max_entries: int = 10000
+    cache_ttl_seconds: float = 30 * 86400
+    near_dup_threshold: float = 0.0
+    results_db_path: str = os.path.join('.cache', 'results.sqlite3')
+    profile: str = ''
+    profile_dir: str = os.path.join('.cache', 'profiles')
+    debug: bool = False
     
+    @classmethod
+    def from_sources(cls, file_values: Dict[str, str]) -> "AppConfig":
+        """
+        由 .env 文件内容和环境变量构造配置（.env 优先）
+        
+        Args:
+            file_values: .env 文件解析出的键值对
+            
+        Returns:
+            AppConfig: 配置对象
+        """
+        env = _EnvReader(file_values)
+        return cls(
+            api_key=env.text('OPENAI_API_KEY', ''),
+            model=env.text('OPENAI_MODEL', cls.model),
+            base_url=env.text('OPENAI_BASE_URL', cls.base_url),
+            max_tokens=env.integer('OPENAI_MAX_TOKENS', cls.max_tokens),
+            context_window=env.integer('OPENAI_CONTEXT_WINDOW', cls.context_window),
+            request_timeout=env.number('OPENAI_REQUEST_TIMEOUT', cls.request_timeout),
+            fallback_endpoints=env.text('OPENAI_FALLBACK_ENDPOINTS', cls.fallback_endpoints),
+            hedge_quantile=env.number('OPENAI_HEDGE_QUANTILE', cls.hedge_quantile),
+            circuit_failure_threshold=env.integer('CIRCUIT_FAILURE_THRESHOLD', cls.circuit_failure_threshold),
+            circuit_reset_seconds=env.number('CIRCUIT_RESET_SECONDS', cls.circuit_reset_seconds),
+            pool_size=env.integer('OPENAI_POOL_SIZE', cls.pool_size),
+            pool_idle_timeout=env.number('OPENAI_POOL_IDLE_TIMEOUT', cls.pool_idle_timeout),
+            requests_per_minute=env.number('OPENAI_RPM', cls.requests_per_minute),
+            tokens_per_minute=env.number('OPENAI_TPM', cls.tokens_per_minute),
+            max_concurrency=env.integer('OPENAI_MAX_CONCURRENCY', cls.max_concurrency),
+            max_retries=env.integer('OPENAI_MAX_RETRIES', cls.max_retries),
+            retry_base_delay=env.number('OPENAI_RETRY_BASE_DELAY', cls.retry_base_delay),
+            retry_max_delay=env.number('OPENAI_RETRY_MAX_DELAY', cls.retry_max_delay),
+            retry_after_max=env.number('OPENAI_RETRY_AFTER_MAX', cls.retry_after_max),
+            cache_path=env.text('CACHE_PATH', cls.cache_path),
+            cache_max_entries=env.integer('CACHE_MAX_ENTRIES', cls.cache_max_entries),
+            cache_ttl_seconds=env.number('CACHE_TTL_SECONDS', cls.cache_ttl_seconds),
+            near_dup_threshold=env.number('NEAR_DUP_THRESHOLD', cls.near_dup_threshold),
+            results_db_path=env.text('RESULTS_DB_PATH', cls.results_db_path),
+            profile=env.text('EVAL_PROFILE', cls.profile),
+            profile_dir=env.text('EVAL_PROFILE_DIR', cls.profile_dir),
+            debug=env.flag('DEBUG', cls.debug),
+        )
+    
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        转换为环境变量命名的配置字典（兼容 load_env_config 的返回格式）
+        
+        Returns:
+            Dict[str, Any]: 配置字典
+        """
+        return {
+            'OPENAI_API_KEY': self.api_key,
+            'OPENAI_MODEL': self.model,
+            'OPENAI_BASE_URL': self.base_url,
+            'OPENAI_MAX_TOKENS': self.max_tokens,
+            'OPENAI_CONTEXT_WINDOW': self.context_window,
+            'OPENAI_REQUEST_TIMEOUT': self.request_timeout,
+            'OPENAI_FALLBACK_ENDPOINTS': self.fallback_endpoints,
+            'OPENAI_HEDGE_QUANTILE': self.hedge_quantile,
+            'CIRCUIT_FAILURE_THRESHOLD': self.circuit_failure_threshold,
+            'CIRCUIT_RESET_SECONDS': self.circuit_reset_seconds,
+            'OPENAI_POOL_SIZE': self.pool_size,
+            'OPENAI_POOL_IDLE_TIMEOUT': self.pool_idle_timeout,
+            'OPENAI_RPM': self.requests_per_minute,
+            'OPENAI_TPM': self.tokens_per_minute,
+            'OPENAI_MAX_CONCURRENCY': self.max_concurrency,
+            'OPENAI_MAX_RETRIES': self.max_retries,
+            'OPENAI_RETRY_BASE_DELAY': self.retry_base_delay,
+            'OPENAI_RETRY_MAX_DELAY': self.retry_max_delay,
+            'OPENAI_RETRY_AFTER_MAX': self.retry_after_max,
+            'CACHE_PATH': self.cache_path,
+            'CACHE_MAX_ENTRIES': self.cache_max_entries,
+            'CACHE_TTL_SECONDS': self.cache_ttl_seconds,
+            'NEAR_DUP_THRESHOLD': self.near_dup_threshold,
+            'RESULTS_DB_PATH': self.results_db_path,
+            'EVAL_PROFILE': self.profile,
+            'EVAL_PROFILE_DIR': self.profile_dir,
+            'DEBUG': self.debug,
+        }
+    
+    @cached_property
+    def is_valid(self) -> bool:
+        """配置是否有效（每个配置对象只验证一次）"""
+        return validate_config(self.as_dict())
+
+
+_config_lock = threading.Lock()
+_config_cache: Dict[str, Tuple[Optional[int], AppConfig]] = {}
+
+
+def get_config(env_file: str = ENV_FILE) -> AppConfig:
+    """
+    获取进程共享的配置对象，仅在 .env 文件修改时间变化时重新解析
+    
+    Args:
+        env_file: .env 文件路径
+        
     Returns:
-        Dict[str, str]: 配置字典
+        AppConfig: 不可变配置对象
     """
-    # 尝试加载 .env 文件
-    env_file = '.env'
-    if os.path.exists(env_file):
-        with open(env_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and '=' in line:
-                    key, value = line.split('=', 1)
-                    os.environ[key.strip()] = value.strip()
-    
-    config = {
-        'OPENAI_API_KEY': os.getenv('OPENAI_API_KEY', ''),
-        'OPENAI_MODEL': os.getenv('OPENAI_MODEL', 'deepseek-chat'),
-        'OPENAI_BASE_URL': os.getenv('OPENAI_BASE_URL', 'https://api.deepseek.com'),
-        'DEBUG': os.getenv('DEBUG', 'false').lower() == 'true'
-    }
+    start = time.perf_counter()
+    try:
+        mtime: Optional[int] = os.stat(env_file).st_mtime_ns
+    except OSError:
+        mtime = None
+    
+    with _config_lock:
+        cached = _config_cache.get(env_file)
+        if cached is not None and cached[0] == mtime:
+            config = cached[1]
+        else:
+            file_values = _parse_env_file(env_file) if mtime is not None else {}
+            config = AppConfig.from_sources(file_values)
+            _config_cache[env_file] = (mtime, config)
+    observe_stage('config_load', time.perf_counter() - start)
     return config
 
 
+def load_env_config() -> Dict[str, Any]:
+    """
+    加载环境变量配置
+    
+    Returns:
+        Dict[str, Any]: 配置字典
+    """
+    return get_config().as_dict()
+
+
 def validate_config(config: Dict[str, str]) -> bool:
     """
     验证配置是否有效
@@ -0,0 +1,6 @@
+"""测试公共配置：将 src 目录加入导入路径（与 evaluate.py 的运行方式一致）"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
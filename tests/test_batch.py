@@ -0,0 +1,72 @@
+"""批量输入读取测试：JSONL/CSV导出的字段映射和手术类型校验"""
+
+import gzip
+import json
+
+import pytest
+
+from batch import iter_csv_records, iter_jsonl_records, parse_fields, prefetch, resolve_surgery_type
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("cholecystectomy", "cholecystectomy"),
+    ("Appendectomy", "appendectomy"),
+    ("腹腔镜胆囊切除术", "cholecystectomy"),
+    ("胃穿孔修补术", "gastric_perforation"),
+    ("疝修补术", None),
+])
+def test_resolve_surgery_type(value, expected):
+    assert resolve_surgery_type(value) == expected
+
+
+def test_jsonl_records_map_fields_and_types(tmp_path, capsys):
+    path = tmp_path / "export.jsonl"
+    rows = [
+        {"case_no": "C1", "op_type": "腹腔镜胆囊切除术", "op_note": "1. 解剖Calot三角"},
+        {"case_no": "C2", "op_type": "疝修补术", "op_note": "1. 消毒铺巾"},
+        {"case_no": "C3", "op_type": "疝修补术", "op_note": "1. 消毒铺巾"},
+        {"case_no": "C4", "op_type": "appendectomy"},
+    ]
+    path.write_text("\n".join(json.dumps(row, ensure_ascii=False) for row in rows) + "\nnot json\n",
+                    encoding="utf-8")
+
+    records = list(iter_jsonl_records(str(path), "general", parse_fields("case_no,op_type,op_note")))
+
+    assert records == [
+        ("C1", "cholecystectomy", "1. 解剖Calot三角"),
+        ("C2", "general", "1. 消毒铺巾"),
+        ("C3", "general", "1. 消毒铺巾"),
+    ]
+    err = capsys.readouterr().err
+    assert err.count("疝修补术") == 1
+    assert "缺少 op_note" in err
+    assert "JSON无效" in err
+
+
+def test_gzipped_csv_with_multiline_field(tmp_path):
+    path = tmp_path / "export.csv.gz"
+    with gzip.open(path, "wt", encoding="utf-8-sig", newline="") as f:
+        f.write('id,type,text\n1,appendectomy,"1. 麦氏切口\n2. 结扎阑尾根部"\n2,,"1. 探查"\n')
+
+    records = list(iter_csv_records(str(path), "general"))
+
+    assert records == [("1", "appendectomy", "1. 麦氏切口\n2. 结扎阑尾根部"), ("2", "general", "1. 探查")]
+
+
+def test_csv_without_text_column_is_rejected(tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_text("id,type\n1,general\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_csv_records(str(path)))
+
+
+def test_prefetch_keeps_order_and_reraises():
+    def source():
+        yield from range(5)
+        raise OSError("disk error")
+
+    seen = []
+    with pytest.raises(OSError):
+        for item in prefetch(source(), 2):
+            seen.append(item)
+    assert seen == [0, 1, 2, 3, 4]
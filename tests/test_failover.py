@@ -0,0 +1,167 @@
+"""故障转移测试：熔断器状态转换、对冲计时和探测名额的归还"""
+
+import asyncio
+import itertools
+import time
+
+import pytest
+
+import failover
+from failover import (EndpointHealth, SendTimer, acall_with_failover, call_with_failover,
+                      get_failover_stats, get_health, reserve_hedge_threads)
+from utils import AppConfig
+
+_ids = itertools.count()
+
+
+def _open(health):
+    for _ in range(health.failure_threshold):
+        assert health.allow()
+        health.record_failure()
+
+
+def test_opens_after_consecutive_failures():
+    health = EndpointHealth(failure_threshold=3, reset_timeout=60)
+    health.record_failure()
+    health.record_failure()
+    health.record_success()
+    assert health.state == EndpointHealth.CLOSED
+
+    _open(health)
+    assert health.state == EndpointHealth.OPEN
+    assert health.opened == 1
+    assert not health.allow()
+
+
+def test_half_open_allows_single_probe_and_success_closes():
+    health = EndpointHealth(failure_threshold=2, reset_timeout=0.05)
+    _open(health)
+    time.sleep(0.06)
+
+    assert health.allow()
+    assert health.state == EndpointHealth.HALF_OPEN
+    assert not health.allow()
+
+    health.record_success(latency=0.1)
+    assert health.state == EndpointHealth.CLOSED
+    assert health.consecutive_failures == 0
+    assert health.allow()
+
+
+def test_failed_probe_reopens():
+    health = EndpointHealth(failure_threshold=2, reset_timeout=0.05)
+    _open(health)
+    time.sleep(0.06)
+
+    assert health.allow()
+    health.record_failure()
+    assert health.state == EndpointHealth.OPEN
+    assert health.opened == 2
+    assert not health.allow()
+
+
+def test_cancelled_probe_returns_the_slot():
+    health = EndpointHealth(failure_threshold=1, reset_timeout=0.05)
+    _open(health)
+    time.sleep(0.06)
+
+    assert health.allow()
+    health.record_cancelled()
+    assert health.state == EndpointHealth.HALF_OPEN
+    assert health.allow()
+
+
+@pytest.fixture
+def endpoints():
+    """一对互不共享健康状态的端点，主端点已有足够的低延迟样本（对冲等待为下限0.05秒）"""
+    n = next(_ids)
+    primary = AppConfig(base_url=f"http://primary-{n}", model='m', circuit_failure_threshold=1,
+                        circuit_reset_seconds=0.05)
+    backup = AppConfig(base_url=f"http://backup-{n}", model='m')
+    for _ in range(failover.MIN_LATENCY_SAMPLES):
+        get_health(primary).record_success(0.01)
+    return [primary, backup]
+
+
+def _slow_before_send(primary):
+    """主端点先在本地排队（模拟限流等待）0.2秒，实际发送很快"""
+    def attempt(endpoint, last, timer):
+        if endpoint is not primary:
+            return 'backup'
+        time.sleep(0.2)
+        return timer.wrap(lambda: 'primary')()
+    return attempt
+
+
+def test_local_waits_do_not_trigger_hedge(endpoints):
+    primary = endpoints[0]
+    hedged = get_failover_stats()['hedged']
+    result, endpoint = call_with_failover(endpoints, _slow_before_send(primary), lambda e: True)
+    assert (result, endpoint) == ('primary', primary)
+    assert get_failover_stats()['hedged'] == hedged
+    assert max(get_health(primary)._latencies) < 0.1
+
+
+def test_async_local_waits_do_not_trigger_hedge(endpoints):
+    primary = endpoints[0]
+
+    async def attempt(endpoint, last, timer):
+        if endpoint is not primary:
+            return 'backup'
+        await asyncio.sleep(0.2)
+
+        async def send():
+            return 'primary'
+        return await timer.awrap(send)()
+
+    result, endpoint = asyncio.run(acall_with_failover(endpoints, attempt, lambda e: True))
+    assert (result, endpoint) == ('primary', primary)
+    assert max(get_health(primary)._latencies) < 0.1
+
+
+def test_slow_send_is_hedged(endpoints):
+    primary = endpoints[0]
+
+    def attempt(endpoint, last, timer):
+        if endpoint is not primary:
+            return timer.wrap(lambda: 'backup')()
+        return timer.wrap(lambda: time.sleep(0.5) or 'primary')()
+
+    hedged = get_failover_stats()['hedged']
+    assert call_with_failover(endpoints, attempt, lambda e: True) == ('backup', endpoints[1])
+    assert get_failover_stats()['hedged'] == hedged + 1
+
+
+@pytest.mark.parametrize('hedging', [True, False])
+def test_interrupted_probe_returns_the_slot(endpoints, hedging):
+    primary = endpoints[0]
+    health = get_health(primary)
+    if not hedging:
+        endpoints = endpoints[:1]
+    health.record_failure()
+    time.sleep(0.06)
+
+    def attempt(endpoint, last, timer):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        call_with_failover(endpoints, attempt, lambda e: True)
+    assert health.state == EndpointHealth.HALF_OPEN
+    assert health.allow()
+
+
+def test_hedge_pool_grows_with_workers():
+    reserve_hedge_threads(failover.MIN_HEDGE_THREADS // 2)
+    assert failover._executor_threads == failover.MIN_HEDGE_THREADS
+    reserve_hedge_threads(100)
+    assert failover._get_executor()._max_workers == 200
+
+
+def test_send_timer_measures_only_the_send():
+    started = []
+    timer = SendTimer(lambda: started.append(1))
+    assert timer.elapsed() == 0.0
+    assert timer.wrap(lambda: time.sleep(0.02) or 'ok')() == 'ok'
+    timer.wrap(lambda: None)()
+    assert started == [1]
+    assert timer.latency < 0.02 <= timer.elapsed()
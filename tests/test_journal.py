@@ -0,0 +1,107 @@
+"""批量日志测试：崩溃留下的残缺末行在恢复时被忽略并截掉"""
+
+import io
+import json
+
+import pytest
+
+from batch import run_batch
+from journal import BatchJournal, read_journal
+
+RECORDS = [(f"r{i}", 'general', f"步骤{i}") for i in range(3)]
+
+
+def _line(record, status='ok'):
+    return {'id': record[0], 'status': status, 'result': {'total_score': 80}}
+
+
+def _write(path, records):
+    journal = BatchJournal(str(path))
+    for record in records:
+        journal.append(record, _line(record))
+    journal.close()
+
+
+def test_torn_last_line_is_ignored_and_truncated(tmp_path):
+    path = tmp_path / 'run.journal'
+    _write(path, RECORDS[:2])
+    valid_size = path.stat().st_size
+    with open(path, 'ab') as f:
+        f.write(b'{"id": "r2", "hash": "ab')
+
+    journal = BatchJournal(str(path), resume=True)
+    assert journal.completed_count == 2
+    assert path.stat().st_size == valid_size
+    journal.append(RECORDS[2], _line(RECORDS[2]))
+    journal.close()
+
+    entries, valid_end = read_journal(str(path))
+    assert [entry['id'] for entry in entries] == ['r0', 'r1', 'r2']
+    assert valid_end == path.stat().st_size
+
+
+def test_complete_last_line_without_newline_is_dropped(tmp_path):
+    path = tmp_path / 'run.journal'
+    _write(path, RECORDS[:2])
+    data = path.read_bytes().rstrip(b'\n')
+    path.write_bytes(data)
+
+    entries, valid_end = read_journal(str(path))
+    assert [entry['id'] for entry in entries] == ['r0']
+    assert valid_end == data.index(b'\n') + 1
+
+
+def test_corrupt_middle_line_is_skipped(tmp_path, capsys):
+    path = tmp_path / 'run.journal'
+    _write(path, RECORDS[:2])
+    first, second = path.read_bytes().splitlines(keepends=True)
+    path.write_bytes(first + b'not json\n' + second)
+
+    entries, valid_end = read_journal(str(path))
+    assert [entry['id'] for entry in entries] == ['r0', 'r1']
+    assert valid_end == path.stat().st_size
+    assert '第2行无效' in capsys.readouterr().err
+
+
+def test_resume_skips_only_successful_unchanged_records(tmp_path):
+    path = tmp_path / 'run.journal'
+    journal = BatchJournal(str(path))
+    journal.append(RECORDS[0], _line(RECORDS[0]))
+    journal.append(RECORDS[1], _line(RECORDS[1], status='error'))
+    journal.close()
+
+    journal = BatchJournal(str(path), resume=True)
+    changed = (RECORDS[0][0], 'general', '内容已修改')
+    replay = []
+    pending = list(journal.skip_completed([RECORDS[0], RECORDS[1], changed], replay.append))
+    journal.close()
+    assert pending == [RECORDS[1], changed]
+    assert replay == [_line(RECORDS[0])]
+
+
+def test_existing_journal_requires_resume(tmp_path):
+    path = tmp_path / 'run.journal'
+    _write(path, RECORDS[:1])
+    with pytest.raises(FileExistsError):
+        BatchJournal(str(path))
+    assert json.loads(path.read_text(encoding='utf-8'))['id'] == 'r0'
+
+
+def test_resumed_lines_are_written_as_they_are_skipped(tmp_path):
+    path = tmp_path / 'run.journal'
+    records = [(f"r{i}", 'general', f"步骤{i}") for i in range(50)]
+    _write(path, records[:-1])
+    output = io.StringIO()
+
+    def source():
+        # 预读队列之外，之前已完成记录的行都应已写出，而不是积压到下一条待评估记录
+        for i, record in enumerate(records):
+            assert output.getvalue().count("\n") >= i - 4
+            yield record
+
+    journal = BatchJournal(str(path), resume=True)
+    summary = run_batch(source(), lambda steps, surgery_type: {'total_score': 80}, output,
+                        workers=1, journal=journal)
+    journal.close()
+    assert summary['total'] == 50 and summary['resumed'] == 49
+    assert [json.loads(line)['id'] for line in output.getvalue().splitlines()] == [r[0] for r in records]
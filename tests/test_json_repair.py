@@ -0,0 +1,37 @@
+"""模型回复JSON提取测试：包裹文字、字符串内括号和截断修复"""
+
+import json
+
+import pytest
+
+from openai_client import extract_json_from_content
+
+
+def test_object_wrapped_in_code_fence_and_text():
+    content = '评估如下：\n```json\n{"total_score": 85, "risks": []}\n```\n以上。'
+    assert extract_json_from_content(content) == {'total_score': 85, 'risks': []}
+
+
+def test_skips_invalid_fragment_before_valid_object():
+    assert extract_json_from_content('x {bad} y {"ok": true} z') == {'ok': True}
+
+
+def test_truncated_inside_string_drops_unfinished_element():
+    content = '{"total_score": 85, "risks": ["胆管损伤", "术中出'
+    assert extract_json_from_content(content) == {'total_score': 85, 'risks': ['胆管损伤']}
+
+
+def test_truncated_number_drops_unfinished_field():
+    # 85 可能被截成 8，不能当作完整数值保留
+    content = '{"risks": ["胆管损伤"], "total_score": 8'
+    assert extract_json_from_content(content) == {'risks': ['胆管损伤']}
+
+
+def test_braces_inside_strings_do_not_close_object():
+    content = '{"a": 1, "b": {"c": "}"'
+    assert extract_json_from_content(content) == {'a': 1, 'b': {'c': '}'}}
+
+
+def test_unrecoverable_content_raises():
+    with pytest.raises(json.JSONDecodeError):
+        extract_json_from_content('没有JSON {')
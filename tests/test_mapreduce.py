@@ -0,0 +1,29 @@
+"""分段合并测试：风险点和建议只合并真正重复的条目"""
+
+from mapreduce import dedupe_items, merge_results
+
+
+def test_contained_short_item_is_kept():
+    items = ['术中出血风险', '出血', '胆管损伤']
+    assert dedupe_items(items) == items
+
+
+def test_normalized_duplicates_are_dropped():
+    items = ['胆管损伤风险。', ' 胆管损伤风险', '胆管损伤风险！']
+    assert dedupe_items(items) == ['胆管损伤风险。']
+
+
+def test_near_duplicates_above_threshold_are_dropped():
+    items = ['术中未确认胆囊管与胆总管的关系', '术中未确认胆囊管与胆总管关系']
+    assert dedupe_items(items) == items[:1]
+
+
+def test_merge_results_keeps_distinct_risks_across_segments():
+    results = [
+        {'total_score': 80, 'risk_level': 'Low', 'risks': ['术中出血风险'], 'suggestions': ['加强止血']},
+        {'total_score': 60, 'risk_level': 'High', 'risks': ['出血', '术中出血风险'], 'suggestions': ['加强止血']},
+    ]
+    merged = merge_results(results, [1, 1])
+    assert merged['risks'] == ['术中出血风险', '出血']
+    assert merged['suggestions'] == ['加强止血']
+    assert merged['risk_level'] == 'High'
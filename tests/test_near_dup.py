@@ -0,0 +1,82 @@
+"""近似重复索引测试：只复用逐步比对一致的记录"""
+
+import os
+import re
+
+import pytest
+
+from near_dup import NearDuplicateIndex, normalize_record
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'data', 'samples', 'cholecystectomy_01.txt')
+SCOPE = NearDuplicateIndex.make_scope('test-model', 'cholecystectomy')
+RESULT = {'total_score': 88, 'risks': [], 'suggestions': [], 'risk_level': 'Low'}
+
+
+@pytest.fixture
+def note():
+    with open(SAMPLE, encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture
+def index(note):
+    index = NearDuplicateIndex(':memory:', threshold=0.9)
+    index.add(note, SCOPE, RESULT)
+    yield index
+    index.close()
+
+
+def test_header_whitespace_and_numbering_are_ignored(index, note):
+    variant = re.sub(r'^(\d+)\. ', r'(\1) ', note.replace('李某，女，45岁', '王某，男，61岁'),
+                     flags=re.MULTILINE).replace('，', ', ')
+    assert normalize_record(variant) == normalize_record(note)
+    reused = index.lookup(variant, SCOPE)
+    assert reused is not None
+    assert reused['total_score'] == 88
+    assert reused['reused']['similarity'] == 1.0
+
+
+def test_swapped_steps_are_not_reused(index, note):
+    swapped = (note.replace('用钛夹夹闭胆囊动脉', '@@')
+               .replace('用钛夹夹闭胆囊管近端和远端', '用钛夹夹闭胆囊动脉')
+               .replace('@@', '用钛夹夹闭胆囊管近端和远端'))
+    assert swapped != note
+    assert index.lookup(swapped, SCOPE) is None
+
+
+def test_negated_step_is_not_reused(index, note):
+    negated = note.replace('用钛夹夹闭胆囊动脉，电凝切断', '未夹闭胆囊动脉，电凝切断')
+    assert index.lookup(negated, SCOPE) is None
+
+
+def test_other_scope_is_not_reused(index, note):
+    assert index.lookup(note, NearDuplicateIndex.make_scope('other-model', 'cholecystectomy')) is None
+
+
+def test_minor_wording_change_is_reused(index, note):
+    variant = note.replace('用钛夹夹闭胆囊动脉，电凝切断', '用钛夹夹闭胆囊动脉后，电凝切断')
+    reused = index.lookup(variant, SCOPE)
+    assert reused is not None
+    assert 0.9 <= reused['reused']['similarity'] < 1.0
+
+
+def test_similarity_below_threshold_is_not_reused(index, note):
+    variant = note.replace('用钛夹夹闭胆囊动脉，电凝切断', '用钛夹夹闭胆囊动脉后，电凝切断')
+    index.threshold = 0.999
+    assert index.lookup(variant, SCOPE) is None
+
+
+@pytest.mark.parametrize('old, new', [
+    ('出血量：约10ml', '出血量：约100ml'),
+    ('压力维持12-14mmHg', '压力维持15-18mmHg'),
+    ('确认无出血', '确认有出血'),
+    ('确认无副管', '确认副管'),
+])
+def test_changed_numbers_or_negations_are_not_reused(index, note, old, new):
+    assert old in note
+    assert index.lookup(note.replace(old, new), SCOPE) is None
+
+
+def test_missing_step_is_not_reused(index, note):
+    assert index.lookup(note.replace('18. 计数器械纱布无误\n', ''), SCOPE) is None
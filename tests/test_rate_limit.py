@@ -0,0 +1,62 @@
+"""限流与重试测试：Retry-After上限、令牌桶预约和异步并发等待"""
+
+import asyncio
+import time
+
+from rate_limit import AdaptiveConcurrency, RetryPolicy, TokenBucket
+
+
+def test_retry_after_not_capped_by_backoff_limit():
+    policy = RetryPolicy(max_delay=30.0, retry_after_max=300.0)
+    assert policy.delay(0, retry_after=120.0) == 120.0
+    assert policy.delay(0, retry_after=3600.0) == 300.0
+    assert policy.delay(0, retry_after=-1.0) == 0.0
+
+
+def test_backoff_without_retry_after_stays_under_max_delay():
+    policy = RetryPolicy(base_delay=1.0, max_delay=2.0)
+    assert all(0.0 <= policy.delay(10) <= 2.0 for _ in range(100))
+
+
+def test_token_bucket_reservations_queue_up():
+    bucket = TokenBucket(rate_per_minute=60, capacity=1)
+    assert bucket.reserve() == 0.0
+    assert 0.9 < bucket.reserve() <= 1.0
+    assert 1.9 < bucket.reserve() <= 2.0
+
+
+def test_async_acquire_wakes_on_release_without_polling():
+    concurrency = AdaptiveConcurrency(max_limit=1)
+
+    async def scenario():
+        await concurrency.aacquire()
+        waiter = asyncio.create_task(concurrency.aacquire())
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        assert len(concurrency._async_waiters) == 1
+
+        started = time.monotonic()
+        concurrency.release()
+        await asyncio.wait_for(waiter, 1.0)
+        assert time.monotonic() - started < 0.05
+        assert concurrency.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_async_waiter_does_not_take_a_slot():
+    concurrency = AdaptiveConcurrency(max_limit=1)
+
+    async def scenario():
+        await concurrency.aacquire()
+        waiter = asyncio.create_task(concurrency.aacquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert concurrency._async_waiters == []
+
+        concurrency.release()
+        assert concurrency.in_flight == 0
+        await asyncio.wait_for(concurrency.aacquire(), 1.0)
+
+    asyncio.run(scenario())
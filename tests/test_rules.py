@@ -0,0 +1,96 @@
+"""规则预检测试：否定或并发症表述不得被规则直接判定为规范"""
+
+import os
+
+import pytest
+
+from rules import triage_record
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'samples')
+
+CLEAN_CHOLECYSTECTOMY = """\
+1. 常规消毒铺巾，建立气腹，置入腹腔镜
+2. 解剖Calot三角，显露胆囊动脉和胆囊管
+3. 钛夹夹闭胆囊动脉后切断
+4. 钛夹夹闭胆囊管后切断
+5. 剥离胆囊，胆囊床电凝止血
+6. 清点器械纱布无误
+7. 逐层缝合戳孔切口
+"""
+
+
+def test_clean_note_is_conclusive():
+    result = triage_record(CLEAN_CHOLECYSTECTOMY, "cholecystectomy")
+    assert result.conclusive
+    assert result.as_evaluation()['risk_level'] == 'Low'
+
+
+@pytest.mark.parametrize("original, replacement", [
+    ("钛夹夹闭胆囊动脉后切断", "胆囊动脉未能夹闭，出血明显"),
+    ("钛夹夹闭胆囊管后切断", "胆囊管撕裂后切断"),
+    ("胆囊床电凝止血", "胆囊床电凝止血困难"),
+    ("清点器械纱布无误", "未清点器械纱布"),
+])
+def test_negated_step_is_not_resolved_locally(original, replacement):
+    note = CLEAN_CHOLECYSTECTOMY.replace(original, replacement)
+    result = triage_record(note, "cholecystectomy")
+    assert not result.conclusive
+    assert any(replacement in step for step in result.flagged)
+    assert result.hints()
+
+
+def test_negated_step_does_not_satisfy_checkpoint():
+    note = CLEAN_CHOLECYSTECTOMY.replace("钛夹夹闭胆囊动脉后切断", "胆囊动脉未能夹闭")
+    result = triage_record(note, "cholecystectomy")
+    assert "胆囊动脉处理" in result.missing
+
+
+def test_negated_step_is_flagged_even_if_repeated_correctly():
+    note = CLEAN_CHOLECYSTECTOMY + "8. 胆囊动脉夹闭失败，再次夹闭胆囊动脉\n"
+    assert not triage_record(note, "cholecystectomy").conclusive
+
+
+def test_blood_loss_does_not_satisfy_hemostasis():
+    note = CLEAN_CHOLECYSTECTOMY.replace("胆囊床电凝止血", "剥离胆囊").replace(
+        "清点器械纱布无误", "清点器械纱布无误，术中出血约800ml")
+    result = triage_record(note, "cholecystectomy")
+    assert "止血确认" in result.missing
+    assert not result.conclusive
+
+
+def test_atraumatic_instrument_is_not_a_negation():
+    note = CLEAN_CHOLECYSTECTOMY.replace("解剖Calot三角", "无损伤钳牵引胆囊，解剖Calot三角")
+    assert triage_record(note, "cholecystectomy").conclusive
+
+
+def _sample(name):
+    with open(os.path.join(SAMPLES_DIR, f"{name}.txt"), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name, surgery_type", [("appendectomy_01", "appendectomy"),
+                                                ("cholecystectomy_01", "cholecystectomy")])
+def test_clean_sample_notes_pass_triage(name, surgery_type):
+    result = triage_record(_sample(name), surgery_type)
+    assert result.conclusive
+    assert result.flagged == ()
+
+
+def test_sample_without_hemostasis_goes_to_model():
+    result = triage_record(_sample("gastric_perforation_01"), "gastric_perforation")
+    assert result.flagged == ()
+    assert result.missing == ("止血确认",)
+    assert not result.conclusive
+
+
+@pytest.mark.parametrize("line", ["8. 检查缝合处，确认无渗漏", "8. 未见活动性出血", "出血量：约50ml",
+                                  "术中出血约100毫升"])
+def test_ruled_out_problems_and_normal_blood_loss_are_not_flagged(line):
+    assert triage_record(CLEAN_CHOLECYSTECTOMY + line + "\n", "cholecystectomy").conclusive
+
+
+@pytest.mark.parametrize("line", ["出血量：约300ml", "术中出血约150毫升", "8. 胆囊床渗血，无法止血"])
+def test_large_blood_loss_and_unresolved_problems_are_flagged(line):
+    result = triage_record(CLEAN_CHOLECYSTECTOMY + line + "\n", "cholecystectomy")
+    assert result.flagged == (line,)
+    assert not result.conclusive
@@ -0,0 +1,79 @@
+"""优先级调度测试：交互任务优先，批量任务不占用保留的工作线程"""
+
+import threading
+import time
+
+import pytest
+
+from service import PriorityScheduler
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_bulk_never_occupies_reserved_workers(release):
+    scheduler = PriorityScheduler(workers=3, reserved=1)
+    bulk = [scheduler.submit(lambda: release.wait(5), 'bulk') for _ in range(5)]
+    _wait_until(lambda: scheduler.stats()['running']['bulk'] == 2)
+    time.sleep(0.02)
+    assert scheduler.stats()['running']['bulk'] == 2
+    assert scheduler.stats()['queued']['bulk'] == 3
+
+    # 批量积压时交互任务仍由保留线程立即执行
+    assert scheduler.submit(lambda: 'done', 'interactive').result(1) == 'done'
+
+    release.set()
+    for future in bulk:
+        future.result(5)
+    scheduler.shutdown()
+
+
+def test_interactive_runs_before_queued_bulk(release):
+    scheduler = PriorityScheduler(workers=1, reserved=0)
+    order = []
+    blocker = scheduler.submit(lambda: release.wait(5), 'bulk')
+    _wait_until(lambda: scheduler.stats()['running']['bulk'] == 1)
+
+    futures = [scheduler.submit(lambda: order.append('bulk-1'), 'bulk'),
+               scheduler.submit(lambda: order.append('interactive-1'), 'interactive'),
+               scheduler.submit(lambda: order.append('bulk-2'), 'bulk'),
+               scheduler.submit(lambda: order.append('interactive-2'), 'interactive')]
+    release.set()
+    blocker.result(5)
+    for future in futures:
+        future.result(5)
+    scheduler.shutdown()
+
+    assert order == ['interactive-1', 'interactive-2', 'bulk-1', 'bulk-2']
+
+
+def test_closed_scheduler_rejects_and_cancels_queued(release):
+    scheduler = PriorityScheduler(workers=1, reserved=0)
+    running = scheduler.submit(lambda: release.wait(5), 'interactive')
+    _wait_until(lambda: scheduler.stats()['running']['interactive'] == 1)
+    queued = scheduler.submit(lambda: 'never', 'bulk')
+
+    scheduler.shutdown(wait=False)
+    assert queued.cancelled()
+    with pytest.raises(RuntimeError):
+        scheduler.submit(lambda: None)
+    release.set()
+    assert running.result(5) is True
+
+
+def test_unknown_priority_is_rejected():
+    scheduler = PriorityScheduler(workers=1, reserved=0)
+    with pytest.raises(ValueError):
+        scheduler.submit(lambda: None, 'urgent')
+    scheduler.shutdown()
@@ -0,0 +1,94 @@
+"""评估服务测试：请求校验、批量请求的逐条超时和请求头错误"""
+
+import json
+import socket
+import threading
+
+import pytest
+
+from service import EvaluationServer, EvaluationService, PriorityScheduler, RequestError, _parse_record
+
+NOTE = "1. 常规消毒铺巾\n2. 切开腹膜，探查腹腔\n3. 逐层缝合切口"
+RESULT = {'total_score': 90, 'risks': [], 'suggestions': [], 'risk_level': 'Low'}
+
+
+@pytest.mark.parametrize('entry, message', [
+    ({'type': 'general'}, '缺少 text 字段'),
+    ({'text': 42}, 'text 字段必须是非空字符串'),
+    ({'text': '   '}, 'text 字段必须是非空字符串'),
+])
+def test_parse_record_reports_why_text_is_rejected(entry, message):
+    with pytest.raises(RequestError, match=message):
+        _parse_record(entry, 0)
+
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+@pytest.fixture
+def service(release):
+    def evaluate(steps, surgery_type, refresh=False):
+        if 'stuck' in steps:
+            release.wait(5)
+        return RESULT
+
+    scheduler = PriorityScheduler(workers=2, reserved=0)
+    yield EvaluationService(evaluate, scheduler, timeout=0.2)
+    release.set()
+    scheduler.shutdown()
+
+
+def test_stuck_record_times_out_without_blocking_batch(service):
+    status, response = service.evaluate_batch({'records': [
+        {'id': 'a', 'text': NOTE},
+        {'id': 'b', 'text': NOTE + '\nstuck'},
+        {'id': 'c', 'text': NOTE},
+    ]})
+    assert status == 200
+    assert [line['status'] for line in response['results']] == ['ok', 'error', 'ok']
+    assert '评估超时' in response['results'][1]['error']
+    assert response['summary']['failed'] == 1
+
+
+@pytest.fixture
+def server(service):
+    server = EvaluationServer(('127.0.0.1', 0), service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _post(server, headers, body=b''):
+    with socket.create_connection(server.server_address[:2], timeout=5) as sock:
+        request = "POST /evaluate HTTP/1.1\r\nHost: test\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()) + "\r\n"
+        sock.sendall(request.encode('ascii') + body)
+        response = b''
+        while chunk := sock.recv(65536):
+            response += chunk
+    head, _, payload = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(payload)
+
+
+@pytest.mark.parametrize('headers, status', [
+    ({}, 411),
+    ({'Content-Length': 'abc'}, 400),
+    ({'Content-Length': '-5'}, 400),
+])
+def test_invalid_content_length_is_rejected(server, headers, status):
+    code, payload = _post(server, headers)
+    assert code == status
+    assert payload['status'] == 'error'
+
+
+def test_valid_request_is_evaluated(server):
+    body = json.dumps({'text': NOTE}).encode('utf-8')
+    code, payload = _post(server, {'Content-Length': len(body), 'Connection': 'close'}, body)
+    assert code == 200
+    assert payload['result'] == RESULT
@@ -0,0 +1,114 @@
+"""请求合并测试：并发的相同请求只执行一次，取消只影响各自的等待"""
+
+import asyncio
+import threading
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'total_score': 90}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', work)))
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', work)))
+                 for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.stats()['coalesced'] < 3:
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 4 and all(r is results[0] for r in results)
+    assert flight.stats() == {'executed': 1, 'coalesced': 3, 'in_flight': 0}
+
+
+def test_error_is_shared_and_key_is_released():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('上游错误')
+
+    with pytest.raises(ValueError):
+        flight.do('k', fail)
+    assert flight.do('k', lambda: 1) == 1
+    assert flight.stats()['executed'] == 2
+
+
+def test_async_callers_share_one_task():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do('k', work) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [42] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {'executed': 1, 'coalesced': 4, 'in_flight': 0}
+
+
+def test_async_cancel_only_leaves_own_wait():
+    flight = AsyncSingleFlight()
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(0.05)
+            return 'ok'
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def scenario():
+        first = asyncio.create_task(flight.do('k', work))
+        second = asyncio.create_task(flight.do('k', work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == 'ok'
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(scenario())
+    assert cancelled == []
+
+
+def test_async_last_waiter_leaving_cancels_task():
+    flight = AsyncSingleFlight()
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def scenario():
+        with pytest.raises(TimeoutError):
+            await asyncio.wait_for(flight.do('k', work), 0.01)
+        await asyncio.sleep(0)
+        assert flight.stats()['in_flight'] == 0
+
+    asyncio.run(scenario())
+    assert cancelled == [1]